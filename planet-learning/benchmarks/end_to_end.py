@@ -0,0 +1,252 @@
+"""End-to-end benchmark of the pipeline stages
+
+Generates a synthetic data folder of `--objects` objects (see `synthetic.generate_dataset()`) and runs on it, one after another,
+`extracttic`, `catascript` (the catalog files), `process_confirmed` and `make_light_curves_plot`, against a SQLite database
+or the database given by `--engine-url`, e.g. a local Postgres.
+Each stage runs in a fresh process, so that its peak memory is measured alone. The throughput, peak memory and number of
+round trips to the database of each stage are printed, and saved in the JSON file given by `--output`.
+
+Run it from the root of the repository with :
+    python -m planet-learning.benchmarks.end_to_end --objects 10000 --objects 100000 --objects 1000000
+
+"""
+import argparse
+import json
+import os
+import resource
+import shutil
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from os.path import isfile, join
+
+from .synthetic import generate_dataset
+
+STAGES = ('extracttic', 'catascript', 'confirmed', 'plot_to_file')
+
+
+def get_peak_memory():
+    """Peak resident memory of the process and of its terminated children.
+
+    Returns
+    -------
+    float
+        the largest of both, in MB
+
+    """
+    # ru_maxrss is in kB on Linux, in bytes on macOS
+    unit = 1024 ** 2 if sys.platform == 'darwin' else 1024
+    return max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss, resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss) / unit
+
+
+def run_stage(stage, environment, n_workers):
+    """Run a stage of the pipeline, in the process of the benchmark of this stage.
+
+    The modules of the pipeline are imported here, once the environment is set.
+
+    Parameters
+    ----------
+    stage: str
+        name of the stage, one of STAGES
+    environment: dict
+        the environment variables of the dataset
+    n_workers: int
+        number of worker processes of the stage
+
+    Returns
+    -------
+    (float, float, dict)
+        the duration in seconds, the peak memory in MB and the run report of the measures of the stage
+
+    """
+    os.environ.update(environment)
+    from ..pipeline import metrics
+
+    processed_dir_path = join(environment['DATA_ROOT'], environment['PROCESSED_DIR'])
+    index_path = join(processed_dir_path, environment['EXTRACTED_TICS_FILE'])
+
+    start = time.perf_counter()
+    if stage == 'extracttic':
+        from ..extracttic.extracttic import extracttic
+        extracttic(join(environment['DATA_ROOT'], environment['LIGHT_CURVES_DIR']), index_path, force_extract=True, n_workers=n_workers)
+
+    elif stage == 'catascript':
+        from ..catascript.base import Base, get_engine
+        from ..catascript.catascript import display_stats, get_catalog_files, initialize_database, load_TIC_index, process_catalog_files
+        # The database of a previous run is emptied
+        Base.metadata.drop_all(get_engine())
+        initialize_database()
+        process_catalog_files(get_catalog_files(), load_TIC_index(), int(environment['DB_BATCH_SIZE']), n_workers)
+        display_stats()
+
+    elif stage == 'confirmed':
+        from ..catascript.confirmed import process_confirmed
+        process_confirmed()
+
+    elif stage == 'plot_to_file':
+        from ..plot_to_file.make_light_curves_plot import make_light_curves_plot
+        # The plots of a previous run are removed, with their render cache
+        shutil.rmtree(join(processed_dir_path, 'plots_to_file'), ignore_errors=True)
+        make_light_curves_plot(processed_dir_path)
+
+    else:
+        raise ValueError("Unknown stage {}".format(stage))
+
+    return time.perf_counter() - start, get_peak_memory(), metrics.get_report()
+
+
+def sum_measures(report, kind, name, **labels):
+    """Sum the values of the measures of a run report having a name and some labels.
+
+    Parameters
+    ----------
+    report: dict
+        the run report, see `pipeline.metrics.get_report()`
+    kind: str
+        'counters' or 'gauges'
+    name: str
+        name of the measures
+    labels:
+        labels the measures must have
+
+    Returns
+    -------
+    float
+        the sum, 0 if there is no such measure
+
+    """
+    return sum(
+        measure['value'] for measure in report[kind]
+        if measure['name'] == name and all(measure['labels'].get(label) == str(value) for (label, value) in labels.items())
+    )
+
+
+def count_items(stage, dataset, report):
+    """Number of items processed by a stage, to compute its throughput.
+
+    Parameters
+    ----------
+    stage: str
+        name of the stage
+    dataset: dict
+        the description of the dataset, see `synthetic.generate_dataset()`
+    report: dict
+        the run report of the stage
+
+    Returns
+    -------
+    (int, str)
+        the number of items and their unit
+
+    """
+    if stage == 'extracttic':
+        return dataset['light_curves'], 'files'
+    if stage == 'catascript':
+        return dataset['catalog_entries'], 'rows'
+    if stage == 'confirmed':
+        return int(sum_measures(report, 'gauges', 'confirmed_planets', status='read')), 'planets'
+    return int(sum_measures(report, 'counters', 'plots_total')), 'plots'
+
+
+def benchmark_scale(n_objects, args):
+    """Generate the dataset of a scale if needed, and run every stage on it.
+
+    Parameters
+    ----------
+    n_objects: int
+        number of objects having a light curve
+    args: argparse.Namespace
+        the options of the benchmark
+
+    Returns
+    -------
+    list of dict
+        the results of the stages
+
+    """
+    data_root = join(args.dir, "objects_{}".format(n_objects))
+    parameters = {'objects': n_objects, 'sectors': args.sectors, 'points': args.points, 'seed': args.seed}
+
+    # The dataset of a previous benchmark is kept if it was generated with the same parameters
+    dataset_path = join(data_root, 'dataset.json')
+    dataset = None
+    if isfile(dataset_path):
+        with open(dataset_path) as dataset_file:
+            dataset = json.load(dataset_file)
+        if any(dataset.get(key) != value for (key, value) in parameters.items()):
+            dataset = None
+
+    if dataset is None:
+        shutil.rmtree(data_root, ignore_errors=True)
+        print("Generating {} objects in {} ...".format(n_objects, data_root), flush=True)
+        start = time.perf_counter()
+        dataset = generate_dataset(data_root, n_objects, n_sectors=args.sectors, n_points=args.points, seed=args.seed)
+        print("{} light curves and {} catalog entries generated in {:.1f} s".format(dataset['light_curves'], dataset['catalog_entries'], time.perf_counter() - start))
+
+    environment = dict(dataset['environment'])
+    environment.update({
+        'ENGINE_URL': args.engine_url or "sqlite:///{}".format(join(os.path.abspath(data_root), 'catalog.sqlite')),
+        'DB_BATCH_SIZE': str(args.batch_size),
+        'RE_LAUNCH': '1',
+        'PLOT_TO_FILE': '1',
+    })
+
+    results = []
+    for stage in STAGES:
+        # A fresh process for each stage, not inheriting the memory of the previous ones
+        with ProcessPoolExecutor(max_workers=1, mp_context=get_context('spawn')) as executor:
+            (duration, peak_memory, report) = executor.submit(run_stage, stage, environment, args.workers).result()
+
+        (nb_items, unit) = count_items(stage, dataset, report)
+        results.append({
+            'objects': n_objects, 'stage': stage, 'seconds': duration, 'items': nb_items, 'unit': unit,
+            'items_per_second': nb_items / max(duration, 1e-6), 'peak_memory_mb': peak_memory,
+            'db_round_trips': int(sum_measures(report, 'counters', 'db_round_trips_total')), 'report': report,
+        })
+
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--objects', type=int, action='append', help="number of objects having a light curve, repeat for several scales (default 10000)")
+    parser.add_argument('--sectors', type=int, default=2, help="number of sectors")
+    parser.add_argument('--points', type=int, default=1000, help="number of samples of the light curves")
+    parser.add_argument('--seed', type=int, default=0, help="seed of the random generator")
+    parser.add_argument('--dir', help="folder of the datasets, kept between runs. A temporary folder removed at the end if not given.")
+    parser.add_argument('--engine-url', help="URL of the database, emptied at each scale. A SQLite file in the dataset folder if not given.")
+    parser.add_argument('--workers', type=int, default=1, help="number of worker processes of the stages")
+    parser.add_argument('--batch-size', type=int, default=1000, help="number of entries inserted at once in the database")
+    parser.add_argument('--output', help="JSON file to save the results in")
+    args = parser.parse_args()
+
+    temporary_dir = None
+    if args.dir is None:
+        temporary_dir = tempfile.mkdtemp(prefix='planet-learning-benchmark-')
+        args.dir = temporary_dir
+
+    try:
+        results = []
+        for n_objects in args.objects or [10000]:
+            scale_results = benchmark_scale(n_objects, args)
+            results += scale_results
+
+            print("{:>10}{:>14}{:>12}{:>20}{:>16}{:>16}".format("objects", "stage", "time (s)", "throughput", "peak mem (MB)", "db round trips"))
+            for result in scale_results:
+                print("{:>10}{:>14}{:>12.2f}{:>20}{:>16.0f}{:>16}".format(
+                    result['objects'], result['stage'], result['seconds'],
+                    "{:.0f} {}/s".format(result['items_per_second'], result['unit']), result['peak_memory_mb'], result['db_round_trips']))
+
+        if args.output:
+            with open(args.output, 'w') as output_file:
+                json.dump({'parameters': vars(args), 'results': results}, output_file, indent=1)
+
+    finally:
+        if temporary_dir is not None:
+            shutil.rmtree(temporary_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
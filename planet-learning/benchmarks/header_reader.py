@@ -0,0 +1,78 @@
+"""Benchmark of the light curves header readers of extracttic
+
+Compares the time needed to extract the metadata of synthetic light curves files with astropy's `fits.open`
+and with the header-only reader of `extracttic.fits_header`.
+
+Run it from the root of the repository with :
+    python -m planet-learning.benchmarks.header_reader --files 1000
+
+"""
+import argparse
+import os
+import tempfile
+import time
+from os.path import join
+
+from ..extracttic.extracttic import METADATA_KEYWORDS, read_header_with_astropy
+from ..extracttic.fits_header import read_primary_header
+from .synthetic import write_light_curve
+
+
+def time_reader(reader, paths, repeats):
+    """Time a reader over a list of files.
+
+    Parameters
+    ----------
+    reader: callable
+        function taking a path and returning the extracted fields
+    paths: list of path-like objects
+        the files to read
+    repeats: int
+        number of passes over the files, the best one is kept
+
+    Returns
+    -------
+    (float, list)
+        the best duration of a pass in seconds and the extracted fields of each file
+
+    """
+    best = float('inf')
+    for _ in range(repeats):
+        start = time.perf_counter()
+        results = [reader(path) for path in paths]
+        best = min(best, time.perf_counter() - start)
+
+    return best, results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--files', type=int, default=1000, help="number of synthetic light curves")
+    parser.add_argument('--points', type=int, default=20000, help="number of samples per light curve")
+    parser.add_argument('--repeats', type=int, default=3, help="number of passes, the best one is kept")
+    parser.add_argument('--dir', default=None, help="folder to write the files to, a temporary one by default")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(dir=args.dir) as tmp_dir:
+        paths = []
+        for i in range(args.files):
+            path = join(tmp_dir, 'tess_{:016d}-s0001_lc.fits'.format(i))
+            write_light_curve(path, ticid=100000 + i, sector=1, n_points=args.points)
+            paths.append(path)
+        size = sum(os.path.getsize(path) for path in paths)
+        print("{} files written, {:.1f} MB".format(args.files, size / 1e6))
+
+        astropy_time, astropy_results = time_reader(read_header_with_astropy, paths, args.repeats)
+        header_time, header_results = time_reader(lambda path: read_primary_header(path, METADATA_KEYWORDS), paths, args.repeats)
+
+        if astropy_results != header_results:
+            raise RuntimeError("The readers do not extract the same metadata")
+
+        print("{:<20}{:>12}{:>14}".format("reader", "time (s)", "files / s"))
+        for name, duration in (("fits.open", astropy_time), ("read_primary_header", header_time)):
+            print("{:<20}{:>12.3f}{:>14.0f}".format(name, duration, args.files / duration))
+        print("speedup : {:.1f}x".format(astropy_time / header_time))
+
+
+if __name__ == '__main__':
+    main()
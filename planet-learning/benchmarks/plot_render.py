@@ -0,0 +1,117 @@
+"""Benchmark of the rendering modes of plot_to_file
+
+Renders synthetic light curves with each rendering mode and format of `plot_to_file.make_light_curves_plot`,
+and compares the time per plot and the size of the files with the default mode (every sample as a vector point in a svg).
+The faithfulness of each mode is measured on png renderings : the fraction of pixels differing from the default mode.
+
+Run it from the root of the repository with :
+    python -m planet-learning.benchmarks.plot_render --files 20
+
+"""
+import argparse
+import os
+import tempfile
+import time
+from os.path import join
+
+import numpy as np
+from matplotlib.image import imread
+
+from ..plot_to_file.make_light_curves_plot import PLOT_FORMATS, PLOT_MODES, get_plot_path, get_render_options, make_and_save_light_curve
+from .synthetic import write_light_curve
+
+
+def render_all(TICs, paths, processed_dir_path, options):
+    """Render the plots of all the light curves with the given options.
+
+    Parameters
+    ----------
+    TICs: list of int
+        the TIC IDs of the light curves
+    paths: list of path-like objects
+        the light curves files
+    processed_dir_path: path-like object
+        folder holding the `plots_to_file` folder
+    options: dict
+        the rendering options
+
+    Returns
+    -------
+    (float, float)
+        the mean duration of a plot in seconds and the mean size of a plot file in bytes
+
+    """
+    start = time.perf_counter()
+    for (TIC, path) in zip(TICs, paths):
+        make_and_save_light_curve(TIC, (path, 'TIC {}'.format(TIC), 'Transit'), processed_dir_path, options)
+    duration = time.perf_counter() - start
+
+    size = sum(os.path.getsize(get_plot_path(processed_dir_path, TIC, options)) for TIC in TICs)
+    return duration / len(TICs), size / len(TICs)
+
+
+def differing_pixels(path, reference_path):
+    """Fraction of the pixels differing between two png images.
+
+    Parameters
+    ----------
+    path: path-like object
+        the image to compare
+    reference_path: path-like object
+        the reference image
+
+    Returns
+    -------
+    float
+        the fraction of differing pixels
+
+    """
+    image = imread(path)
+    reference = imread(reference_path)
+    if image.shape != reference.shape:
+        return 1.
+    return float(np.mean(np.any(np.abs(image - reference) > 1. / 255, axis=-1)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--files', type=int, default=20, help="number of synthetic light curves")
+    parser.add_argument('--points', type=int, default=20000, help="number of samples per light curve")
+    parser.add_argument('--dir', default=None, help="folder to write the files to, a temporary one by default")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(dir=args.dir) as tmp_dir:
+        TICs = [100000 + i for i in range(args.files)]
+        paths = []
+        for TIC in TICs:
+            path = join(tmp_dir, 'tess_{:016d}-s0001_lc.fits'.format(TIC))
+            write_light_curve(path, ticid=TIC, sector=1, n_points=args.points)
+            paths.append(path)
+
+        results = {}
+        for plot_format in PLOT_FORMATS:
+            for mode in PLOT_MODES:
+                processed_dir_path = join(tmp_dir, '{}_{}'.format(mode, plot_format))
+                os.makedirs(join(processed_dir_path, 'plots_to_file'))
+                options = get_render_options(mode, plot_format)
+                results[(mode, plot_format)] = (processed_dir_path, options) + render_all(TICs, paths, processed_dir_path, options)
+
+        (reference_time, reference_size) = results[('points', 'svg')][2:]
+        (reference_dir_path, reference_options) = results[('points', 'png')][:2]
+
+        print("{:<12}{:>8}{:>14}{:>12}{:>14}{:>10}{:>18}".format("mode", "format", "time (ms)", "speedup", "size (kB)", "ratio", "pixels differing"))
+        for ((mode, plot_format), (processed_dir_path, options, duration, size)) in results.items():
+            if plot_format == 'png':
+                difference = np.mean([
+                    differing_pixels(get_plot_path(processed_dir_path, TIC, options), get_plot_path(reference_dir_path, TIC, reference_options))
+                    for TIC in TICs
+                ])
+                difference = "{:.3%}".format(difference)
+            else:
+                difference = "-"
+            print("{:<12}{:>8}{:>14.1f}{:>11.1f}x{:>14.1f}{:>9.1f}x{:>18}".format(
+                mode, plot_format, duration * 1e3, reference_time / duration, size / 1e3, reference_size / size, difference))
+
+
+if __name__ == '__main__':
+    main()
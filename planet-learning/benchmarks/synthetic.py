@@ -0,0 +1,426 @@
+"""Generation of synthetic TESS data for the benchmarks
+
+The generated light curves `.fits` files mimic the structure of the TESS 2-minutes cadence light curves :
+a primary HDU holding the object metadata, a `LIGHTCURVE` binary table and an `APERTURE` image.
+Find more information about the TESS `.fits` files here : https://archive.stsci.edu/files/live/sites/mast/files/home/missions-and-data/active-missions/tess/_documents/EXP-TESS-ARC-ICD-TM-0014.pdf
+
+`generate_dataset()` writes a whole data folder, as found on the NFS : the sector folders of light curves, the TIC catalog files
+and the catalog of confirmed planets, whose hosts are at the position of some of the objects.
+
+"""
+import io
+import json
+import os
+from os.path import join
+
+import numpy as np
+from astropy.io import fits
+
+# Number of samples in a 2-minutes cadence sector
+SECTOR_LENGTH = 20000
+# Duration of a sector, in days
+SECTOR_DURATION = 27.4
+
+# Columns of the generated TIC catalog files, as listed in LIST_DB_FIELDS
+CATALOG_FIELDS = ('ID', 'version', 'HIP', 'TYC', 'UCAC', 'TWOMASS', 'SDSS', 'ALLWISE', 'GAIA', 'APASS', 'KIC', 'objType', 'typeSrc', 'ra', 'dec')
+# Identifiers of other missions among them, as listed in OTHER_MISSIONS_IDS
+OTHER_MISSIONS_FIELDS = ('HIP', 'TYC', 'UCAC', 'TWOMASS', 'SDSS', 'ALLWISE', 'GAIA', 'APASS', 'KIC')
+# Number of columns following them in the TIC catalog files, unused by catascript
+CATALOG_EXTRA_COLUMNS = 100
+# Columns of the generated confirmed planets catalog, as listed in LIST_CONFIRMED_FIELDS
+CONFIRMED_FIELDS = ('Host_name', 'Planet_Letter', 'Planet_Name', 'Discovery_Method', 'Controversial_flag', 'Number_planets_in_system', 'Orbital_Period',
+                    'Ra_sex', 'Ra_deg', 'Dec_sex', 'Dec_deg', 'HIP_Name', 'Proper_Motion_RA', 'Proper_Motion_DEC')
+
+
+def make_primary_header(ticid, sector, ticver, rng):
+    """Build a primary header with the keywords found in TESS light curves.
+
+    Parameters
+    ----------
+    ticid: int
+        TESS Input Catalog ID of the object
+    sector: int
+        observation sector
+    ticver: int
+        version of the TESS Input Catalog
+    rng: numpy.random.RandomState
+        random generator used for the object properties
+
+    Returns
+    -------
+    astropy.io.fits.Header
+        the header
+
+    """
+    header = fits.Header()
+    header['ORIGIN'] = ('NASA/Ames', 'institution responsible for creating this file')
+    header['DATE'] = ('2019-05-06', 'file creation date.')
+    header['TSTART'] = (1325.3 + (sector - 1) * SECTOR_DURATION, 'observation start time in TJD')
+    header['TSTOP'] = (1352.7 + (sector - 1) * SECTOR_DURATION, 'observation stop time in TJD')
+    header['DATE-OBS'] = ('2018-07-25T19:29:42.708Z', 'TSTART as UTC calendar date')
+    header['DATE-END'] = ('2018-08-22T16:14:51.276Z', 'TSTOP as UTC calendar date')
+    header['CREATOR'] = ('11925 LightCurveExporterPipelineModule', 'pipeline job and program')
+    header['PROCVER'] = ('spoc-3.3.37-20181201', 'SW version')
+    header['FILEVER'] = ('1.0', 'file format version')
+    header['TIMVERSN'] = ('OGIP/93-003', 'OGIP memo number for file format')
+    header['TELESCOP'] = ('TESS', 'telescope')
+    header['INSTRUME'] = ('TESS Photometer', 'detector type')
+    header['DATA_REL'] = (4, 'data release version number')
+    header['OBJECT'] = ('TIC {}'.format(ticid), 'string version of target id')
+    header['TICID'] = (ticid, 'unique tess target identifier')
+    header['SECTOR'] = (sector, 'Observing sector')
+    header['CAMERA'] = (int(rng.randint(1, 5)), 'Camera number')
+    header['CCD'] = (int(rng.randint(1, 5)), 'CCD chip number')
+    header['PXTABLE'] = (129, 'pixel table id')
+    header['RADESYS'] = ('ICRS', 'reference frame of celestial coordinates')
+    header['RA_OBJ'] = (round(float(rng.uniform(0, 360)), 6), '[deg] right ascension')
+    header['DEC_OBJ'] = (round(float(rng.uniform(-90, 90)), 6), '[deg] declination')
+    header['EQUINOX'] = (2000.0, 'equinox of celestial coordinate system')
+    header['PMRA'] = (round(float(rng.normal(0, 10)), 6), '[mas/yr] RA proper motion')
+    header['PMDEC'] = (round(float(rng.normal(0, 10)), 6), '[mas/yr] Dec proper motion')
+    header['PMTOTAL'] = (round(float(rng.uniform(0, 20)), 6), '[mas/yr] total proper motion')
+    header['TESSMAG'] = (round(float(rng.uniform(6, 16)), 6), '[mag] TESS magnitude')
+    header['TEFF'] = (round(float(rng.uniform(3000, 7000)), 6), '[K] Effective temperature')
+    header['LOGG'] = (round(float(rng.uniform(3.5, 5)), 6), '[cm/s2] log10 surface gravity')
+    header['MH'] = (round(float(rng.normal(0, 0.2)), 6), '[log10([M/H])] metallicity')
+    header['RADIUS'] = (round(float(rng.uniform(0.5, 2)), 6), '[solar radii] stellar radius')
+    header['TICVER'] = (ticver, 'TICVER')
+    header['CRMITEN'] = (True, 'spacecraft cosmic ray mitigation enabled')
+    header['CRBLKSZ'] = (10, '[exposures] s/c cosmic ray mitigation block siz')
+    header['CRSPOC'] = (False, 'SPOC cosmic ray cleaning enabled')
+    header['CHECKSUM'] = ('ZAgPa5ZNZAfNa5ZN', 'HDU checksum updated 2019-05-06T19:22:04Z')
+
+    return header
+
+
+def make_light_curve_table(sector, n_points, rng):
+    """Build a `LIGHTCURVE` binary table of Gaussian noise with some gaps and flagged cadences.
+
+    Parameters
+    ----------
+    sector: int
+        observation sector, used to offset the time stamps
+    n_points: int
+        number of samples
+    rng: numpy.random.RandomState
+        random generator
+
+    Returns
+    -------
+    astropy.io.fits.BinTableHDU
+        the table
+
+    """
+    t_start = 1325.3 + (sector - 1) * SECTOR_DURATION
+    time = np.linspace(t_start, t_start + SECTOR_DURATION, n_points)
+    sap_flux = rng.normal(10000., 20., n_points).astype(np.float32)
+    pdcsap_flux = rng.normal(10000., 10., n_points).astype(np.float32)
+    quality = np.zeros(n_points, dtype=np.int32)
+
+    # Gap of the data downlink in the middle of the sector
+    gap = slice(n_points // 2 - n_points // 40, n_points // 2 + n_points // 40)
+    time[gap] = np.nan
+    sap_flux[gap] = np.nan
+    pdcsap_flux[gap] = np.nan
+
+    # Some flagged cadences (e.g. momentum dumps)
+    flagged = rng.choice(n_points, size=n_points // 100, replace=False)
+    quality[flagged] = 32
+    pdcsap_flux[flagged] = np.nan
+
+    columns = [
+        fits.Column(name='TIME', format='D', unit='BJD - 2457000, days', array=time),
+        fits.Column(name='CADENCENO', format='J', array=np.arange(n_points, dtype=np.int32)),
+        fits.Column(name='SAP_FLUX', format='E', unit='e-/s', array=sap_flux),
+        fits.Column(name='SAP_FLUX_ERR', format='E', unit='e-/s', array=np.full(n_points, 20., dtype=np.float32)),
+        fits.Column(name='PDCSAP_FLUX', format='E', unit='e-/s', array=pdcsap_flux),
+        fits.Column(name='PDCSAP_FLUX_ERR', format='E', unit='e-/s', array=np.full(n_points, 10., dtype=np.float32)),
+        fits.Column(name='QUALITY', format='J', array=quality),
+    ]
+    return fits.BinTableHDU.from_columns(columns, name='LIGHTCURVE')
+
+
+def write_light_curve(path, ticid, sector, ticver=8, n_points=SECTOR_LENGTH, seed=None):
+    """Write a synthetic light curve `.fits` file.
+
+    Parameters
+    ----------
+    path: path-like object
+        path to the file to write
+    ticid: int
+        TESS Input Catalog ID of the object
+    sector: int
+        observation sector
+    ticver: int
+        version of the TESS Input Catalog
+    n_points: int
+        number of samples of the light curve
+    seed: int
+        seed of the random generator, defaults to the TICID
+
+    """
+    rng = np.random.RandomState(ticid if seed is None else seed)
+
+    primary = fits.PrimaryHDU(header=make_primary_header(ticid, sector, ticver, rng))
+    table = make_light_curve_table(sector, n_points, rng)
+    aperture = fits.ImageHDU(data=np.ones((11, 11), dtype=np.int32), name='APERTURE')
+
+    fits.HDUList([primary, table, aperture]).writeto(path, overwrite=True)
+
+
+def get_light_curve_name(ticid, sector):
+    """Name of the light curve file of an object, as in the TESS archive.
+
+    Parameters
+    ----------
+    ticid: int
+        TESS Input Catalog ID of the object
+    sector: int
+        observation sector
+
+    Returns
+    -------
+    str
+        the file name
+
+    """
+    return "tess2018206045859-s{:04d}-{:016d}-0120-s_lc.fits".format(sector, ticid)
+
+
+def make_light_curve_template(sector, ticver=8, n_points=SECTOR_LENGTH, seed=0):
+    """Build the content of a light curve file, to be written for many objects by `write_light_curve_from_template()`.
+
+    Parameters
+    ----------
+    sector: int
+        observation sector
+    ticver: int
+        version of the TESS Input Catalog
+    n_points: int
+        number of samples of the light curve
+    seed: int
+        seed of the random generator
+
+    Returns
+    -------
+    bytes
+        the content of the file, for the TICID 0
+
+    """
+    rng = np.random.RandomState(seed)
+
+    primary = fits.PrimaryHDU(header=make_primary_header(0, sector, ticver, rng))
+    table = make_light_curve_table(sector, n_points, rng)
+    aperture = fits.ImageHDU(data=np.ones((11, 11), dtype=np.int32), name='APERTURE')
+
+    content = io.BytesIO()
+    fits.HDUList([primary, table, aperture]).writeto(content)
+    return content.getvalue()
+
+
+def write_light_curve_from_template(path, template, ticid):
+    """Write a light curve file from a template, replacing the `TICID` and `OBJECT` cards of its header.
+
+    Much faster than `write_light_curve()`, the samples being the same for all the objects.
+
+    Parameters
+    ----------
+    path: path-like object
+        path to the file to write
+    template: bytes
+        the content given by `make_light_curve_template()`
+    ticid: int
+        TESS Input Catalog ID of the object
+
+    """
+    content = bytearray(template)
+    for card in (fits.Card('TICID', ticid, 'unique tess target identifier'), fits.Card('OBJECT', 'TIC {}'.format(ticid), 'string version of target id')):
+        # Cards are 80 characters long, with the keyword padded to 8 characters
+        start = template.index("{:<8}=".format(card.keyword).encode('ascii'))
+        content[start:start + 80] = card.image.encode('ascii')
+
+    with open(path, 'wb') as f:
+        f.write(content)
+
+
+def format_sexagesimal(degrees, hours=False):
+    """Format an angle in sexagesimal notation, as in the confirmed planets catalog.
+
+    Parameters
+    ----------
+    degrees: float
+        the angle, in degrees
+    hours: bool
+        True to format it in hours (right ascension)
+
+    Returns
+    -------
+    str
+        e.g. `05h32m41.35s` or `-05d22m34.2s`
+
+    """
+    value = abs(degrees) / 15. if hours else abs(degrees)
+    (units, minutes) = divmod(value * 60, 60)
+    (minutes, seconds) = divmod(minutes * 60, 60)
+    sign = '-' if degrees < 0 and not hours else ''
+    return "{}{:02d}{}{:02d}m{:05.2f}s".format(sign, int(units), 'h' if hours else 'd', int(minutes), seconds)
+
+
+def write_catalog_files(catalog_dir_path, catalog_ids, ra, dec, n_files, rng):
+    """Write the TIC catalog files, split by ID.
+
+    Parameters
+    ----------
+    catalog_dir_path: path-like object
+        path to the catalog folder
+    catalog_ids: numpy.ndarray
+        the sorted IDs of the catalog entries
+    ra: numpy.ndarray
+        their right ascension, in degrees
+    dec: numpy.ndarray
+        their declination, in degrees
+    n_files: int
+        number of files
+    rng: numpy.random.RandomState
+        random generator
+
+    """
+    os.makedirs(catalog_dir_path, exist_ok=True)
+    extra_columns = ",0.0" * CATALOG_EXTRA_COLUMNS
+    # Some entries have identifiers in other missions
+    has_hip = rng.uniform(size=len(catalog_ids)) < 0.01
+    has_gaia = rng.uniform(size=len(catalog_ids)) < 0.9
+
+    for (file_number, rows) in enumerate(np.array_split(np.arange(len(catalog_ids)), max(n_files, 1)), 1):
+        with open(join(catalog_dir_path, "tic_dec{:02d}.csv".format(file_number)), 'w') as catalog_file:
+            for row in rows:
+                ID = int(catalog_ids[row])
+                catalog_file.write("{},20190415,{},,,{:08d}+{:07d},,,{},,,STAR,tmgaia2,{:.8f},{:.8f}{}\n".format(
+                    ID, ID % 100000 if has_hip[row] else '', ID % 100000000, ID % 10000000, ID * 7 if has_gaia[row] else '', ra[row], dec[row], extra_columns))
+
+
+def write_confirmed_file(path, host_ids, ra, dec, n_unmatched, rng):
+    """Write the catalog of confirmed planets, with a header line.
+
+    A tenth of the hosts have a second planet. The hosts are placed at a fraction of arc second from their catalog entry.
+
+    Parameters
+    ----------
+    path: path-like object
+        path to the file to write
+    host_ids: numpy.ndarray
+        the IDs of the catalog entries hosting a planet
+    ra: numpy.ndarray
+        their right ascension, in degrees
+    dec: numpy.ndarray
+        their declination, in degrees
+    n_unmatched: int
+        number of hosts added away from any catalog entry
+    rng: numpy.random.RandomState
+        random generator
+
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    offset = 0.2 / 3600
+    # The unmatched hosts are close to the celestial poles, where no catalog entry is generated
+    host_ra = np.concatenate([ra + rng.uniform(-offset, offset, len(ra)), rng.uniform(0, 360, n_unmatched)])
+    host_dec = np.concatenate([dec + rng.uniform(-offset, offset, len(dec)), rng.uniform(89.99, 90, n_unmatched)])
+    host_names = ["Host {}".format(ID) for ID in host_ids] + ["Unmatched {}".format(i) for i in range(n_unmatched)]
+
+    with open(path, 'w') as confirmed_file:
+        confirmed_file.write(",".join(CONFIRMED_FIELDS) + "\n")
+        for (i, name) in enumerate(host_names):
+            n_planets = 2 if i % 10 == 0 else 1
+            for letter in 'bc'[:n_planets]:
+                confirmed_file.write("{0},{1},{0} {1},Transit,0,{2},{3:.5f},{4},{5:.7f},{6},{7:.7f},,{8:.3f},{9:.3f}\n".format(
+                    name, letter, n_planets, rng.uniform(0.5, 50), format_sexagesimal(host_ra[i], hours=True), host_ra[i],
+                    format_sexagesimal(host_dec[i]), host_dec[i], rng.normal(0, 10), rng.normal(0, 10)))
+
+
+def generate_dataset(data_root, n_objects, n_sectors=2, n_points=1000, revisit_fraction=0.1, catalog_rows_per_object=5,
+                     n_catalog_files=4, n_confirmed=None, seed=0):
+    """Write a synthetic data folder, with the structure of the NFS.
+
+    The objects having a light curve are drawn among the entries of the TIC catalog, each one being observed in a sector,
+    and a fraction of them in the next sector too. The light curves of a sector share the same samples.
+
+    Parameters
+    ----------
+    data_root: path-like object
+        path to the data folder to write
+    n_objects: int
+        number of objects having a light curve
+    n_sectors: int
+        number of sectors
+    n_points: int
+        number of samples of the light curves. A file takes about 36 bytes per sample.
+    revisit_fraction: float
+        fraction of the objects observed in two sectors
+    catalog_rows_per_object: int
+        number of entries of the TIC catalog per object having a light curve
+    n_catalog_files: int
+        number of TIC catalog files
+    n_confirmed: int
+        number of hosts of confirmed planets among the objects. Defaults to one per thousand objects, at least 5.
+    seed: int
+        seed of the random generator
+
+    Returns
+    -------
+    dict
+        the description of the dataset, also saved in `dataset.json` in the data folder :
+        the number of light curves files, catalog entries, confirmed planets, and the environment variables to process it
+
+    """
+    rng = np.random.RandomState(seed)
+    n_catalog = n_objects * catalog_rows_per_object
+    n_confirmed = max(5, n_objects // 1000) if n_confirmed is None else min(n_confirmed, n_objects)
+
+    # Catalog entries, uniformly distributed on the sky away from the poles
+    catalog_ids = np.sort(rng.choice(np.arange(10000, 10000 + 20 * n_catalog), n_catalog, replace=False))
+    ra = rng.uniform(0, 360, n_catalog)
+    dec = np.degrees(np.arcsin(rng.uniform(-0.99, 0.99, n_catalog)))
+    write_catalog_files(join(data_root, 'catalog'), catalog_ids, ra, dec, n_catalog_files, rng)
+
+    # Objects having a light curve
+    object_rows = np.sort(rng.choice(n_catalog, n_objects, replace=False))
+    sectors = rng.randint(1, n_sectors + 1, n_objects)
+    revisited = (rng.uniform(size=n_objects) < revisit_fraction) & (sectors < n_sectors)
+
+    n_files = 0
+    for sector in range(1, n_sectors + 1):
+        sector_path = join(data_root, 'light_curves', "sector_{}".format(sector))
+        os.makedirs(sector_path, exist_ok=True)
+        template = make_light_curve_template(sector, n_points=n_points, seed=seed + sector)
+        observed = (sectors == sector) | (revisited & (sectors == sector - 1))
+        for row in object_rows[observed]:
+            write_light_curve_from_template(join(sector_path, get_light_curve_name(int(catalog_ids[row]), sector)), template, int(catalog_ids[row]))
+        n_files += int(observed.sum())
+
+    # Hosts of confirmed planets
+    host_rows = np.sort(rng.choice(object_rows, n_confirmed, replace=False))
+    n_unmatched = max(1, n_confirmed // 10)
+    write_confirmed_file(join(data_root, 'confirmed', 'confirmed.csv'), catalog_ids[host_rows], ra[host_rows], dec[host_rows], n_unmatched, rng)
+
+    os.makedirs(join(data_root, 'processed'), exist_ok=True)
+
+    dataset = {
+        'objects': n_objects, 'sectors': n_sectors, 'points': n_points, 'light_curves': n_files, 'catalog_entries': n_catalog,
+        'catalog_files': n_catalog_files, 'confirmed_hosts': n_confirmed, 'unmatched_hosts': n_unmatched, 'seed': seed,
+        'environment': {
+            'DATA_ROOT': str(data_root),
+            'LIGHT_CURVES_DIR': 'light_curves',
+            'PROCESSED_DIR': 'processed',
+            'EXTRACTED_TICS_FILE': 'tic_index',
+            'CONFIRMED_DIR': 'confirmed',
+            'CONFIRMED_CATALOG_FILE': 'confirmed.csv',
+            'LIST_DB_FIELDS': ",".join(CATALOG_FIELDS),
+            'OTHER_MISSIONS_IDS': ",".join(OTHER_MISSIONS_FIELDS),
+            'LIST_CONFIRMED_FIELDS': ",".join(CONFIRMED_FIELDS),
+            'NB_ROWS_HEADER': '1',
+        },
+    }
+    with open(join(data_root, 'dataset.json'), 'w') as dataset_file:
+        json.dump(dataset, dataset_file, indent=1, sort_keys=True)
+
+    return dataset
@@ -0,0 +1,141 @@
+"""Benchmark of the BLS engine of transitsearch
+
+Compares the time needed to compute the BLS periodogram of a synthetic light curve holding a transit, with the engine
+of `transitsearch.bls` (periods batched in 2-D arrays) and with a naive loop folding the light curve period after period.
+Both compute the same statistic on the same time bins, and must find the injected period.
+
+Run it from the root of the repository with :
+    python -m planet-learning.benchmarks.transit_search --periods 2000
+
+"""
+import argparse
+import time
+
+import numpy as np
+
+from ..transitsearch.bls import DEFAULT_DURATIONS, DEFAULT_OVERSAMPLE, MAX_DUTY_CYCLE, MIN_SAMPLES_IN_TRANSIT, bin_in_time, bls_power, period_grid
+from .synthetic import SECTOR_DURATION, SECTOR_LENGTH
+
+
+def make_transiting_light_curve(n_points, period, epoch, duration, depth, noise, seed=0):
+    """Build a normalized light curve with box-shaped transits and a mid-sector gap.
+
+    Parameters
+    ----------
+    n_points: int
+        number of samples over a sector
+    period: float
+        period of the transits, in days
+    epoch: float
+        middle of the first transit, in days
+    duration: float
+        duration of the transits, in days
+    depth: float
+        relative depth of the transits
+    noise: float
+        relative standard deviation of the noise
+    seed: int
+        seed of the random generator
+
+    Returns
+    -------
+    (numpy.ndarray, numpy.ndarray)
+        the time stamps in days and the fluxes
+
+    """
+    rng = np.random.RandomState(seed)
+    time_stamps = np.linspace(0, SECTOR_DURATION, n_points)
+    flux = 1 + rng.normal(0, noise, n_points)
+    flux[np.abs((time_stamps - epoch + period / 2) % period - period / 2) < duration / 2] -= depth
+    gap = slice(n_points // 2 - n_points // 40, n_points // 2 + n_points // 40)
+    flux[gap] = np.nan
+    return time_stamps, flux
+
+
+def naive_bls_power(time_stamps, counts, sums, periods, durations, oversample):
+    """BLS periodogram computed one period and one duration after another, the boxes of a duration being vectorized.
+
+    Parameters
+    ----------
+    time_stamps: numpy.ndarray
+        the centers of the time bins, in days
+    counts: numpy.ndarray
+        the number of samples of the bins
+    sums: numpy.ndarray
+        the sum of the mean-subtracted fluxes of the bins
+    periods: numpy.ndarray
+        the trial periods, in days
+    durations: numpy.ndarray
+        the trial durations, in days
+    oversample: int
+        the number of phase bins per shortest duration at the longest period
+
+    Returns
+    -------
+    numpy.ndarray
+        the power of each period, up to the constant factor of `bls_power`
+
+    """
+    total = counts.sum()
+    power = np.zeros(len(periods))
+    for (i, period) in enumerate(periods):
+        n_bins = int(np.ceil(period / durations[0] * oversample))
+        phase_bins = np.minimum(((time_stamps / period) % 1 * n_bins).astype(np.int64), n_bins - 1)
+        binned_counts = np.bincount(phase_bins, weights=counts, minlength=n_bins)
+        binned_sums = np.bincount(phase_bins, weights=sums, minlength=n_bins)
+
+        for duration in durations:
+            if duration > MAX_DUTY_CYCLE * period:
+                continue
+            width = min(max(int(np.round(duration / period * n_bins)), 1), n_bins // 2)
+            # Sums of the boxes of every start phase, wrapping around
+            n_in = np.convolve(np.r_[binned_counts, binned_counts[:width - 1]], np.ones(width), mode='valid')
+            sum_in = np.convolve(np.r_[binned_sums, binned_sums[:width - 1]], np.ones(width), mode='valid')
+            darker = (sum_in < 0) & (n_in >= MIN_SAMPLES_IN_TRANSIT) & (n_in < total)
+            if darker.any():
+                power[i] = max(power[i], np.max(sum_in[darker] ** 2 / (n_in[darker] * (total - n_in[darker]))))
+
+    return power
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--points', type=int, default=SECTOR_LENGTH, help="number of samples of the light curve")
+    parser.add_argument('--periods', type=int, default=2000, help="number of trial periods of the naive loop, taken around the injected one")
+    parser.add_argument('--period', type=float, default=3.217, help="period of the injected transits, in days")
+    args = parser.parse_args()
+
+    (time_stamps, flux) = make_transiting_light_curve(args.points, args.period, epoch=1.3, duration=0.12, depth=2e-3, noise=1e-3)
+    (binned_time, counts, sums, sigma) = bin_in_time(time_stamps, flux, DEFAULT_DURATIONS[0] / DEFAULT_OVERSAMPLE)
+
+    all_periods = period_grid(binned_time[-1] - binned_time[0])
+    closest = int(np.argmin(np.abs(all_periods - args.period)))
+    first = max(0, min(closest - args.periods // 2, len(all_periods) - args.periods))
+    periods = all_periods[first:first + args.periods]
+    print("{} time bins, {} trial periods in the full grid, {} compared".format(len(binned_time), len(all_periods), len(periods)))
+
+    start = time.perf_counter()
+    naive = naive_bls_power(binned_time, counts, sums, periods, DEFAULT_DURATIONS, DEFAULT_OVERSAMPLE)
+    naive_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    batched = bls_power(binned_time, counts, sums, sigma, periods, DEFAULT_DURATIONS, DEFAULT_OVERSAMPLE)
+    batched_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    bls_power(binned_time, counts, sums, sigma, all_periods, DEFAULT_DURATIONS, DEFAULT_OVERSAMPLE)
+    full_time = time.perf_counter() - start
+
+    (naive_best, batched_best) = (periods[np.argmax(naive)], periods[np.argmax(batched['power'])])
+    print("{:<10}{:>12}{:>16}{:>14}".format("engine", "time (s)", "periods / s", "best period"))
+    print("{:<10}{:>12.3f}{:>16.0f}{:>14.4f}".format("naive", naive_time, len(periods) / naive_time, naive_best))
+    print("{:<10}{:>12.3f}{:>16.0f}{:>14.4f}".format("batched", batched_time, len(periods) / batched_time, batched_best))
+    print("speedup : {:.1f}x".format(naive_time / batched_time))
+    print("full grid with the batched engine : {:.2f} s per light curve".format(full_time))
+
+    if abs(batched_best - args.period) > 0.01 * args.period:
+        raise RuntimeError("The batched engine did not find the injected period")
+
+
+if __name__ == '__main__':
+    main()
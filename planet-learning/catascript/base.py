@@ -1,15 +1,134 @@
 import os
 
 from sqlalchemy import create_engine
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.engine import make_url
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 from dotenv import load_dotenv
 
+from ..pipeline.metrics import instrument_engine
+
 #Loading environment variables
 load_dotenv()
-ENGINE = os.getenv("ENGINE_URL")
 
-#Creating engine, session and base class
-engine = create_engine(ENGINE)
-Session = sessionmaker(bind=engine)
-Base = declarative_base()
\ No newline at end of file
+#Engine created on first use, so that importing the models does not need a database
+_engine = None
+_session_factory = sessionmaker()
+Base = declarative_base()
+
+def get_engine():
+    """
+    Returns the engine of the database given by ENGINE_URL, creating it on the first call.
+    Its connections are pooled : DB_POOL_SIZE connections are kept open (5 by default), and each one is checked
+    before being reused if DB_POOL_PRE_PING is set (the default), so that connections dropped by the server are replaced.
+
+    Returns
+    -------
+    sqlalchemy.engine.Engine
+        the engine
+    """
+    global _engine
+    if _engine is None:
+        url = make_url(os.getenv("ENGINE_URL"))
+        options = {"pool_pre_ping": bool(int(os.getenv("DB_POOL_PRE_PING", 1)))}
+        #SQLite databases are files or in memory, whose pools are not sized
+        if url.get_backend_name() != "sqlite":
+            options["pool_size"] = int(os.getenv("DB_POOL_SIZE", 5))
+        _engine = create_engine(url, **options)
+        #Counting the round trips to the database in the metrics
+        instrument_engine(_engine)
+    return _engine
+
+def dispose_engine():
+    """
+    Closes the pooled connections of the engine, if it was created. To be called before forking worker processes,
+    which must not share the connections of their parent.
+    """
+    if _engine is not None:
+        _engine.dispose()
+
+def Session():
+    """
+    Opens a session on the database, creating the engine if needed
+
+    Returns
+    -------
+    sqlalchemy.orm.Session
+        the session
+    """
+    return _session_factory(bind=get_engine())
+
+#Dialects supporting INSERT ... ON CONFLICT, with their INSERT constructs
+CONFLICT_INSERTS = {"postgresql": postgresql.insert, "sqlite": sqlite.insert}
+
+def get_conflict_insert(table):
+    """
+    Builds an INSERT statement for the given table supporting the ON CONFLICT clauses of the dialect of the database
+
+    Parameters
+    ----------
+    table: sqlalchemy.Table
+        the table to insert into
+
+    Raises
+    ------
+    ValueError
+        if the database is neither PostgreSQL nor SQLite
+
+    Returns
+    -------
+    sqlalchemy.sql.Insert
+        the statement
+    """
+    dialect_name = get_engine().dialect.name
+    if dialect_name not in CONFLICT_INSERTS:
+        raise ValueError("The database must be one of {}, not {} : set ENGINE_URL accordingly".format(", ".join(sorted(CONFLICT_INSERTS)), dialect_name))
+    return CONFLICT_INSERTS[dialect_name](table)
+
+def insert_ignoring_duplicates(table):
+    """
+    Builds an INSERT statement for the given table that skips the rows conflicting with existing ones (INSERT ... ON CONFLICT DO NOTHING)
+
+    Parameters
+    ----------
+    table: sqlalchemy.Table
+        the table to insert into
+
+    Raises
+    ------
+    ValueError
+        if the database is neither PostgreSQL nor SQLite
+
+    Returns
+    -------
+    sqlalchemy.sql.Insert
+        the statement
+    """
+    return get_conflict_insert(table).on_conflict_do_nothing()
+
+def insert_updating_duplicates(table, index_elements):
+    """
+    Builds an INSERT statement for the given table that updates the existing rows conflicting with the inserted ones
+    on the given unique columns instead (INSERT ... ON CONFLICT (...) DO UPDATE), i.e. a bulk upsert
+
+    Parameters
+    ----------
+    table: sqlalchemy.Table
+        the table to insert into
+    index_elements: list of str
+        the keys of the columns of a unique index or constraint of the table, identifying the conflicting rows
+
+    Raises
+    ------
+    ValueError
+        if the database is neither PostgreSQL nor SQLite
+
+    Returns
+    -------
+    sqlalchemy.sql.Insert
+        the statement, updating all the columns but the primary key and the index columns
+    """
+    statement = get_conflict_insert(table)
+    updated_columns = {column.key: statement.excluded[column.key] for column in table.columns if not column.primary_key and column.key not in index_elements}
+    return statement.on_conflict_do_update(index_elements=index_elements, set_=updated_columns)
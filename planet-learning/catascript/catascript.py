@@ -1,22 +1,32 @@
 import csv
+import itertools
 import logging
 import os
-import pickle
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from os.path import join
 
 import numpy as np
-from psycopg2.errors import UniqueViolation
-from sqlalchemy.exc import IntegrityError
-
-from .base import Base, Session, engine
+from ..extracttic.tic_index import load_tic_index
+from ..pipeline import metrics
+from .base import Base, Session, dispose_engine, get_engine, insert_ignoring_duplicates
 from .confirmed import process_confirmed
-from .models import Catalog
+from .migrations import upgrade_database
+from .models import Catalog, Observation
 
 """
 catascript is a module that builds a SQL Alchemy database with specified database fields, with a primary key being the TESS id (TIC). 
 These TICs have the particularity of all having at least one corresponding light curve.
 """
 
+#Number of catalog lines filtered at once against the TIC index
+CATALOG_CHUNK_SIZE = 100000
+#Largest number of bound parameters of a statement : SQLite's limit, PostgreSQL allowing up to 65535
+MAX_BIND_PARAMETERS = 32766
+
+#TIC index of a catalog worker process, loaded by init_catalog_worker
+_worker_TIC_index = None
+
 #Loading functions
 def get_catalog_files():
     """
@@ -34,30 +44,93 @@ def get_catalog_files():
 
     #Extract the csv files
     catalog_files = []
-    for file_name in file_names:
+    for file_name in sorted(file_names):
         if file_name.endswith(".csv"):
             catalog_files.append(catalog_path + file_name)
     
     #Results
     return catalog_files
 
-def load_TICS_dict():
+def load_TIC_index():
     """
-    This function loads the dictionnary of extracted TICS that have a ligth curve (it was extracted and stored by the extrattic module)
+    This function loads the index of extracted TICS that have a ligth curve (it was extracted and stored by the extrattic module).
+    The index is memory-mapped : it is not read in memory at once.
     
     Returns
     -------
-    dict
-        a dictionnary containing the (TIC, list of name_of_ligthcurve_file) pairs.
+    extracttic.tic_index.TICIndex
+        the index giving the list of light curves of each TIC.
     """
 
     path_to_load = join(os.getenv("DATA_ROOT"), os.getenv("PROCESSED_DIR"), os.getenv("EXTRACTED_TICS_FILE"))
-    with open(path_to_load, 'rb') as pickle_dict:
-        dict_TICS = pickle.load(pickle_dict)
-    return dict_TICS
+    return load_tic_index(path_to_load)
+
+def read_catalog_chunks(catalog_file, chunk_size=CATALOG_CHUNK_SIZE):
+    """
+    Reads a catalog file by chunks of raw lines, skipping the blank ones
+
+    Parameters
+    ----------
+    catalog_file: str
+        path to the catalog file
+    chunk_size: int
+        the number of lines of a chunk
+
+    Yields
+    ------
+    list of str
+        the lines of the chunk
+    """
+    with open(catalog_file, newline='') as catalog_csv:
+        while True:
+            lines = list(itertools.islice(catalog_csv, chunk_size))
+            if not lines:
+                return
+            yield [line for line in lines if line.strip()]
+
+#Preprocessing functions
+def parse_id_column(catalog_lines, id_position):
+    """
+    Parses the ID column of a chunk of catalog lines into an array, without splitting the rest of the lines
+
+    Parameters
+    ----------
+    catalog_lines: list of str
+        the raw lines of the chunk
+    id_position: int
+        the position of the ID column in the lines
+
+    Returns
+    -------
+    numpy.ndarray of int64
+        the IDs of the lines
+    """
+    return np.array([line.split(',', id_position + 1)[id_position] for line in catalog_lines], dtype=np.int64)
+
+def filter_catalog_chunk(catalog_lines, TIC_index, id_position):
+    """
+    Keeps the lines of a chunk whose TIC has a light curve, with a vectorized membership test against the TIC index.
+    Most lines of the catalog do not have a light curve : only the remaining lines are then fully parsed.
+
+    Parameters
+    ----------
+    catalog_lines: list of str
+        the raw lines of the chunk
+    TIC_index: extracttic.tic_index.TICIndex
+        the index of extracted TICS given by load_TIC_index
+    id_position: int
+        the position of the ID column in the lines
+
+    Returns
+    -------
+    list of str
+        the lines having a light curve
+    """
+    TICS_in_catalog = parse_id_column(catalog_lines, id_position)
+    (kept_positions,) = np.nonzero(TIC_index.contains(TICS_in_catalog))
+    return [catalog_lines[position] for position in kept_positions]
 
-#Preprocessing function
-def preprocess_catalog_line(catalog_line):
+def preprocess_catalog_line(catalog_line, list_of_fields=None):
     """
     Preprocess the given catalog line into a dict with (name of field in the database, value for this line) entries.
     
@@ -65,6 +138,8 @@ def preprocess_catalog_line(catalog_line):
     ----------
     catalog_line: list
         The line to process
+    list_of_fields: list of str
+        The fields of the database, in the order they appear in the catalog. Read from LIST_DB_FIELDS if not given.
     
     Returns
     -------
@@ -72,7 +147,8 @@ def preprocess_catalog_line(catalog_line):
         the processed line
     """
     #Getting fields (in order)
-    list_of_fields = (os.getenv("LIST_DB_FIELDS")).split(',')
+    if list_of_fields is None:
+        list_of_fields = (os.getenv("LIST_DB_FIELDS")).split(',')
 
     #Creating dict 
     catalog_line_dict = {}
@@ -88,60 +164,275 @@ def preprocess_catalog_line(catalog_line):
     return catalog_line_dict
 
 #Checking functions
-def check_in_TICS_dict(TIC_in_catalog, TICS_dict):
+def check_in_TIC_index(TIC_in_catalog, TIC_index):
     """
-    This function checks for the existence of a specified TIC in the dictionnary of TICS of which we have a ligth curve 
+    This function checks for the existence of a specified TIC in the index of TICS of which we have a ligth curve 
     and returns the corresponding boolean.
 
     Parameters
     ----------
     TIC_in_catalog: str
         the TIC we want to check
-    TICS_dict: {int: list} dict. The list is for taking into account repetitions of a TIC visualisation.
-        the dict of extracted TICS given by load_TICS_dict
+    TIC_index: extracttic.tic_index.TICIndex
+        the index of extracted TICS given by load_TIC_index
 
     Returns
     -------
-    (bool, (str, {str dict} list)) tuple
-        (boolean indicating existence, value of the dict entry if existing)
+    (bool, {str dict} list) tuple
+        (boolean indicating existence, list of the light curves of the TIC if existing, ordered by sector)
     """
-    TIC_in_catalog = int(TIC_in_catalog)
+    observations = TIC_index.lookup(int(TIC_in_catalog))
 
-    if TIC_in_catalog in TICS_dict.keys():
-        return( (True, TICS_dict[TIC_in_catalog]))
+    if observations:
+        return( (True, observations))
 
     else:
-        return ( (False, ("", []))) #we return False and default values
+        return ( (False, [])) #we return False and default values
 
 #Database relation functions
 def initialize_database():
     """
     This function initializes a database with SQL Alchemy ; its model is located in catascript.base.Catalog
+    The schema of a database created by a previous version is upgraded to the current model.
     """
     #instantiates database
-    Base.metadata.create_all(engine)
+    Base.metadata.create_all(get_engine())
 
-def add_entry_to_database(value_fields_dict):
+    #upgrades existing tables
+    upgrade_database(get_engine())
+
+def insert_by_chunks(connection, table, rows, max_rows):
     """
-    This function adds a new value to the database. 
-    It matches the list of all possible fields given with the keys of the value of fields dictionnary, 
-    filling with None if there is not such value for that TIC.
+    This function inserts rows in a table with multi-row INSERTs skipping the duplicates (ON CONFLICT DO NOTHING).
+    Each INSERT holds at most max_rows rows, and fewer if their values would exceed MAX_BIND_PARAMETERS.
 
     Parameters
     ----------
-    value_fields_dict: dict
-        dictionary containing the value for each of the needed fields for that TIC entry.
+    connection: sqlalchemy.engine.Connection
+        the connection, whose transaction holds all the INSERTs
+    table: sqlalchemy.Table
+        the table to insert into
+    rows: list of dict
+        the rows, all having the same keys
+    max_rows: int
+        the largest number of rows of an INSERT
+
+    Returns
+    -------
+    int
+        the number of rows actually inserted
     """
-    session = Session()
-    try:
-        new_entry = Catalog(value_fields_dict)
-        session.add(new_entry)
-        session.commit()
-    except (IntegrityError, UniqueViolation):
-        #There is already an entry in the database
-        pass
-    finally:
-        session.close()
+    rows_per_insert = max(min(max_rows, MAX_BIND_PARAMETERS // max(len(rows[0]), 1)), 1)
+
+    nb_inserted = 0
+    for start in range(0, len(rows), rows_per_insert):
+        nb_inserted += connection.execute(insert_ignoring_duplicates(table).values(rows[start:start + rows_per_insert])).rowcount
+    return nb_inserted
+
+def add_entries_to_database(list_value_fields_dict, list_observations=None):
+    """
+    This function adds a batch of new values to the database, in one transaction.
+    Each table is inserted into with multi-row INSERTs of at most as many rows as there are entries (see insert_by_chunks) :
+    the observations, one per sector of each entry, take several of them.
+    The entries whose TIC is already in the database are skipped (ON CONFLICT DO NOTHING), as well as the observations already recorded :
+    the new sectors of a TIC already in the database are added.
+
+    Parameters
+    ----------
+    list_value_fields_dict: list of dict
+        dictionaries containing the value for each of the needed fields for each TIC entry. They must all have the same keys.
+    list_observations: list of dict
+        the light curves of the entries, {'catalog_id', 'SECTOR', 'TICVER', 'path'}
+
+    Returns
+    -------
+    int
+        the number of entries actually added
+    """
+    if not list_value_fields_dict:
+        return 0
+
+    #already_confirmed is initialized to False for latter processing, as done by Catalog.__init__
+    rows = [dict(value_fields_dict, already_confirmed=False) for value_fields_dict in list_value_fields_dict]
+
+    with get_engine().begin() as connection:
+        nb_added = insert_by_chunks(connection, Catalog.__table__, rows, len(rows))
+        if list_observations:
+            insert_by_chunks(connection, Observation.__table__, list_observations, len(rows))
+
+    return nb_added
+
+def process_catalog_file(catalog_file, TIC_index, batch_size):
+    """
+    This function adds to the database the entries of a catalog file that have a light curve, by batches.
+    The file is read by chunks, whose lines are filtered against the TIC index before being parsed.
+
+    Parameters
+    ----------
+    catalog_file: str
+        path to the catalog file
+    TIC_index: extracttic.tic_index.TICIndex
+        the index of extracted TICS given by load_TIC_index
+    batch_size: int
+        the number of entries inserted at once
+
+    Returns
+    -------
+    (int, int)
+        the number of entries having a light curve, and the number of them actually added
+    """
+    #Getting fields (in order), once for the whole file
+    list_of_fields = (os.getenv("LIST_DB_FIELDS")).split(',')
+    id_position = list_of_fields.index("ID")
+
+    nb_matched = 0
+    nb_added = 0
+    batch = []
+    observations = []
+
+    for catalog_lines in read_catalog_chunks(catalog_file):
+        #keep only the lines matching a TIC with known light curve
+        matched_lines = filter_catalog_chunk(catalog_lines, TIC_index, id_position)
+        catalog_reader = csv.reader(matched_lines, delimiter=',', quotechar='|')
+
+        #Iteration on each remaining line
+        for catalog_line in catalog_reader:
+            #preprocess that line to put in a good format
+            catalog_line_values = preprocess_catalog_line(catalog_line, list_of_fields)
+            TIC_in_catalog = catalog_line_values["ID"]
+
+            # add values extracted from the tic index in the catalog line to be stored in the database
+            (TIC_in_dict, dict_values) = check_in_TIC_index(TIC_in_catalog, TIC_index)
+            catalog_line_values['SECTOR'] = dict_values[0]['SECTOR']
+            catalog_line_values['path'] = dict_values[0]['path']
+            batch.append(catalog_line_values)
+            nb_matched += 1
+
+            # keep all the sectors observed
+            for observation in dict_values:
+                observations.append({'catalog_id': int(TIC_in_catalog), 'SECTOR': observation['SECTOR'], 'TICVER': observation['TICVER'], 'path': observation['path']})
+
+            # add the batch to the database
+            if len(batch) >= batch_size:
+                nb_added += add_entries_to_database(batch, observations)
+                batch = []
+                observations = []
+
+    nb_added += add_entries_to_database(batch, observations)
+
+    return (nb_matched, nb_added)
+
+#Parallel processing functions
+def init_catalog_worker():
+    """
+    Initializes a catalog worker process by loading its own (memory-mapped) TIC index.
+    The worker opens its own database connections, from the engine of its process.
+    """
+    global _worker_TIC_index
+    _worker_TIC_index = load_TIC_index()
+
+def run_catalog_worker(catalog_file, batch_size):
+    """
+    Processes a catalog file in a catalog worker process
+
+    Parameters
+    ----------
+    catalog_file: str
+        path to the catalog file
+    batch_size: int
+        the number of entries inserted at once
+
+    Returns
+    -------
+    ((str, int, int, float), dict)
+        the catalog file, the number of entries having a light curve, the number of them actually added and the processing duration in seconds,
+        and the metrics recorded by the worker while processing it
+    """
+    start = time.time()
+    (nb_matched, nb_added) = process_catalog_file(catalog_file, _worker_TIC_index, batch_size)
+    return (catalog_file, nb_matched, nb_added, time.time() - start), metrics.drain()
+
+def log_catalog_file_stats(catalog_file, nb_matched, nb_added, duration):
+    """
+    Logs the statistics of the processing of a catalog file, and records them in the metrics
+
+    Parameters
+    ----------
+    catalog_file: str
+        path to the catalog file
+    nb_matched: int
+        the number of entries having a light curve
+    nb_added: int
+        the number of them actually added
+    duration: float
+        the processing duration in seconds
+    """
+    logging.info("Processing {} : Done".format(catalog_file))
+    logging.info("{} entries with a light curve, {} added, {} already in database, in {:.1f} s ({:.0f} rows/s)".format(
+        nb_matched, nb_added, nb_matched - nb_added, duration, nb_matched / max(duration, 1e-6)))
+
+    metrics.observe("catascript_file_seconds", duration)
+    metrics.increment("catascript_files_total")
+    metrics.increment("catascript_rows_total", nb_matched, status="matched")
+    metrics.increment("catascript_rows_total", nb_added, status="added")
+    metrics.increment("bytes_read_total", os.path.getsize(catalog_file), stage="catascript")
+
+def process_catalog_files(catalog_files_list, TIC_index, batch_size, n_workers=1, checkpoint=None):
+    """
+    Adds to the database the entries of all the catalog files that have a light curve.
+    With more than one worker, the files are dispatched to a pool of processes, each one writing its files to the database with its own connection.
+    As the entries already in the database are skipped, the resulting database is the same as with a serial processing, a TIC appearing in a single catalog file.
+    The files completed by an interrupted run, recorded in the checkpoint, are not processed again.
+
+    Parameters
+    ----------
+    catalog_files_list: list of str
+        paths to the catalog files
+    TIC_index: extracttic.tic_index.TICIndex
+        the index of extracted TICS given by load_TIC_index, used by the serial processing
+    batch_size: int
+        the number of entries inserted at once
+    n_workers: int
+        the number of catalog files processed at once
+    checkpoint: pipeline.checkpoint.StageCheckpoint
+        the catalog files already processed, None to process all of them
+    """
+    if checkpoint is not None:
+        pending_files = [catalog_file for catalog_file in catalog_files_list if not checkpoint.is_done(catalog_file)]
+        if len(pending_files) < len(catalog_files_list):
+            logging.info("Resuming : {} catalog files already processed".format(len(catalog_files_list) - len(pending_files)))
+        catalog_files_list = pending_files
+
+    nb_files = len(catalog_files_list)
+
+    if n_workers > 1 and nb_files > 1:
+        #The connections opened so far must not be shared with the workers
+        dispose_engine()
+
+        with ProcessPoolExecutor(max_workers=n_workers, initializer=init_catalog_worker) as executor:
+            futures = [executor.submit(run_catalog_worker, catalog_file, batch_size) for catalog_file in catalog_files_list]
+            logging.info("Processing : {} catalog files with {} workers ... ".format(nb_files, n_workers))
+
+            for (nb_done, future) in enumerate(as_completed(futures), 1):
+                (stats, worker_metrics) = future.result()
+                metrics.merge(worker_metrics)
+                log_catalog_file_stats(*stats)
+                if checkpoint is not None:
+                    checkpoint.complete(stats[0])
+                logging.info("Progress : {}/{} catalog files".format(nb_done, nb_files))
+
+    else:
+        #loop over catalog files
+        for (nb_done, catalog_file) in enumerate(catalog_files_list, 1):
+            logging.info("Processing : catalog {} ... ".format(catalog_file))
+            start = time.time()
+
+            (nb_matched, nb_added) = process_catalog_file(catalog_file, TIC_index, batch_size)
+
+            log_catalog_file_stats(catalog_file, nb_matched, nb_added, time.time() - start)
+            if checkpoint is not None:
+                checkpoint.complete(catalog_file)
+            logging.info("Progress : {}/{} catalog files".format(nb_done, nb_files))
 
 #Statistics displaying
 def display_stats():
@@ -153,30 +444,41 @@ def display_stats():
 
     nb_total_entries = session.query(Catalog).count()
     nb_total_already_confirmed = session.query(Catalog).filter(Catalog.already_confirmed == True).count()
+    nb_total_observations = session.query(Observation).count()
 
     session.close()
 
+    metrics.set_gauge("database_entries", nb_total_entries, table="catalog")
+    metrics.set_gauge("database_entries", nb_total_already_confirmed, table="catalog_already_confirmed")
+    metrics.set_gauge("database_entries", nb_total_observations, table="observation")
+
     #Displaying
     logging.info("     ~~~      ")
     logging.info("NUMBER OF ENTRIES : {}".format(nb_total_entries))
     logging.info("NUMBER OF ALREADY CONFIRMED : {}".format(nb_total_already_confirmed))
+    logging.info("NUMBER OF OBSERVATIONS : {}".format(nb_total_observations))
     logging.info("     ~~~      ")
 
 
 #Main function
-def catascript():
+def catascript(checkpoint=None):
     """
     Builds a database containing the TESS ID (TIC), IDs for other missions, ra and dec value.
     It then fills it with the catalog entries that have a light curve (found in a previously extracted dictionnary) and other mission ID.
+
+    Parameters
+    ----------
+    checkpoint: pipeline.checkpoint.StageCheckpoint
+        the catalog files processed by an interrupted run, skipped by the recompute. None to process all of them.
     """
     logging.info("Launching : catascript")
 
     #get catalog files
     catalog_files_list = get_catalog_files()
 
-    #extract TICS_dict
-    logging.info("Loading : TICS dict ... ")
-    TICS_dict = load_TICS_dict()
+    #load the TIC index
+    logging.info("Loading : TIC index ... ")
+    TIC_index = load_TIC_index()
     logging.info("Done.")
 
     #inialize database
@@ -189,29 +491,15 @@ def catascript():
 
     #check if a recompute is being asked
     if need_re_launch:
-        #loop over catalog lines in catalog
-        for catalog_file in catalog_files_list:
-            with open(catalog_file, newline='') as catalog_csv:
-                catalog_reader = csv.reader(catalog_csv, delimiter=',', quotechar='|')
-                logging.info("Processing : catalog {} ... ".format(catalog_file))
-                
-                #Iteration on each line of the csv file
-                for catalog_line in catalog_reader:
-                    #preprocess that line to put in a good format
-                    catalog_line_values = preprocess_catalog_line(catalog_line)
-                    TIC_in_catalog = catalog_line_values["ID"]
-
-                    #check if match with a TIC with known light curve
-                    (TIC_in_dict, dict_values) = check_in_TICS_dict(TIC_in_catalog, TICS_dict)
-                    if TIC_in_dict:
-                        # add values extracted from the tic stored dictionnary in the catalog line to be stored in the database
-                        catalog_line_values['SECTOR'] = dict_values[0]['SECTOR']
-                        catalog_line_values['path'] = dict_values[0]['path']
-
-                        # add entry to database
-                        add_entry_to_database(catalog_line_values)
-
-                logging.info("Processing {} : Done".format(catalog_file))
+        #get the number of entries inserted at once and the number of catalog files processed at once
+        batch_size = int(os.getenv("DB_BATCH_SIZE", 1000))
+        n_workers = int(os.getenv("CATALOG_WORKERS", 1))
+
+        #process the catalog files
+        start = time.time()
+        process_catalog_files(catalog_files_list, TIC_index, batch_size, n_workers, checkpoint)
+        logging.info("Processing : all catalog files done in {:.1f} s".format(time.time() - start))
+        metrics.record_throughput("catascript_files_per_second", len(catalog_files_list), time.time() - start)
 
         #Processing confirmed catalog
         process_confirmed()
@@ -1,14 +1,14 @@
 import csv
 import logging
 import os
-import pickle
 from os.path import join
 
 import numpy as np
-from psycopg2.errors import UniqueViolation
-from sqlalchemy.exc import IntegrityError
+from sqlalchemy import inspect, select
 
-from .base import Base, Session, engine
+from ..pipeline import metrics
+from .base import Session, insert_updating_duplicates
+from .crossmatch import SkyIndex
 from .models import Catalog, Confirmed
 
 
@@ -16,6 +16,9 @@ from .models import Catalog, Confirmed
 catascript.confirmed updates the already_confirmed attribute of the database build by catascript by looking up to the confirmed exoplanets catalog.
 """
 
+#Number of catalog positions fetched at once to build the sky index
+SKY_INDEX_CHUNK_ROWS = 100000
+
 #Preprocessing function
 def preprocess_catalog_line(catalog_line):
     """
@@ -51,79 +54,111 @@ def preprocess_catalog_line(catalog_line):
     return catalog_line_dict
 
 #Query fucntions
-def add_or_update_confirmed(value_fields_dict, catalog_id):
+def update_confirmed_entries(matches):
     """
-    This function adds a new value to the database (without commiting it)
-    It matches the list of all possible fields given with the keys of the value of fields dictionnary, 
-    filling with None if there is not such value for that host.
+    This function marks the matched catalog entries as already confirmed and upserts the corresponding Confirmed entries, in a single transaction :
+        - a single UPDATE sets already_confirmed for all the matched catalog entries
+        - a single INSERT ... ON CONFLICT (catalog_id) DO UPDATE writes one Confirmed entry per matched catalog entry,
+          the first planet of each system being kept, and replaces the entries of the systems treated before
 
     Parameters
     ----------
-    value_fields_dict: dict
-        dictionary containing the value for each of the needed fields for that host entry.
-    catalog_id : int
+    matches: list of (dict, int) tuples
+        the processed confirmed catalog lines with the ID of their matched catalog entry, in the order of the confirmed catalog
+
+    Returns
+    -------
+    int
+        the number of Confirmed entries upserted
     """
+    #Only the fields of the confirmed catalog that are attributes of Confirmed are stored, under the keys of their columns
+    column_keys = {prop.key: prop.columns[0].key for prop in inspect(Confirmed).column_attrs if prop.key not in ("ID", "catalog_id")}
+
+    #A row can only be affected once by the statement : one entry per system, all entries having the same keys
+    rows = {}
+    for (value_fields_dict, catalog_id) in matches:
+        if catalog_id in rows:
+            continue
+        row = {column_key: value_fields_dict.get(attribute) for (attribute, column_key) in column_keys.items()}
+        row["catalog_id"] = catalog_id
+        rows[catalog_id] = row
+
+    if not rows:
+        return 0
+
     session = Session()
     try:
-        #Querying database to see if the entry already exists (a planet from the same system was treated before)
-        check_exists_db = session.query(Confirmed).filter(Confirmed.catalog_id == catalog_id).limit(1).all()
-        if check_exists_db:
-            raise UniqueViolation
-
-        #Adding new entry
-        new_entry = Confirmed(value_fields_dict, catalog_id)
-        session.add(new_entry)
+        #Modifying Catalog entries
+        session.query(Catalog).filter(Catalog.ID.in_(sorted(rows))).update({Catalog.already_confirmed: True}, synchronize_session=False)
+
+        #Upserting Confirmed entries
+        session.execute(insert_updating_duplicates(Confirmed.__table__, ["catalog_id"]), list(rows.values()))
         session.commit()
 
-    except (IntegrityError, UniqueViolation):
-        #There is already an entry in the database : we do nothing
-        pass
+    except Exception:
+        session.rollback()
+        raise
 
     finally:
         session.close()
 
-#Processing functions
-def checks_star_exists_in_database_and_update(processed_catalog_line):
+    return len(rows)
+
+#Cross-matching functions
+def load_sky_index():
+    """
+    This function builds the spatial index of the positions of all the catalog entries of the database
+
+    Returns
+    -------
+    catascript.crossmatch.SkyIndex
+        the index of the catalog positions
+    """
+    #The positions are streamed by chunks of SKY_INDEX_CHUNK_ROWS rows, each one converted to arrays before the next is fetched
+    ids = [np.zeros(0, dtype=np.int64)]
+    ra = [np.zeros(0, dtype=np.float64)]
+    dec = [np.zeros(0, dtype=np.float64)]
+    session = Session()
+    try:
+        query = select(Catalog.ID, Catalog.ra, Catalog.dec).where(Catalog.ra != None).where(Catalog.dec != None)
+        result = session.execute(query, execution_options={"yield_per": SKY_INDEX_CHUNK_ROWS})
+        for positions in result.partitions():
+            (chunk_ids, chunk_ra, chunk_dec) = zip(*positions)
+            ids.append(np.array(chunk_ids, dtype=np.int64))
+            ra.append(np.array(chunk_ra, dtype=np.float64))
+            dec.append(np.array(chunk_dec, dtype=np.float64))
+    finally:
+        session.close()
+
+    return SkyIndex(np.concatenate(ids), np.concatenate(ra), np.concatenate(dec))
+
+def get_coordinate(processed_catalog_line, field):
     """
-    This function checks if the HIP identifier of the confirmed line is in the database. If it isn't, we check for th ra and dec values.
+    Reads a coordinate of a processed confirmed catalog line
 
     Parameters
     ----------
     processed_catalog_line : dict
         the dict containing the processed catalog line
+    field : str
+        the name of the coordinate field
 
+    Returns
+    -------
+    float
+        the coordinate in degrees, NaN if missing or malformed
     """
-    Ra = float(processed_catalog_line["Ra_deg"])
-    Dec = float(processed_catalog_line["Dec_deg"])
-    accepted_error_margin = 0.000001
-
-    session = Session()
     try:
-        #Queries
-        search_for_Ra = session.query(Catalog).filter(Catalog.ra > Ra-accepted_error_margin).filter(Catalog.ra < Ra + accepted_error_margin)
-        search_for_Dec_and_Ra = search_for_Ra.filter(Catalog.dec > Dec-accepted_error_margin).filter(Catalog.dec < Dec + accepted_error_margin).limit(1).all()
-
-        #Modifying Catalog entry
-        catalog_entry = search_for_Dec_and_Ra[0]
-        catalog_entry.update_already_confirmed()
-        catalog_id = catalog_entry.ID 
-
-        #Closing this first session
-        session.commit()
-        session.close()
-        
-        #Creating or updating a Confirmed entry, updating Catalog entry
-        add_or_update_confirmed(processed_catalog_line, catalog_id)
-        
-        logging.info("Dec/Ra : \n Modifying entry for : {}, with TIC : {}".format(processed_catalog_line["Host_name"], catalog_id))
-    
-    except (IndexError):
-        #Closing the opened session
-        session.close()
+        return float(processed_catalog_line[field])
+    except (TypeError, ValueError):
+        return np.nan
 
+#Processing functions
 def process_confirmed():
     """
-    This function processes the confirmed exoplanets catalog
+    This function processes the confirmed exoplanets catalog.
+    All the hosts of the catalog are cross-matched at once with the positions of the catalog entries of the database,
+    each host being matched with its nearest entry within the tolerance given by CROSSMATCH_TOLERANCE_ARCSEC.
 
     """
     logging.info("Processing : catascript, confirmed catalog")
@@ -131,6 +166,8 @@ def process_confirmed():
     catalog_file = join(os.getenv("DATA_ROOT"), os.getenv("CONFIRMED_DIR"), os.getenv("CONFIRMED_CATALOG_FILE"))
     #get the number of rows in header (skipped in the processing)
     nb_rows_header = int(os.getenv("NB_ROWS_HEADER"))
+    #get the accepted angular separation between a host and a catalog entry
+    tolerance_arcsec = float(os.getenv("CROSSMATCH_TOLERANCE_ARCSEC", 1.0))
 
     #open the file
     with open(catalog_file, newline='') as catalog_csv:
@@ -140,11 +177,37 @@ def process_confirmed():
         for i in range(nb_rows_header):
             next(catalog_reader)
 
-        #Iteration on each line of the csv file
-        for catalog_line in catalog_reader:
-            processed_catalog_line = preprocess_catalog_line(catalog_line)
-            checks_star_exists_in_database_and_update(processed_catalog_line)
-        
-    #logging.info number of confirmed systems are in database
+        #Reading all the lines of the csv file
+        processed_catalog_lines = [preprocess_catalog_line(catalog_line) for catalog_line in catalog_reader]
+
+    metrics.increment("bytes_read_total", os.path.getsize(catalog_file), stage="confirmed")
+
+    #Cross-matching all the hosts at once
+    with metrics.timer("confirmed_step_seconds", step="load_sky_index"):
+        sky_index = load_sky_index()
+    with metrics.timer("confirmed_step_seconds", step="crossmatch"):
+        Ra = np.array([get_coordinate(line, "Ra_deg") for line in processed_catalog_lines])
+        Dec = np.array([get_coordinate(line, "Dec_deg") for line in processed_catalog_lines])
+        (catalog_ids, separations) = sky_index.match(Ra, Dec, tolerance_arcsec)
+
+    matches = []
+    for (processed_catalog_line, catalog_id, separation) in zip(processed_catalog_lines, catalog_ids, separations):
+        if catalog_id < 0:
+            continue
+
+        matches.append((processed_catalog_line, int(catalog_id)))
+        logging.info("Dec/Ra : \n Modifying entry for : {}, with TIC : {}, at {:.3f} arcsec".format(processed_catalog_line["Host_name"], catalog_id, separation))
+
+    #Updating the database at once
+    with metrics.timer("confirmed_step_seconds", step="update_database"):
+        nb_upserted = update_confirmed_entries(matches)
+
+    metrics.set_gauge("confirmed_planets", len(processed_catalog_lines), status="read")
+    metrics.set_gauge("confirmed_planets", len(matches), status="matched")
+    metrics.increment("confirmed_systems_upserted_total", nb_upserted)
+
+    #logging.info number of confirmed planets matched in database
+    logging.info("{} of {} confirmed planets matched within {} arcsec".format(len(matches), len(processed_catalog_lines), tolerance_arcsec))
+    logging.info("{} confirmed systems written".format(nb_upserted))
 
     logging.info("Done : catascript, confirmed catalog")
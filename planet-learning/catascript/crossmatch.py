@@ -0,0 +1,179 @@
+import numpy as np
+
+"""
+catascript.crossmatch matches sky positions (ra, dec) against the positions of the catalog entries, within an angular tolerance.
+
+The catalog positions are indexed with the zones algorithm : the sky is cut into declination zones of constant height,
+and the positions are sorted by zone then by right ascension. The candidates of a target are then found by binary search
+in the zones overlapping its tolerance circle, and the nearest one is kept by computing the exact angular separations.
+"""
+
+#Height of the declination zones, in degrees
+ZONE_HEIGHT = 0.01
+
+def radec_to_unit_vectors(ra, dec):
+    """
+    Converts sky positions to unit vectors
+
+    Parameters
+    ----------
+    ra: numpy.ndarray
+        right ascensions, in degrees
+    dec: numpy.ndarray
+        declinations, in degrees
+
+    Returns
+    -------
+    numpy.ndarray
+        the (n, 3) array of unit vectors
+    """
+    ra = np.radians(ra)
+    dec = np.radians(dec)
+    cos_dec = np.cos(dec)
+    return np.stack([cos_dec * np.cos(ra), cos_dec * np.sin(ra), np.sin(dec)], axis=-1)
+
+class SkyIndex:
+    """
+    Spatial index of catalog positions, for nearest neighbour matching within an angular tolerance
+    """
+    def __init__(self, ids, ra, dec, zone_height=ZONE_HEIGHT):
+        """
+        Builds the index. Positions with a missing coordinate are ignored.
+
+        Parameters
+        ----------
+        ids: array-like of int
+            the IDs of the catalog entries
+        ra: array-like of float
+            the right ascensions of the entries, in degrees
+        dec: array-like of float
+            the declinations of the entries, in degrees
+        zone_height: float
+            the height of the declination zones, in degrees
+        """
+        ids = np.asarray(ids, dtype=np.int64)
+        ra = np.mod(np.asarray(ra, dtype=np.float64), 360.)
+        dec = np.asarray(dec, dtype=np.float64)
+
+        valid = np.isfinite(ra) & np.isfinite(dec)
+        (ids, ra, dec) = (ids[valid], ra[valid], dec[valid])
+
+        self.zone_height = zone_height
+        zones = self.zone_of(dec)
+
+        #Sorting by zone then right ascension, combined in a single key
+        keys = zones * 360. + ra
+        order = np.argsort(keys, kind='stable')
+
+        self.keys = keys[order]
+        self.ids = ids[order]
+        self.vectors = radec_to_unit_vectors(ra[order], dec[order])
+
+    def __len__(self):
+        return len(self.ids)
+
+    def zone_of(self, dec):
+        """
+        Gets the zone of declinations
+
+        Parameters
+        ----------
+        dec: numpy.ndarray or float
+            declinations, in degrees
+
+        Returns
+        -------
+        numpy.ndarray or float
+            the zone numbers, as floats
+        """
+        return np.floor((np.clip(dec, -90., 90.) + 90.) / self.zone_height)
+
+    def candidates(self, ra, dec, tolerance):
+        """
+        Gets the positions of the entries that may be within the tolerance of a target
+
+        Parameters
+        ----------
+        ra: float
+            right ascension of the target, in degrees
+        dec: float
+            declination of the target, in degrees
+        tolerance: float
+            the tolerance, in degrees
+
+        Returns
+        -------
+        numpy.ndarray of int
+            the positions of the candidates in the index
+        """
+        ra = ra % 360.
+
+        #Half width in right ascension of the tolerance circle, the whole zone near the poles
+        cos_dec = np.cos(np.radians(min(abs(dec) + tolerance, 90.)))
+        if cos_dec <= 0 or tolerance / cos_dec >= 180.:
+            ra_ranges = [(0., 360.)]
+        else:
+            half_width = tolerance / cos_dec
+            (ra_low, ra_high) = (ra - half_width, ra + half_width)
+            ra_ranges = [(max(ra_low, 0.), min(ra_high, 360.))]
+            #Wrapping around ra = 0
+            if ra_low < 0:
+                ra_ranges.append((ra_low + 360., 360.))
+            if ra_high > 360.:
+                ra_ranges.append((0., ra_high - 360.))
+
+        slices = []
+        first_zone = int(self.zone_of(dec - tolerance))
+        last_zone = int(self.zone_of(dec + tolerance))
+        for zone in range(first_zone, last_zone + 1):
+            for (ra_low, ra_high) in ra_ranges:
+                start = np.searchsorted(self.keys, zone * 360. + ra_low, side='left')
+                stop = np.searchsorted(self.keys, zone * 360. + ra_high, side='right')
+                slices.append(np.arange(start, stop))
+
+        return np.concatenate(slices)
+
+    def match(self, ra, dec, tolerance_arcsec):
+        """
+        Finds the nearest entry of each target, within the tolerance
+
+        Parameters
+        ----------
+        ra: array-like of float
+            right ascensions of the targets, in degrees
+        dec: array-like of float
+            declinations of the targets, in degrees
+        tolerance_arcsec: float
+            the maximum angular separation, in arcseconds
+
+        Returns
+        -------
+        (numpy.ndarray of int, numpy.ndarray of float)
+            the ID of the nearest entry of each target (-1 if there is none within the tolerance)
+            and the angular separations, in arcseconds (NaN if there is no match)
+        """
+        ra = np.asarray(ra, dtype=np.float64)
+        dec = np.asarray(dec, dtype=np.float64)
+        tolerance = tolerance_arcsec / 3600.
+        #Maximum squared chord length between unit vectors within the tolerance, more accurate than dot products for small angles
+        max_chord2 = (2 * np.sin(np.radians(tolerance) / 2)) ** 2
+
+        matched_ids = np.full(len(ra), -1, dtype=np.int64)
+        separations = np.full(len(ra), np.nan)
+        targets = radec_to_unit_vectors(ra, dec)
+
+        for i in range(len(ra)):
+            if not (np.isfinite(ra[i]) and np.isfinite(dec[i])):
+                continue
+
+            candidates = self.candidates(ra[i], dec[i], tolerance)
+            if len(candidates) == 0:
+                continue
+
+            chords2 = np.sum((self.vectors[candidates] - targets[i]) ** 2, axis=1)
+            nearest = np.argmin(chords2)
+            if chords2[nearest] <= max_chord2:
+                matched_ids[i] = self.ids[candidates[nearest]]
+                separations[i] = np.degrees(2 * np.arcsin(np.sqrt(chords2[nearest]) / 2)) * 3600.
+
+        return (matched_ids, separations)
@@ -0,0 +1,86 @@
+import logging
+
+from sqlalchemy import BigInteger, Float, inspect, text
+
+"""
+catascript.migrations upgrades the schema of databases created by previous versions of catascript to the one declared in catascript.models.
+Every step checks the current schema first, so that the upgrade can be run on each launch.
+"""
+
+#Columns stored as double precision instead of arbitrary-precision numeric
+DOUBLE_PRECISION_COLUMNS = [("catalog", "ra"), ("catalog", "dec")]
+
+#Indexes declared in catascript.models, with their creation statement
+INDEXES = [
+    ("catalog", "ix_catalog_already_confirmed", 'CREATE INDEX IF NOT EXISTS ix_catalog_already_confirmed ON catalog (already_confirmed) WHERE already_confirmed'),
+    ("catalog", "ix_catalog_dec_ra", 'CREATE INDEX IF NOT EXISTS ix_catalog_dec_ra ON catalog ("dec", ra)'),
+    ("confirmed", "uq_confirmed_catalog_id", 'CREATE UNIQUE INDEX IF NOT EXISTS uq_confirmed_catalog_id ON confirmed (catalog_id)'),
+]
+
+def get_column_types(inspector, table):
+    """
+    Gets the types of the columns of a table
+
+    Parameters
+    ----------
+    inspector: sqlalchemy.engine.reflection.Inspector
+        the inspector of the database
+    table: str
+        the name of the table
+
+    Returns
+    -------
+    dict
+        the (name of the column, type) pairs
+    """
+    return {column["name"]: column["type"] for column in inspector.get_columns(table)}
+
+def upgrade_database(engine):
+    """
+    Upgrades the schema of an existing database :
+        - ra and dec of the catalog become double precision (PostgreSQL only, SQLite columns being untyped)
+        - confirmed.catalog_id becomes a bigint, TIC IDs not fitting in an integer (PostgreSQL only)
+        - duplicated confirmed entries of a system are removed, keeping the first one, before adding the unique index on catalog_id
+        - the missing indexes are created
+        - the observation table of a database created without it is filled with the first sector of each catalog entry,
+          the other sectors being added by the next recompute of catascript
+
+    Parameters
+    ----------
+    engine: sqlalchemy.engine.Engine
+        the engine of the database
+    """
+    inspector = inspect(engine)
+    is_postgresql = engine.dialect.name == "postgresql"
+
+    with engine.begin() as connection:
+        if is_postgresql:
+            for (table, column) in DOUBLE_PRECISION_COLUMNS:
+                column_type = get_column_types(inspector, table)[column]
+                if not isinstance(column_type, Float):
+                    logging.info("Upgrading database : {}.{} to double precision".format(table, column))
+                    connection.execute(text('ALTER TABLE {0} ALTER COLUMN "{1}" TYPE double precision USING "{1}"::double precision'.format(table, column)))
+
+            catalog_id_type = get_column_types(inspector, "confirmed")["catalog_id"]
+            if not isinstance(catalog_id_type, BigInteger):
+                logging.info("Upgrading database : confirmed.catalog_id to bigint")
+                connection.execute(text('ALTER TABLE confirmed ALTER COLUMN catalog_id TYPE bigint'))
+
+        existing_indexes = {table: set(index["name"] for index in inspector.get_indexes(table)) for table in ("catalog", "confirmed")}
+
+        for (table, name, statement) in INDEXES:
+            if name in existing_indexes[table]:
+                continue
+
+            if name == "uq_confirmed_catalog_id":
+                logging.info("Upgrading database : removing duplicated confirmed entries")
+                connection.execute(text('DELETE FROM confirmed WHERE "ID" NOT IN (SELECT MIN("ID") FROM confirmed GROUP BY catalog_id) AND catalog_id IS NOT NULL'))
+
+            logging.info("Upgrading database : creating index {}".format(name))
+            connection.execute(text(statement))
+
+        has_observations = connection.execute(text('SELECT 1 FROM observation LIMIT 1')).first() is not None
+        if not has_observations:
+            result = connection.execute(text('INSERT INTO observation (catalog_id, "SECTOR", path) SELECT "ID", "SECTOR", path FROM catalog WHERE "SECTOR" IS NOT NULL'))
+            if result.rowcount:
+                logging.info("Upgrading database : {} observations copied from the catalog".format(result.rowcount))
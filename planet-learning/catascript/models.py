@@ -1,4 +1,4 @@
-from sqlalchemy import Column, String, Integer, Numeric, DateTime, Boolean, ForeignKey, BigInteger, VARCHAR
+from sqlalchemy import Column, String, Integer, Numeric, Float, DateTime, Boolean, ForeignKey, BigInteger, VARCHAR, Index
 from sqlalchemy.orm import relationship
 
 from .base import Base
@@ -23,9 +23,13 @@ class Catalog(Base):
 	[typeSrc] [varchar](20)
 	[ra] [float] *
 	[dec] [float] *
-    [SECTOR] [int] *
-    [path] [varchar 300]
+    [SECTOR] [int] * (first sector observed, see Observation for all of them)
+    [path] [varchar 300] (light curve of the first sector)
     [already_confirmed] [boolean]
+
+    Indexes
+    ix_catalog_already_confirmed : partial index on the entries having a confirmed planet
+    ix_catalog_dec_ra : composite index on the position
     """
     __tablename__="catalog"
     ID = Column(BigInteger, primary_key = True)
@@ -41,15 +45,23 @@ class Catalog(Base):
     KIC = Column("KIC", Integer)
     objType = Column("objType", VARCHAR(10))
     typeSrc = Column("typeSrc", VARCHAR(20))
-    ra = Column("ra", Numeric)
-    dec = Column("dec", Numeric)
+    ra = Column("ra", Float(precision=53))
+    dec = Column("dec", Float(precision=53))
     SECTOR = Column("SECTOR", Integer)
     path = Column("path", VARCHAR(300))
     already_confirmed = Column("already_confirmed", Boolean)
 
+    __table_args__ = (
+        Index("ix_catalog_already_confirmed", already_confirmed, postgresql_where=(already_confirmed == True), sqlite_where=(already_confirmed == True)),
+        Index("ix_catalog_dec_ra", dec, ra),
+    )
+
     #One to one relationship with Confirmed
     planets_information = relationship("Confirmed", uselist=False, back_populates="related_catalog_entry")
 
+    #One to many relationship with Observation, ordered by sector
+    observations = relationship("Observation", back_populates="catalog_entry", order_by="Observation.SECTOR")
+
     def __init__(self, value_fields_dict):
         """
         Creates another entry in the database
@@ -91,9 +103,11 @@ class Confirmed(Base):
     HIP_Name [varchar(25)]
     Proper_Motion_ra [varchar(30)]
     Proper_Motion_dec [varchar(30)]
+    catalog_id [bigint] (unique)
     """
     __tablename__ = "confirmed"
-    ID = Column(BigInteger, primary_key=True)
+    #SQLite only autoincrements INTEGER primary keys
+    ID = Column(BigInteger().with_variant(Integer, "sqlite"), primary_key=True)
     Host_name = Column("Host_name", VARCHAR(40))
     Discovery_Method = Column("Discovery_method", VARCHAR(50))
     Controversial_flag = Column("Controversial_flag", Integer)
@@ -108,9 +122,14 @@ class Confirmed(Base):
     Proper_Motion_dec = Column("Proper_Motion_dec",  VARCHAR(30))
 
     #One to one relationship with Confirmed
-    catalog_id = Column(Integer, ForeignKey("catalog.ID"))
+    catalog_id = Column(BigInteger, ForeignKey("catalog.ID"))
     related_catalog_entry = relationship("Catalog", back_populates="planets_information")
 
+    #A single entry per system
+    __table_args__ = (
+        Index("uq_confirmed_catalog_id", catalog_id, unique=True),
+    )
+
     def __init__(self, value_fields_dict, catalog_id):
         """
         Creates another entry in the database
@@ -129,4 +148,55 @@ class Confirmed(Base):
         #Linking to the corresponding catalog entry
         self.catalog_id = catalog_id
 
-        
\ No newline at end of file
+class Observation(Base):
+    """
+    Creates a database with following attributes, one entry per light curve of a catalog entry
+
+    catalog_id [bigint] (primary key)
+    SECTOR [int] (primary key)
+    TICVER [int]
+    path [varchar 300]
+    """
+    __tablename__ = "observation"
+    catalog_id = Column(BigInteger, ForeignKey("catalog.ID"), primary_key=True)
+    SECTOR = Column("SECTOR", Integer, primary_key=True)
+    TICVER = Column("TICVER", Integer)
+    path = Column("path", VARCHAR(300))
+
+    #Many to one relationship with Catalog
+    catalog_entry = relationship("Catalog", back_populates="observations")
+
+class Candidate(Base):
+    """
+    Creates a database with following attributes, the transit candidates found by transitsearch
+
+    ID [Integer] (primary key)
+    catalog_id [bigint]
+    SECTOR [int]
+    rank [int] (1 for the highest peak of the periodogram)
+    period [float] (days)
+    epoch [float] (middle of the first transit, BTJD)
+    duration [float] (days)
+    depth [float] (relative to the median flux)
+    snr [float]
+    power [float] (decrease of chi-square)
+
+    Indexes
+    ix_candidate_catalog_id_sector : composite index on the searched light curve
+    """
+    __tablename__ = "candidate"
+    #SQLite only autoincrements INTEGER primary keys
+    ID = Column(BigInteger().with_variant(Integer, "sqlite"), primary_key=True)
+    catalog_id = Column(BigInteger, ForeignKey("catalog.ID"))
+    SECTOR = Column("SECTOR", Integer)
+    rank = Column("rank", Integer)
+    period = Column("period", Float(precision=53))
+    epoch = Column("epoch", Float(precision=53))
+    duration = Column("duration", Float(precision=53))
+    depth = Column("depth", Float(precision=53))
+    snr = Column("snr", Float(precision=53))
+    power = Column("power", Float(precision=53))
+
+    __table_args__ = (
+        Index("ix_candidate_catalog_id_sector", catalog_id, SECTOR),
+    )
@@ -0,0 +1,277 @@
+"""Streaming of labelled light curves for the training of Keras models
+
+The labelled set is given by the catalog table built by catascript : the light curves of the TICs having a confirmed planet
+(`already_confirmed`) are the positive examples, the others the negative ones. Their samples are read from the flux store
+(see `fluxstore/store.py`), in fixed-size batches brought to a fixed length, without loading the whole set in memory.
+
+The light curves are grouped in shards of consecutive rows of the store. Each epoch visits the shards in a random order,
+and the light curves of a shard in a random order : the reads stay local in the store while the batches are shuffled.
+The next batches are assembled by background threads while the current one is used for training.
+
+"""
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from ..catascript.base import Session
+from ..catascript.models import Catalog
+from ..fluxstore.store import load_flux_store
+from ..pipeline.prefetch import map_bounded
+
+# Ways of bringing the light curves to a fixed length
+LENGTH_MODES = ("pad", "resample")
+
+
+def get_labelled_TICs():
+    """Query the TICs of the catalog with their label.
+
+    Returns
+    -------
+    (numpy.ndarray, numpy.ndarray)
+        the TIC IDs, sorted, and their labels (True for the TICs having a confirmed planet)
+
+    """
+    session = Session()
+    try:
+        query = (
+            session.query(Catalog.ID, Catalog.already_confirmed)
+            .order_by(Catalog.ID)
+            .execution_options(stream_results=True)
+            .yield_per(10000)
+        )
+        rows = [(ID, bool(already_confirmed)) for (ID, already_confirmed) in query]
+    finally:
+        session.close()
+
+    TIC_IDs = np.array([row[0] for row in rows], dtype=np.int64)
+    labels = np.array([row[1] for row in rows], dtype=bool)
+    return TIC_IDs, labels
+
+
+def normalize_flux(flux):
+    """Default transformation of the fluxes : relative variation around the median, missing samples set to 0.
+
+    Parameters
+    ----------
+    flux: numpy.ndarray
+        the fluxes of a light curve
+
+    Returns
+    -------
+    numpy.ndarray
+        the float32 normalized fluxes
+
+    """
+    flux = np.asarray(flux, dtype=np.float32)
+    finite = np.isfinite(flux)
+    if not finite.any():
+        return np.zeros(len(flux), dtype=np.float32)
+
+    normalized = flux / np.median(flux[finite]) - 1
+    normalized[~finite] = 0
+    return normalized
+
+
+def to_fixed_length(time, flux, length, mode="pad"):
+    """Bring a light curve to a fixed number of samples.
+
+    Parameters
+    ----------
+    time: numpy.ndarray
+        the time stamps
+    flux: numpy.ndarray
+        the transformed fluxes, without missing values
+    length: int
+        the number of samples
+    mode: str
+        "pad" to cut the light curve or pad it with zeros at the end,
+        "resample" to interpolate it linearly on `length` evenly spaced time stamps
+
+    Returns
+    -------
+    numpy.ndarray
+        the float32 fluxes
+
+    """
+    if mode == "pad":
+        fixed = np.zeros(length, dtype=np.float32)
+        n = min(length, len(flux))
+        fixed[:n] = flux[:n]
+        return fixed
+
+    elif mode == "resample":
+        finite = np.isfinite(time)
+        if finite.sum() < 2:
+            return np.zeros(length, dtype=np.float32)
+        (time, flux) = (time[finite], flux[finite])
+        grid = np.linspace(time[0], time[-1], length)
+        return np.interp(grid, time, flux).astype(np.float32)
+
+    raise ValueError("Unknown length mode {}, expected one of {}".format(mode, ", ".join(LENGTH_MODES)))
+
+
+class LightCurveDataset:
+    """
+    Batches of labelled light curves read from the flux store, brought to a fixed length
+    """
+    def __init__(self, store_path, length, batch_size=32, mode="pad", shard_size=1024,
+                 negatives_per_positive=None, transform=normalize_flux, prefetch=4, n_threads=2, seed=None):
+        """
+        Selects the light curves of the labelled TICs in the flux store
+
+        Parameters
+        ----------
+        store_path: path-like object
+            path to the folder of the flux store
+        length: int
+            number of samples of each light curve in the batches
+        batch_size: int
+            number of light curves per batch
+        mode: str
+            "pad" or "resample", see `to_fixed_length()`
+        shard_size: int
+            number of consecutive light curves of the store per shard
+        negatives_per_positive: float or None
+            maximum number of negative light curves kept per positive one, drawn at random. None keeps all of them.
+        transform: callable
+            function applied to the fluxes of each light curve before bringing it to a fixed length.
+            It must return an array of the same length without missing values.
+        prefetch: int
+            number of batches assembled in advance
+        n_threads: int
+            number of threads assembling the batches
+        seed: int
+            seed of the random generator of the shuffling
+        """
+        if mode not in LENGTH_MODES:
+            raise ValueError("Unknown length mode {}, expected one of {}".format(mode, ", ".join(LENGTH_MODES)))
+
+        self.store = load_flux_store(store_path)
+        (self.length, self.batch_size, self.mode, self.shard_size) = (length, batch_size, mode, shard_size)
+        (self.transform, self.prefetch, self.n_threads) = (transform, prefetch, n_threads)
+        self.rng = np.random.RandomState(seed)
+
+        # Label of each row of the store, from the sorted TIC IDs of the catalog
+        (TIC_IDs, labels) = get_labelled_TICs()
+        store_TIC_IDs = np.asarray(self.store.ticid)
+        positions = np.minimum(np.searchsorted(TIC_IDs, store_TIC_IDs), max(len(TIC_IDs) - 1, 0))
+        in_catalog = (TIC_IDs[positions] == store_TIC_IDs) if len(TIC_IDs) else np.zeros(len(store_TIC_IDs), dtype=bool)
+
+        rows = np.flatnonzero(in_catalog)
+        row_labels = labels[positions[rows]]
+
+        if negatives_per_positive is not None:
+            negatives = rows[~row_labels]
+            n_negatives = min(len(negatives), int(negatives_per_positive * np.count_nonzero(row_labels)))
+            kept = np.concatenate([rows[row_labels], self.rng.choice(negatives, n_negatives, replace=False)])
+            kept.sort()
+            row_labels = labels[positions[kept]]
+            rows = kept
+
+        self.rows = rows
+        self.labels = row_labels.astype(np.float32)
+        logging.info("Dataset of {} light curves, {} positive".format(len(self.rows), int(self.labels.sum())))
+
+    def __len__(self):
+        """
+        Number of batches per epoch
+        """
+        return int(np.ceil(len(self.rows) / self.batch_size))
+
+    def shuffled_order(self):
+        """
+        Draws the order of the light curves for an epoch, shuffled by shard
+
+        Returns
+        -------
+        numpy.ndarray of int
+            the positions in `rows` of the light curves, in the order they are visited
+        """
+        shards = [np.arange(start, min(start + self.shard_size, len(self.rows))) for start in range(0, len(self.rows), self.shard_size)]
+        order = []
+        for shard in self.rng.permutation(len(shards)):
+            order.append(self.rng.permutation(shards[shard]))
+        return np.concatenate(order) if order else np.zeros(0, dtype=np.int64)
+
+    def make_batch(self, positions):
+        """
+        Assembles a batch
+
+        Parameters
+        ----------
+        positions: numpy.ndarray of int
+            the positions in `rows` of the light curves of the batch
+
+        Returns
+        -------
+        (numpy.ndarray, numpy.ndarray)
+            the (batch, length, 1) float32 fluxes and the (batch,) float32 labels
+        """
+        batch = np.empty((len(positions), self.length, 1), dtype=np.float32)
+        for (i, position) in enumerate(positions):
+            (time, flux, _) = self.store.get_row(self.rows[position])
+            batch[i, :, 0] = to_fixed_length(time, self.transform(flux), self.length, self.mode)
+        return batch, self.labels[positions]
+
+    def epoch(self, shuffle=True):
+        """
+        Iterates over the batches of an epoch, assembled in background threads
+
+        Parameters
+        ----------
+        shuffle: bool
+            False to visit the light curves in the order of the store
+
+        Yields
+        ------
+        (numpy.ndarray, numpy.ndarray)
+            the (batch, length, 1) float32 fluxes and the (batch,) float32 labels
+        """
+        order = self.shuffled_order() if shuffle else np.arange(len(self.rows))
+        batches = [order[start:start + self.batch_size] for start in range(0, len(order), self.batch_size)]
+
+        with ThreadPoolExecutor(max_workers=max(self.n_threads, 1)) as executor:
+            for batch in map_bounded(executor, self.make_batch, batches, max(self.prefetch, 1)):
+                yield batch
+
+    def generator(self, shuffle=True):
+        """
+        Endless iteration over the epochs, to be given to `model.fit()` with `steps_per_epoch=len(dataset)`
+
+        Parameters
+        ----------
+        shuffle: bool
+            False to visit the light curves in the order of the store
+
+        Yields
+        ------
+        (numpy.ndarray, numpy.ndarray)
+            the (batch, length, 1) float32 fluxes and the (batch,) float32 labels
+        """
+        while True:
+            yield from self.epoch(shuffle)
+
+    def as_tf_dataset(self, shuffle=True):
+        """
+        Wraps the epochs in a `tf.data.Dataset`. TensorFlow is only imported when this method is called.
+
+        Parameters
+        ----------
+        shuffle: bool
+            False to visit the light curves in the order of the store
+
+        Returns
+        -------
+        tf.data.Dataset
+            the dataset of one epoch, use its `repeat()` method for several epochs
+        """
+        import tensorflow as tf
+
+        return tf.data.Dataset.from_generator(
+            lambda: self.epoch(shuffle),
+            output_signature=(
+                tf.TensorSpec(shape=(None, self.length, 1), dtype=tf.float32),
+                tf.TensorSpec(shape=(None,), dtype=tf.float32),
+            ),
+        )
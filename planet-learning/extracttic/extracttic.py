@@ -1,6 +1,8 @@
 """Module to extract metadata from TESS `.fits` light curves files headers
 
-This module reads the headers of light curves files from TESS and exports them into a dictionary, saved in a `.pickle` file.
+This module reads the headers of light curves files from TESS and exports them into a columnar TIC index (see `tic_index.py`).
+The sector folders are read one after another, the data of each sector being written in a shard as soon as it is read,
+then the shards are merged into the TIC index (see `shards.py`) : the memory needed does not depend on the number of sectors.
 The extracted fields are the following :
     - TICID
     - TICVER
@@ -9,16 +11,24 @@ The path to the `.fits` file is also provided in each entry.
 Find more information about the TESS `.fits` files here : https://archive.stsci.edu/files/live/sites/mast/files/home/missions-and-data/active-missions/tess/_documents/EXP-TESS-ARC-ICD-TM-0014.pdf
 
 """
+import io
 import logging
 import os
 import pickle
+import shutil
 import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
 from os.path import isdir, isfile, join
 
-import matplotlib.pyplot as plt
-import numpy as np
-from astropy.io import fits
+from ..pipeline import metrics
+from ..pipeline.prefetch import prefetch
+from .fits_header import read_header_blocks, read_header_cards
+from .shards import compact_shards, get_shards_generations, get_shards_path, is_compacted, iter_light_curve_files, load_shard_files, write_shard
+from .tic_index import CORRUPTED
 
+# Fields of the primary header extracted from the light curves files
+METADATA_KEYWORDS = ('TICID', 'SECTOR', 'TICVER')
 
 def load_pickle(path):
     """Load data from a `.pickle` file.
@@ -52,27 +62,37 @@ def load_pickle(path):
     return data
 
 
-def save_to_pickle(data, path):
-    """Save a python object into a `.pickle` file.
-    
-    Data is saved in binary format.
+def read_header_with_astropy(light_curve_path):
+    """Read the extracted fields of a light curve `.fits` file with astropy.
+
+    The whole HDU list is opened, which is slower than `read_primary_header()` but copes with files
+    the latter considers as malformed.
 
     Parameters
     ----------
-    data: any python object
-        object to save
-    path: path-like object
-        path to the file to write
+    light_curve_path: path-like object
+        path to the light curve `.fits` file
+
+    Raises
+    ------
+    KeyError
+        if one of the fields is missing from the primary header
+
+    Returns
+    -------
+    dict
+        the (field, value) pairs
 
     """
-    # Write the data into a pickle file
-    logging.info("Saving data")
-    with open(path, 'wb') as p:
-        pickle.dump(data, p)
-    logging.info("Data saved in {}".format(path))
+    # astropy is only imported for the files the header reader cannot read
+    from astropy.io import fits
+
+    with fits.open(light_curve_path, mode="readonly") as hdulist:
+        header = hdulist[0].header
+        return {keyword: header[keyword] for keyword in METADATA_KEYWORDS}
 
 
-def get_light_curve_metadata(light_curve_path):
+def get_light_curve_metadata(light_curve_path, header_blocks=None):
     """Retrieve metadata from a light curve `.fits` file.
 
     A description the content of the light curves files can be found here :
@@ -81,6 +101,9 @@ def get_light_curve_metadata(light_curve_path):
         - TICID
         - TICVER
         - SECTOR
+    Only the primary header is read from the file, or parsed from `header_blocks` if it was read ahead.
+    astropy is used as a fallback if it appears malformed.
+    The duration of the reads and the number of bytes of the headers are recorded in the metrics.
     The extracted data is returned as an int representing the TICID and a dict with the following structure :
         {'SECTOR': int, 'TICVER': int}
     In the case where the file could not be read an bare error is raised.
@@ -90,6 +113,8 @@ def get_light_curve_metadata(light_curve_path):
     ----------
     light_curve_path: path-like object
         path to the light curve `.fits` file
+    header_blocks: bytes
+        the blocks of the primary header, read ahead by `fits_header.read_header_blocks()`. Read from the file if None.
 
     Raises
     ------
@@ -104,10 +129,27 @@ def get_light_curve_metadata(light_curve_path):
     """
     metadata = {}
     try :
-        with fits.open(light_curve_path, mode="readonly") as hdulist:
-            TICID = hdulist[0].header['TICID']
-            metadata['SECTOR'] = hdulist[0].header['SECTOR']
-            metadata['TICVER'] = hdulist[0].header['TICVER']
+        try:
+            if header_blocks is None:
+                with metrics.timer("fits_open_seconds", stage="extracttic", reader="header"):
+                    with open(light_curve_path, 'rb') as f:
+                        header = read_header_cards(f, METADATA_KEYWORDS)
+                        metrics.increment("bytes_read_total", f.tell(), stage="extracttic")
+            else:
+                with metrics.timer("fits_open_seconds", stage="extracttic", reader="prefetched"):
+                    header = read_header_cards(io.BytesIO(header_blocks), METADATA_KEYWORDS)
+                metrics.increment("bytes_read_total", len(header_blocks), stage="extracttic")
+            if len(header) != len(METADATA_KEYWORDS):
+                raise ValueError("Missing fields in header")
+        # The header is not understood by the fast reader
+        except ValueError as e:
+            logging.debug("Reading {} with astropy : {}".format(light_curve_path, e))
+            with metrics.timer("fits_open_seconds", stage="extracttic", reader="astropy"):
+                header = read_header_with_astropy(light_curve_path)
+
+        TICID = header['TICID']
+        metadata['SECTOR'] = header['SECTOR']
+        metadata['TICVER'] = header['TICVER']
     # This exception is raised when reading a corrupted file
     except OSError as e:
         logging.warning("OSError : {}".format(e))
@@ -121,128 +163,288 @@ def get_light_curve_metadata(light_curve_path):
     return TICID, metadata
 
 
-def extracttic(light_curves_path, pickle_path, force_extract=False):
-    """Retrieve some fields in the headers of TESS `.fits` light curve files and exports them in a dictionary.
+def read_light_curve_entry(light_curve_path, header_blocks=None):
+    """Build the extracted entry of a single light curve `.fits` file.
 
-    Metadata of all files under `light_curve_path` are extracted into a dictionary.
-    The keys of the dictionary are the TICID of the observed objects. The values of
-    the entries are lists containing one or more dictionaries. One for each observation.
-    The structure of an entry is :
-        {int: [{'TICVER': int, 'SECTOR': int, 'path': str},]}
-    If an exception is raised while readind the file, the `'TICVER'` and `'SECTOR'` fields are not present in the entry.
+    Wraps `get_light_curve_metadata()` so that a corrupted file does not raise but
+    is returned under the `None` TICID with an empty metadata dict.
+    The path to the file is added to the metadata in both cases.
+
+    Parameters
+    ----------
+    light_curve_path: path-like object
+        path to the light curve `.fits` file
+    header_blocks: bytes
+        the blocks of the primary header if they were read ahead, None to read them from the file
+
+    Returns
+    -------
+    (int or None, dict)
+        The TICID (None if the file could not be read) and the metadata of the file
+
+    """
+    try:
+        TICID, metadata = get_light_curve_metadata(light_curve_path, header_blocks)
+    # If the file cannot be read
+    except RuntimeError:
+        TICID = None
+        metadata = {}
+
+    metadata['path'] = light_curve_path
+
+    return TICID, metadata
+
+
+def extract_light_curves_metadata(light_curve_paths, n_workers=1, prefetch_depth=0):
+    """Read the metadata of several light curve `.fits` files.
+
+    When `n_workers` is greater than 1 the headers are read concurrently by a pool of threads,
+    reading a header being mostly bound by the latency of the storage (NFS).
+    Otherwise the header blocks of the next `prefetch_depth` files are read ahead in background threads while the
+    current one is parsed (see `pipeline.prefetch`).
+    The entries are yielded in the same order as `light_curve_paths` whatever the number of workers,
+    so that the extracted data does not depend on the scheduling of the reads.
+
+    Parameters
+    ----------
+    light_curve_paths: list of path-like objects
+        paths to the light curve `.fits` files
+    n_workers: int
+        number of files read at once
+    prefetch_depth: int
+        number of headers read ahead when the files are read one after another, 0 not to read ahead
+
+    Yields
+    ------
+    (int or None, dict)
+        The entry of each file, as returned by `read_light_curve_entry()`
+
+    """
+    if n_workers > 1:
+        with ThreadPoolExecutor(max_workers=n_workers) as executor:
+            # Executor.map returns the results in the order of the inputs
+            for entry in executor.map(read_light_curve_entry, light_curve_paths):
+                yield entry
+    else:
+        for (light_curve_path, header_blocks) in prefetch(light_curve_paths, read_header_blocks, prefetch_depth, stage="extracttic"):
+            yield read_light_curve_entry(light_curve_path, header_blocks)
+
+
+def get_manifest_path(index_path):
+    """Get the path of the manifest associated to an extracted TIC index by the previous versions.
+
+    The manifest was stored next to the extracted data, e.g. `tic_index_manifest.pickle` for `tic_index`.
+
+    Parameters
+    ----------
+    index_path: path-like object
+        path to the folder of the TIC index used to store the extracted data
+
+    Returns
+    -------
+    str
+        path to the manifest
+
+    """
+    return "{}_manifest.pickle".format(os.path.splitext(os.path.normpath(index_path))[0])
+
+
+def get_partial_manifest_path(index_path):
+    """Get the path of the manifest of an extraction interrupted with the previous versions.
+
+    Parameters
+    ----------
+    index_path: path-like object
+        path to the folder of the TIC index used to store the extracted data
+
+    Returns
+    -------
+    str
+        path to the partial manifest
+
+    """
+    return "{}.partial".format(get_manifest_path(index_path))
+
+
+def migrate_manifest(index_path, shards_path):
+    """Convert the manifest of a previous version into shards, so that the files it records are not read again.
+
+    The manifest was structured as {path: {'stat': (size, mtime), 'TICID': int, 'metadata': dict}}.
+    It is removed once converted.
+
+    Parameters
+    ----------
+    index_path: path-like object
+        path to the folder of the TIC index
+    shards_path: path-like object
+        path to the folder of the shards
+
+    """
+    manifest_paths = [path for path in (get_partial_manifest_path(index_path), get_manifest_path(index_path)) if isfile(path)]
+    if not manifest_paths:
+        return
+
+    # The manifest of an interrupted extraction is the most recent one
+    if not isdir(shards_path):
+        logging.info("Converting the manifest {} into shards".format(manifest_paths[0]))
+        sectors = {}
+        for (path, entry) in load_pickle(manifest_paths[0]).items():
+            metadata = entry['metadata']
+            TICID = CORRUPTED if entry['TICID'] is None else entry['TICID']
+            row = (TICID, metadata.get('SECTOR', CORRUPTED), metadata.get('TICVER', CORRUPTED), os.path.basename(path)) + tuple(entry['stat'])
+            sectors.setdefault(os.path.dirname(path), []).append(row)
+
+        for (sector_path, rows) in sectors.items():
+            write_shard(join(shards_path, os.path.basename(sector_path)), sector_path, rows)
+
+    for path in manifest_paths:
+        os.remove(path)
+
+
+def extract_sector(sector_path, shard_path, force_extract=False, n_workers=1, prefetch_depth=0):
+    """Extract the metadata of the light curves of a sector folder into its shard.
+
+    The folder is listed as it is read. Only the files that are not in the shard of the previous extraction, or whose size
+    or modification time changed, are opened. The shard is written again if a file was read or deleted.
+
+    Parameters
+    ----------
+    sector_path: path-like object
+        path to the sector folder
+    shard_path: path-like object
+        path to the folder of its shard
+    force_extract: bool
+        True to read all the files, whatever the previous shard
+    n_workers: int
+        number of light curve files read in parallel
+    prefetch_depth: int
+        number of headers read ahead, see `extract_light_curves_metadata()`
+
+    Returns
+    -------
+    (int, int, int) or None
+        the number of light curves read, of corrupted files and of deleted files. None if the sector did not change.
+
+    """
+    previous_files = {} if force_extract else load_shard_files(shard_path)
+
+    rows = []
+    new_files = []
+    for (light_curve_path, size, mtime) in iter_light_curve_files(sector_path):
+        previous = previous_files.pop(light_curve_path, None)
+        if previous is not None and previous[4:] == (size, mtime):
+            rows.append(previous)
+        else:
+            new_files.append((light_curve_path, size, mtime))
+
+    # The files remaining in the previous shard were deleted from the storage
+    if not new_files and not previous_files and isdir(shard_path):
+        return None
+
+    logging.info("Starting {}".format(os.path.basename(sector_path)))
+    logging.info("Number of light curve files to read : {}".format(len(new_files)))
+
+    n = 0
+    e = 0
+    new_files.sort()
+    entries = extract_light_curves_metadata([light_curve_path for (light_curve_path, _, _) in new_files], n_workers, prefetch_depth)
+    for ((light_curve_path, size, mtime), (TICID, metadata)) in zip(new_files, entries):
+        name = os.path.basename(light_curve_path)
+        # Corrupted files are stored under the CORRUPTED TICID
+        if TICID is None:
+            e += 1
+            rows.append((CORRUPTED, CORRUPTED, CORRUPTED, name, size, mtime))
+        else:
+            n += 1
+            rows.append((int(TICID), int(metadata['SECTOR']), int(metadata['TICVER']), name, size, mtime))
+
+    write_shard(shard_path, sector_path, rows)
+
+    return n, e, len(previous_files)
+
+
+def extracttic(light_curves_path, index_path, force_extract=False, n_workers=1, prefetch_depth=0):
+    """Retrieve some fields in the headers of TESS `.fits` light curve files and exports them in a TIC index.
+
+    The TIC index records, for each light curve file, the TICID of the observed object, its TICVER and SECTOR,
+    and the path to the file. If an exception is raised while readind the file, it is recorded under the `CORRUPTED` TICID.
+    See `tic_index.TICIndex` to read it.
+
+    The extraction is streamed : the sector folders are read one after another, the data of each sector being written
+    in its shard as soon as the sector is read. The shards are then merged into the TIC index (see `shards.py`).
+    The memory needed does not depend on the number of sectors, and an interrupted extraction resumes after the last
+    completed sector.
+
+    The extraction is incremental : the shards record the size and modification time of every file read.
+    Only the files that are new or have changed since the last run are read, and the entries of the files
+    that were deleted from the storage are dropped.
 
     Parameters
     ----------
     light_curve_path: path-like object
         path to the folder containing the light curves
-    pickle_path: path-like object
-        path to the `.pickle` file used to store the extracted data
+    index_path: path-like object
+        path to the folder of the TIC index used to store the extracted data
     force_extract: bool
-        True to force TIC extraction even if up-to-date data is found on storage
+        True to force TIC extraction of all the files even if up-to-date data is found on storage
+    n_workers: int
+        number of light curve files read in parallel
+    prefetch_depth: int
+        number of headers read ahead when the files are read one after another, see `extract_light_curves_metadata()`
 
     """
     sector_dirs = sorted([d for d in os.listdir(light_curves_path) if isdir(join(light_curves_path, d))])
     # get sector numbers
     sectors = set([int(s.split("_")[1]) for s in sector_dirs])
-    # dict to store the light curves' metadata
-    light_curves = {}
+    shards_path = get_shards_path(index_path)
 
     logging.info("#############################################")
     logging.info("#### Extract TIC from light curves files ####")
     logging.info("#############################################")
     logging.info("The following observation sectors are available on storage: {}".format((sectors)))
 
-    # Load previously extracted data
-    try:
-        existing_data = load_pickle(pickle_path)
-        existing_sectors = set()
-
-        # Get the sectors present in the extracted data
-        for tic, existing_lcs in existing_data.items():
-            for lc in existing_lcs:
-                if tic != None:
-                    existing_sectors.add(lc['SECTOR'])
-        logging.info("Found sectors {} in extracted data".format((existing_sectors)))
-
-        if existing_sectors == sectors:
-            if force_extract:
-                logging.info("No new data available, extracting TIC again anyway")
-                logging.info("--------------------------------------------------")
-            else:
-                logging.info("No new data available, skipping TIC extraction")
-                logging.info("----------------------------------------------")
-                return
-        else:
-            new_sectors = sectors.difference(existing_sectors)
-            logging.info("New sectors available : {}".format(new_sectors))
-            if force_extract:
-                logging.info("Extracting TIC again anyway")
-                logging.info("----------------------")
-            else:
-                new_sector_dirs = []
-
-                for s in new_sectors:
-                    s_dir = [d for d in sector_dirs if str(s) in d][0]
-                    new_sector_dirs.append(s_dir)
-                
-                sector_dirs = new_sector_dirs
-                logging.info("Starting extraction for new sectors")
-                logging.info("-----------------------------------")
-
-    # Exception raised by load_pickle() if the requested file is not found on storage
-    except EnvironmentError:
-        existing_data = {}
-        logging.info("Starting TIC extraction")
-        logging.info("-----------------------")
+    # The manifest of a previous version is converted into shards
+    migrate_manifest(index_path, shards_path)
+
+    if force_extract:
+        logging.info("Extracting TIC again from all files")
 
+    # The shards of the sector folders deleted from the storage are dropped, along with the leftovers of interrupted writes
+    if isdir(shards_path):
+        for shard in os.listdir(shards_path):
+            if shard not in sector_dirs:
+                shutil.rmtree(join(shards_path, shard))
+
+    extraction_start = time.time()
+    nb_read = 0
     for sector in sector_dirs:
-        n = 0
-        e = 0
-        sector_dir_path = join(light_curves_path, sector)
-        light_curve_files = [f for f in os.listdir(sector_dir_path) if isfile(join(sector_dir_path, f))]
-        lc_in_sector = len(light_curve_files)
-
-        logging.info("Starting {}".format(sector))
-        logging.info("Number of light curve files found : {}".format(lc_in_sector))
-        
-        for light_curve in light_curve_files:
-            light_curve_path = join(sector_dir_path, light_curve)
-
-            try:
-                TICID, metadata = get_light_curve_metadata(light_curve_path)
-                n += 1
-            # If the file cannot be read
-            except RuntimeError:
-                # Paths of corrupted files is stored under the None key
-                TICID = None
-                metadata = {}
-                e += 1
-
-            metadata['path'] = light_curve_path
-
-            if TICID in light_curves:
-                light_curves[TICID] += [metadata]
-            else:
-                light_curves[TICID] = [metadata]
+        sector_start = time.time()
+        result = extract_sector(join(light_curves_path, sector), join(shards_path, sector), force_extract, n_workers, prefetch_depth)
+        if result is None:
+            continue
 
+        (n, e, d) = result
+        nb_read += n + e
         logging.info("Number of light curves added : {}".format(n))
         logging.info("Number of light curves not added : {}".format(e))
-    
-    # Add the loaded data to the newly extracted data
-    light_curves.update(existing_data)
-    
-    # The number of observed objects is the number of entries in the light_curves dictionary minus one because the key "None" holds the paths to corrupted files
-    object_number = len(light_curves) - 1
-    # Count the nomber of light curves
-    lc_number = 0
-    for tic, data in light_curves.items():
-        if tic != None:
-            for lc in data:
-                lc_number += 1
+        logging.info("Number of deleted files : {}".format(d))
+        metrics.observe("extracttic_sector_seconds", time.time() - sector_start)
+        metrics.increment("extracttic_files_total", n, status="read")
+        metrics.increment("extracttic_files_total", e, status="corrupted")
+
+    if is_compacted(index_path, get_shards_generations(shards_path, sector_dirs)):
+        logging.info("No new data available, skipping TIC extraction")
+        logging.info("----------------------------------------------")
+        return
+
+    metrics.record_throughput("extracttic_files_per_second", nb_read, time.time() - extraction_start)
+
+    logging.info("Saving data")
+    with metrics.timer("extracttic_compaction_seconds"):
+        (lc_number, object_number) = compact_shards(shards_path, sector_dirs, index_path)
+    logging.info("Data saved in {}".format(index_path))
 
     logging.info("Finished extracting data")
     logging.info("------------------------")
     logging.info("Total number of light curve files processed : {}".format(lc_number))
     logging.info("Total number of objects observed : {}".format(object_number))
-
-    save_to_pickle(light_curves, pickle_path)
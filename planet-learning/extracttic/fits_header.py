@@ -0,0 +1,175 @@
+"""Minimal reader for the primary header of `.fits` files
+
+A `.fits` file starts with its primary header, stored as 2880 bytes blocks of 36 cards of 80 ASCII characters.
+The header ends with the `END` card. This module reads these blocks one after another and stops as soon
+as the `END` card is found, without loading nor parsing the rest of the file.
+Only the values of the requested keywords are decoded.
+
+Find more information about the format of the headers here : https://fits.gsfc.nasa.gov/fits_standard.html
+
+"""
+BLOCK_SIZE = 2880
+CARD_SIZE = 80
+# Primary headers of TESS light curves fit in a few blocks, a header longer than this is considered malformed
+MAX_HEADER_BLOCKS = 64
+
+
+def parse_card_value(raw_value):
+    """Decode the value of a header card.
+
+    Handles the fixed formats of the FITS standard : strings, logicals, integers and floats.
+
+    Parameters
+    ----------
+    raw_value: str
+        the content of the card after the value indicator `= `
+
+    Raises
+    ------
+    ValueError
+        if the value cannot be decoded
+
+    Returns
+    -------
+    str, bool, int or float
+        the decoded value
+
+    """
+    raw_value = raw_value.strip()
+
+    # Strings are quoted, a quote inside the string is written twice
+    if raw_value.startswith("'"):
+        end = 1
+        while True:
+            end = raw_value.find("'", end)
+            if end == -1:
+                raise ValueError("Unterminated string value : {}".format(raw_value))
+            if raw_value[end + 1:end + 2] == "'":
+                end += 2
+            else:
+                break
+        return raw_value[1:end].replace("''", "'").rstrip()
+
+    # Remove the comment of the card
+    raw_value = raw_value.split('/', 1)[0].strip()
+
+    if raw_value == 'T':
+        return True
+    if raw_value == 'F':
+        return False
+    try:
+        return int(raw_value)
+    except ValueError:
+        # Exponents may be written with a D in FITS
+        return float(raw_value.replace('D', 'E'))
+
+
+def read_header_cards(fileobj, keywords):
+    """Read the values of some keywords in the primary header of an opened `.fits` file.
+
+    Parameters
+    ----------
+    fileobj: binary file-like object
+        the `.fits` file, positioned at its start
+    keywords: iterable of str
+        the keywords to read
+
+    Raises
+    ------
+    ValueError
+        if the header is malformed : not starting with `SIMPLE`, truncated, without `END` card
+        or with an undecodable value for one of the requested keywords
+
+    Returns
+    -------
+    dict
+        the (keyword, value) pairs found in the header.
+        Requested keywords missing from the header are not present.
+
+    """
+    keywords = set(keywords)
+    values = {}
+
+    for block_number in range(MAX_HEADER_BLOCKS):
+        block = fileobj.read(BLOCK_SIZE)
+        if len(block) != BLOCK_SIZE:
+            raise ValueError("Truncated header")
+        if block_number == 0 and not block.startswith(b'SIMPLE  '):
+            raise ValueError("Not a FITS primary header")
+
+        try:
+            block = block.decode('ascii')
+        except UnicodeDecodeError:
+            raise ValueError("Non ASCII header")
+
+        for start in range(0, BLOCK_SIZE, CARD_SIZE):
+            card = block[start:start + CARD_SIZE]
+            keyword = card[:8].rstrip()
+
+            if keyword == 'END':
+                return values
+            if keyword in keywords and card[8:10] == '= ':
+                values[keyword] = parse_card_value(card[10:])
+
+    raise ValueError("No END card found in the first {} blocks".format(MAX_HEADER_BLOCKS))
+
+
+def read_primary_header(path, keywords):
+    """Read the values of some keywords in the primary header of a `.fits` file.
+
+    Only the blocks of the primary header are read from the storage.
+
+    Parameters
+    ----------
+    path: path-like object
+        path to the `.fits` file
+    keywords: iterable of str
+        the keywords to read
+
+    Raises
+    ------
+    ValueError
+        if the header is malformed
+    OSError
+        if the file cannot be opened
+
+    Returns
+    -------
+    dict
+        the (keyword, value) pairs found in the header
+
+    """
+    with open(path, 'rb') as f:
+        return read_header_cards(f, keywords)
+
+
+def read_header_blocks(path):
+    """Read the blocks of the primary header of a `.fits` file, without parsing them.
+
+    The blocks are read until the one holding the `END` card, to be parsed later with `read_header_cards()`,
+    e.g. when they are read ahead by `pipeline.prefetch`.
+
+    Parameters
+    ----------
+    path: path-like object
+        path to the `.fits` file
+
+    Raises
+    ------
+    OSError
+        if the file cannot be opened
+
+    Returns
+    -------
+    bytes
+        the blocks, truncated or without `END` card if the header is malformed
+
+    """
+    blocks = []
+    with open(path, 'rb') as f:
+        for _ in range(MAX_HEADER_BLOCKS):
+            block = f.read(BLOCK_SIZE)
+            blocks.append(block)
+            if len(block) != BLOCK_SIZE or any(block[start:start + 8] == b'END     ' for start in range(0, BLOCK_SIZE, CARD_SIZE)):
+                break
+    return b''.join(blocks)
@@ -0,0 +1,331 @@
+"""Per-sector shards of the extracted TIC data
+
+The extraction writes the data of each sector folder in a shard as soon as the sector is read. A shard is a columnar TIC index
+(see `tic_index.py`) holding the files of the sector only, with two more columns recording the size and modification time of
+each file (`size.npy` and `mtime.npy`), so that the files that did not change are not read again by the next extraction.
+The shards are stored in `<index>_shards/<sector folder>`. Each one is replaced at once when its sector is read :
+an interrupted extraction resumes after the last completed sector.
+
+`compact_shards()` merges the shards into the TIC index read by the other stages. The rows are merged by chunks of TICIDs,
+so that the memory needed does not depend on the number of sectors.
+
+"""
+import json
+import os
+import shutil
+import time
+from os.path import isdir, isfile, join
+
+import numpy as np
+
+from .tic_index import CORRUPTED, FORMAT_VERSION, load_tic_index, replace_folder
+
+# Maximum number of rows merged at once by the compaction
+COMPACTION_CHUNK_ROWS = 1000000
+
+
+def get_shards_path(index_path):
+    """Get the path of the folder of the shards associated to a TIC index.
+
+    The shards are stored next to the index, e.g. in `tic_index_shards` for `tic_index`.
+
+    Parameters
+    ----------
+    index_path: path-like object
+        path to the folder of the TIC index
+
+    Returns
+    -------
+    str
+        path to the folder of the shards
+
+    """
+    return "{}_shards".format(os.path.normpath(index_path))
+
+
+def iter_light_curve_files(sector_path):
+    """List the files of a sector folder with their size and modification time, as the folder is read.
+
+    Parameters
+    ----------
+    sector_path: path-like object
+        path to the sector folder
+
+    Yields
+    ------
+    (str, int, int)
+        the path to the file, its size and its modification time in ns
+
+    """
+    with os.scandir(sector_path) as entries:
+        for entry in entries:
+            if entry.is_file():
+                stat = entry.stat()
+                yield entry.path, stat.st_size, stat.st_mtime_ns
+
+
+def write_shard(shard_path, sector_path, rows):
+    """Write the shard of a sector, replacing the previous one at once.
+
+    Parameters
+    ----------
+    shard_path: path-like object
+        path to the folder of the shard
+    sector_path: path-like object
+        path to the sector folder, the folder of all the files of the shard
+    rows: list of (int, int, int, str, int, int)
+        the TICID, sector and TICVER (CORRUPTED for the files that could not be read), name, size and modification time
+        of each file
+
+    """
+    rows = sorted(rows)
+    names = [row[3].encode('utf-8') for row in rows]
+    name_offsets = np.zeros(len(rows) + 1, dtype=np.int64)
+    np.cumsum([len(name) for name in names], out=name_offsets[1:])
+
+    ticid = np.array([row[0] for row in rows], dtype=np.int64)
+    columns = {
+        'ticid': ticid,
+        'sector': np.array([row[1] for row in rows], dtype=np.int32),
+        'ticver': np.array([row[2] for row in rows], dtype=np.int32),
+        'directory': np.zeros(len(rows), dtype=np.int32),
+        'name_offsets': name_offsets,
+        'names': np.frombuffer(b''.join(names), dtype=np.uint8),
+        'size': np.array([row[4] for row in rows], dtype=np.int64),
+        'mtime': np.array([row[5] for row in rows], dtype=np.int64),
+    }
+    meta = {
+        'version': FORMAT_VERSION,
+        'directories': [str(sector_path)],
+        'n_light_curves': int(np.count_nonzero(ticid != CORRUPTED)),
+        'n_objects': len(np.unique(ticid[ticid != CORRUPTED])),
+        # Identifies this version of the shard in the compacted index
+        'generation': time.time_ns(),
+    }
+
+    tmp_path = "{}.tmp".format(shard_path)
+    if isdir(tmp_path):
+        shutil.rmtree(tmp_path)
+    os.makedirs(tmp_path)
+
+    for (name, column) in columns.items():
+        np.save(join(tmp_path, "{}.npy".format(name)), column)
+    with open(join(tmp_path, 'meta.json'), 'w') as f:
+        json.dump(meta, f)
+
+    replace_folder(tmp_path, shard_path)
+
+
+def load_shard_files(shard_path):
+    """Load the files recorded in the shard of a sector.
+
+    Parameters
+    ----------
+    shard_path: path-like object
+        path to the folder of the shard
+
+    Returns
+    -------
+    dict
+        the (path, (TICID, sector, TICVER, name, size, modification time)) pairs, as given to `write_shard()`.
+        Empty if there is no shard.
+
+    """
+    try:
+        shard = load_tic_index(shard_path)
+    except EnvironmentError:
+        return {}
+
+    size = np.load(join(shard_path, 'size.npy'))
+    mtime = np.load(join(shard_path, 'mtime.npy'))
+    files = {}
+    for row in range(len(shard)):
+        path = shard.get_path(row)
+        files[path] = (int(shard.ticid[row]), int(shard.sector[row]), int(shard.ticver[row]), os.path.basename(path), int(size[row]), int(mtime[row]))
+
+    return files
+
+
+def get_shards_generations(shards_path, sector_dirs):
+    """Get the version of the shards of some sectors.
+
+    Parameters
+    ----------
+    shards_path: path-like object
+        path to the folder of the shards
+    sector_dirs: list of str
+        names of the sector folders
+
+    Returns
+    -------
+    dict
+        the (sector folder, generation of its shard) pairs, for the sectors having a shard
+
+    """
+    generations = {}
+    for sector in sector_dirs:
+        meta_path = join(shards_path, sector, 'meta.json')
+        if isfile(meta_path):
+            with open(meta_path) as f:
+                generations[sector] = json.load(f)['generation']
+    return generations
+
+
+def is_compacted(index_path, generations):
+    """Tell whether a TIC index was compacted from the current shards.
+
+    Parameters
+    ----------
+    index_path: path-like object
+        path to the folder of the TIC index
+    generations: dict
+        the generations of the current shards, given by `get_shards_generations()`
+
+    Returns
+    -------
+    bool
+        True if the index holds exactly the current shards
+
+    """
+    meta_path = join(index_path, 'meta.json')
+    if not isfile(meta_path):
+        return False
+    with open(meta_path) as f:
+        return json.load(f).get('shards') == generations
+
+
+def get_chunk_bounds(shards, chunk_rows):
+    """Split the TICIDs of the shards in ranges holding at most about `chunk_rows` rows.
+
+    Parameters
+    ----------
+    shards: list of TICIndex
+        the shards
+    chunk_rows: int
+        the maximum number of rows of a range
+
+    Returns
+    -------
+    list of int
+        the TICIDs starting each range but the first one, increasing
+
+    """
+    # With one sample every `step` rows of each shard, a range holding `len(shards)` samples holds at most `chunk_rows` rows
+    step = max(chunk_rows // (2 * max(len(shards), 1)), 1)
+    samples = np.sort(np.concatenate([np.asarray(shard.ticid[::step]) for shard in shards] + [np.zeros(0, dtype=np.int64)]))
+    return [int(bound) for bound in np.unique(samples[::max(len(shards), 1)])[1:]]
+
+
+def compact_shards(shards_path, sector_dirs, index_path, chunk_rows=COMPACTION_CHUNK_ROWS):
+    """Merge the shards of some sectors into a TIC index, replacing the previous one at once.
+
+    The columns of the index are written in memory-mapped files, one range of TICIDs after another :
+    at most `chunk_rows` rows are held in memory.
+
+    Parameters
+    ----------
+    shards_path: path-like object
+        path to the folder of the shards
+    sector_dirs: list of str
+        names of the sector folders whose shards are merged
+    index_path: path-like object
+        path to the folder of the TIC index
+    chunk_rows: int
+        maximum number of rows merged at once
+
+    Returns
+    -------
+    (int, int)
+        the number of light curves and of observed objects in the index
+
+    """
+    generations = get_shards_generations(shards_path, sector_dirs)
+    shards = [load_tic_index(join(shards_path, sector)) for sector in sector_dirs if sector in generations]
+    n_rows = sum(len(shard) for shard in shards)
+    n_bytes = sum(len(shard.names) for shard in shards)
+
+    tmp_path = "{}.tmp".format(index_path)
+    if isdir(tmp_path):
+        shutil.rmtree(tmp_path)
+    os.makedirs(tmp_path)
+
+    def open_column(name, dtype, length):
+        return np.lib.format.open_memmap(join(tmp_path, "{}.npy".format(name)), mode='w+', dtype=dtype, shape=(length,))
+
+    columns = {
+        'ticid': open_column('ticid', np.int64, n_rows),
+        'sector': open_column('sector', np.int32, n_rows),
+        'ticver': open_column('ticver', np.int32, n_rows),
+        'directory': open_column('directory', np.int32, n_rows),
+        'name_offsets': open_column('name_offsets', np.int64, n_rows + 1),
+        'names': open_column('names', np.uint8, n_bytes),
+    }
+    columns['name_offsets'][0] = 0
+
+    (position, n_light_curves, n_objects) = (0, 0, 0)
+    bounds = get_chunk_bounds(shards, chunk_rows)
+    for (low, high) in zip([None] + bounds, bounds + [None]):
+        chunk = {name: [] for name in ('ticid', 'sector', 'ticver', 'directory', 'name_starts', 'name_stops', 'names')}
+
+        # Rows of each shard in [low, high), the shards being sorted by TICID
+        for (shard_number, shard) in enumerate(shards):
+            start = 0 if low is None else int(np.searchsorted(shard.ticid, low, side='left'))
+            stop = len(shard) if high is None else int(np.searchsorted(shard.ticid, high, side='left'))
+            if start == stop:
+                continue
+
+            offsets = np.asarray(shard.name_offsets[start:stop + 1])
+            # Position of the names in the concatenated names of the chunk
+            first_byte = sum(len(names) for names in chunk['names'])
+            chunk['name_starts'].append(offsets[:-1] - offsets[0] + first_byte)
+            chunk['name_stops'].append(offsets[1:] - offsets[0] + first_byte)
+            chunk['names'].append(np.asarray(shard.names[offsets[0]:offsets[-1]]))
+            for name in ('ticid', 'sector', 'ticver'):
+                chunk[name].append(np.asarray(getattr(shard, name)[start:stop]))
+            chunk['directory'].append(np.full(stop - start, shard_number, dtype=np.int32))
+
+        if not chunk['ticid']:
+            continue
+
+        chunk = {name: np.concatenate(values) for (name, values) in chunk.items()}
+        # Sorted by TICID then sector, the rows of a shard keeping their order
+        order = np.lexsort((np.arange(len(chunk['ticid'])), chunk['directory'], chunk['ticver'], chunk['sector'], chunk['ticid']))
+        length = len(order)
+
+        for name in ('ticid', 'sector', 'ticver', 'directory'):
+            columns[name][position:position + length] = chunk[name][order]
+
+        # Gathering of the names in the new order
+        (name_starts, name_stops) = (chunk['name_starts'][order], chunk['name_stops'][order])
+        name_lengths = name_stops - name_starts
+        new_offsets = np.cumsum(name_lengths)
+        byte_offset = int(columns['name_offsets'][position])
+        columns['name_offsets'][position + 1:position + length + 1] = new_offsets + byte_offset
+        byte_positions = np.arange(int(new_offsets[-1]) if length else 0) - np.repeat(new_offsets - name_lengths, name_lengths) + np.repeat(name_starts, name_lengths)
+        columns['names'][byte_offset:byte_offset + len(byte_positions)] = chunk['names'][byte_positions]
+
+        # The ranges do not share any TICID
+        observed = chunk['ticid'][chunk['ticid'] != CORRUPTED]
+        n_light_curves += len(observed)
+        n_objects += len(np.unique(observed))
+        position += length
+
+    for column in columns.values():
+        column.flush()
+    columns = None
+
+    meta = {
+        'version': FORMAT_VERSION,
+        'directories': [shard.directories[0] for shard in shards],
+        'n_light_curves': n_light_curves,
+        'n_objects': n_objects,
+        'shards': generations,
+    }
+    with open(join(tmp_path, 'meta.json'), 'w') as f:
+        json.dump(meta, f)
+
+    # The shards are not mapped any more when the index is replaced
+    shards = None
+    replace_folder(tmp_path, index_path)
+
+    return n_light_curves, n_objects
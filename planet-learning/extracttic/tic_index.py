@@ -0,0 +1,200 @@
+"""Columnar storage of the extracted TIC data
+
+The data extracted by extracttic is stored in a folder holding one NumPy array per field, each row being a light curve file :
+    - `ticid.npy` : TICID of the observed object, -1 for the corrupted files
+    - `sector.npy` : observation sector, -1 for the corrupted files
+    - `ticver.npy` : version of the TESS Input Catalog, -1 for the corrupted files
+    - `directory.npy` : index of the folder of the file in the directories table
+    - `name_offsets.npy` and `names.npy` : name of the file, as slices of a single array of UTF-8 bytes
+    - `meta.json` : the directories table, shared by all the files of a sector folder, and some counts
+The rows are sorted by TICID then sector, so that the observations of an object are found by binary search.
+The arrays are memory-mapped when the index is loaded : only the pages actually accessed are read from the storage.
+
+"""
+import json
+import os
+import shutil
+from os.path import isdir, join
+
+import numpy as np
+
+# TICID and sector of the rows of the files that could not be read
+CORRUPTED = -1
+FORMAT_VERSION = 1
+
+
+def replace_folder(tmp_path, path):
+    """Replace a folder by a completely written temporary one.
+
+    Parameters
+    ----------
+    tmp_path: path-like object
+        path to the temporary folder
+    path: path-like object
+        path to the folder to replace, which may not exist
+
+    """
+    # Swap the folders
+    if isdir(path):
+        old_path = "{}.old".format(path)
+        if isdir(old_path):
+            shutil.rmtree(old_path)
+        os.rename(path, old_path)
+        os.rename(tmp_path, path)
+        shutil.rmtree(old_path)
+    else:
+        os.rename(tmp_path, path)
+
+
+def load_tic_index(path):
+    """Load a columnar TIC index.
+
+    Parameters
+    ----------
+    path: path-like object
+        path to the folder of the index
+
+    Raises
+    ------
+    EnvironmentError
+        if the requested index does not exist
+
+    Returns
+    -------
+    TICIndex
+        the loaded index
+
+    """
+    if not os.path.isfile(join(path, 'meta.json')):
+        raise EnvironmentError("No TIC index found in {}".format(path))
+
+    return TICIndex(path)
+
+
+class TICIndex:
+    """
+    Read access to a columnar TIC index, as written by `shards.compact_shards()`.
+    """
+    def __init__(self, path):
+        """
+        Memory-maps the columns of the index
+
+        Parameters
+        ----------
+        path: path-like object
+            path to the folder of the index
+        """
+        with open(join(path, 'meta.json')) as f:
+            meta = json.load(f)
+
+        self.path = path
+        self.directories = meta['directories']
+        self.n_light_curves = meta['n_light_curves']
+        self.n_objects = meta['n_objects']
+
+        self.ticid = np.load(join(path, 'ticid.npy'), mmap_mode='r')
+        self.sector = np.load(join(path, 'sector.npy'), mmap_mode='r')
+        self.ticver = np.load(join(path, 'ticver.npy'), mmap_mode='r')
+        self.directory = np.load(join(path, 'directory.npy'), mmap_mode='r')
+        self.name_offsets = np.load(join(path, 'name_offsets.npy'), mmap_mode='r')
+        self.names = np.load(join(path, 'names.npy'), mmap_mode='r')
+
+    def __len__(self):
+        return len(self.ticid)
+
+    def __contains__(self, TICID):
+        (start, stop) = self.rows(TICID)
+        return start != stop
+
+    def rows(self, TICID):
+        """
+        Finds the rows of the observations of an object
+
+        Parameters
+        ----------
+        TICID: int
+            the TICID of the object
+
+        Returns
+        -------
+        (int, int)
+            the slice of rows, empty if the object was not observed
+        """
+        TICID = int(TICID)
+        if TICID == CORRUPTED:
+            return (0, 0)
+        start = int(np.searchsorted(self.ticid, TICID, side='left'))
+        stop = int(np.searchsorted(self.ticid, TICID, side='right'))
+        return (start, stop)
+
+    def contains(self, TICIDs):
+        """
+        Vectorized membership test
+
+        Parameters
+        ----------
+        TICIDs: array-like of int
+            the TICIDs to look for
+
+        Returns
+        -------
+        numpy.ndarray of bool
+            True for the TICIDs having at least one light curve
+        """
+        TICIDs = np.asarray(TICIDs, dtype=np.int64)
+        if len(self.ticid) == 0:
+            return np.zeros(TICIDs.shape, dtype=bool)
+
+        positions = np.searchsorted(self.ticid, TICIDs)
+        found = self.ticid[np.minimum(positions, len(self.ticid) - 1)] == TICIDs
+        return found & (TICIDs != CORRUPTED)
+
+    def get_path(self, row):
+        """
+        Rebuilds the path to the light curve file of a row
+
+        Parameters
+        ----------
+        row: int
+            the row
+
+        Returns
+        -------
+        str
+            the path
+        """
+        name = self.names[self.name_offsets[row]:self.name_offsets[row + 1]].tobytes().decode('utf-8')
+        return join(self.directories[self.directory[row]], name)
+
+    def lookup(self, TICID):
+        """
+        Gets the observations of an object, in the format of the former extracted dictionary
+
+        Parameters
+        ----------
+        TICID: int
+            the TICID of the object
+
+        Returns
+        -------
+        list of dict
+            the observations, [{'SECTOR': int, 'TICVER': int, 'path': str},], ordered by sector.
+            Empty if the object was not observed.
+        """
+        (start, stop) = self.rows(TICID)
+        return [
+            {'SECTOR': int(self.sector[row]), 'TICVER': int(self.ticver[row]), 'path': self.get_path(row)}
+            for row in range(start, stop)
+        ]
+
+    def corrupted_paths(self):
+        """
+        Gets the paths to the files that could not be read
+
+        Returns
+        -------
+        list of str
+            the paths
+        """
+        (start, stop) = (int(np.searchsorted(self.ticid, CORRUPTED, side='left')), int(np.searchsorted(self.ticid, CORRUPTED, side='right')))
+        return [self.get_path(row) for row in range(start, stop)]
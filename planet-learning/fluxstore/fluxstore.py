@@ -0,0 +1,179 @@
+"""Module to consolidate the TESS light curves into a flux store
+
+This module reads the TIME, PDCSAP_FLUX and QUALITY columns of every light curve listed in the TIC index extracted by extracttic,
+and writes them in a single memory-mappable flux store (see `store.py`).
+The store is updated incrementally : the light curves whose `.fits` file did not change since the previous build are copied
+from the previous store, and only the new or modified files are read.
+
+"""
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from astropy.io import fits
+
+from ..extracttic.tic_index import CORRUPTED, load_tic_index
+from ..pipeline.prefetch import map_bounded
+from .store import FluxStoreWriter, load_flux_store
+
+
+def read_light_curve_samples(path):
+    """Read the samples of a light curve `.fits` file.
+
+    Parameters
+    ----------
+    path: path-like object
+        path to the file to read
+
+    Returns
+    -------
+    (float, numpy.ndarray, numpy.ndarray, numpy.ndarray)
+        the first time stamp in BTJD (NaN if there is none), the float32 time stamps in days since the first one,
+        the float32 PDCSAP fluxes and the int32 quality flags
+
+    """
+    with fits.open(path, mode="readonly", memmap=False) as hdulist:
+        data = hdulist[1].data
+        time = np.asarray(data['TIME'], dtype=np.float64)
+        flux = np.asarray(data['PDCSAP_FLUX'], dtype=np.float32)
+        quality = np.asarray(data['QUALITY'], dtype=np.int32)
+
+    finite = np.isfinite(time)
+    t0 = float(time[finite].min()) if finite.any() else float('nan')
+    return t0, (time - t0).astype(np.float32), flux, quality
+
+
+def list_light_curves(TIC_index):
+    """List the light curves of a TIC index, one per TICID and sector.
+
+    Parameters
+    ----------
+    TIC_index: extracttic.tic_index.TICIndex
+        the TIC index
+
+    Returns
+    -------
+    list of (int, int, str)
+        the TICID, sector and path of the light curves, sorted by TICID then sector
+
+    """
+    light_curves = []
+    for row in range(len(TIC_index)):
+        (ticid, sector) = (int(TIC_index.ticid[row]), int(TIC_index.sector[row]))
+        if ticid == CORRUPTED:
+            continue
+        # Rows are sorted by TICID then sector : duplicates are consecutive
+        if light_curves and light_curves[-1][:2] == (ticid, sector):
+            logging.warning("TIC {} sector {} : ignoring duplicate light curve {}".format(ticid, sector, TIC_index.get_path(row)))
+            continue
+        light_curves.append((ticid, sector, TIC_index.get_path(row)))
+
+    return light_curves
+
+
+def load_light_curve(light_curve, previous_store):
+    """Get the samples of a light curve, from the previous store if its file did not change.
+
+    Parameters
+    ----------
+    light_curve: (int, int, str)
+        the TICID, sector and path of the light curve
+    previous_store: FluxStore or None
+        the previous store
+
+    Returns
+    -------
+    tuple or None
+        (t0, time, flux, quality, (size, mtime_ns) of the file, True if read from the file), None if the file cannot be read
+
+    """
+    (ticid, sector, path) = light_curve
+    try:
+        stat = os.stat(path)
+        source_stat = (stat.st_size, stat.st_mtime_ns)
+
+        if previous_store is not None:
+            row = previous_store.find(ticid, sector)
+            if row is not None and (int(previous_store.source_size[row]), int(previous_store.source_mtime[row])) == source_stat:
+                (time, flux, quality) = previous_store.get_row(row)
+                return (float(previous_store.t0[row]), np.array(time), np.array(flux), np.array(quality), source_stat, False)
+
+        (t0, time, flux, quality) = read_light_curve_samples(path)
+        return (t0, time, flux, quality, source_stat, True)
+
+    except Exception as e:
+        logging.warning("TIC {} sector {} : {} could not be read, {}: {}".format(ticid, sector, path, type(e).__name__, e))
+        return None
+
+
+def build_flux_store(tic_index_path, store_path, n_workers=1):
+    """Build or update the flux store of all the light curves of the TIC index.
+
+    Parameters
+    ----------
+    tic_index_path: path-like object
+        path to the TIC index extracted by extracttic
+    store_path: path-like object
+        path to the folder of the flux store
+    n_workers: int
+        number of light curve files read at the same time
+
+    """
+    light_curves = list_light_curves(load_tic_index(tic_index_path))
+    logging.info("Building the flux store of {} light curves in {}".format(len(light_curves), store_path))
+
+    try:
+        previous_store = load_flux_store(store_path)
+        logging.info("Reusing the {} light curves of the existing flux store".format(len(previous_store)))
+    except EnvironmentError:
+        previous_store = None
+
+    (nb_read, nb_copied, nb_failed) = (0, 0, 0)
+    writer = FluxStoreWriter(store_path)
+    try:
+        with ThreadPoolExecutor(max_workers=max(n_workers, 1)) as executor:
+            results = map_bounded(executor, lambda light_curve: load_light_curve(light_curve, previous_store), light_curves, 4 * max(n_workers, 1))
+
+            for (nb_done, ((ticid, sector, _), result)) in enumerate(zip(light_curves, results), 1):
+                if result is None:
+                    nb_failed += 1
+                    continue
+
+                (t0, time, flux, quality, source_stat, was_read) = result
+                writer.add(ticid, sector, t0, time, flux, quality, source_stat)
+                if was_read:
+                    nb_read += 1
+                else:
+                    nb_copied += 1
+
+                if nb_done % 1000 == 0:
+                    logging.info("{}/{} light curves stored".format(nb_done, len(light_curves)))
+
+        # The previous store is replaced : its files must not be mapped any more
+        previous_store = None
+        writer.close()
+
+    except BaseException:
+        writer.abort()
+        raise
+
+    logging.info("Flux store built : {} light curves read, {} unchanged, {} unreadable".format(nb_read, nb_copied, nb_failed))
+
+
+def fluxstore(tic_index_path, store_path):
+    """Build the flux store if asked in the configuration.
+
+    Parameters
+    ----------
+    tic_index_path: path-like object
+        path to the TIC index extracted by extracttic
+    store_path: path-like object
+        path to the folder of the flux store
+
+    """
+    if not int(os.getenv("BUILD_FLUX_STORE", 0)):
+        logging.info("Not building the flux store")
+        return
+
+    build_flux_store(tic_index_path, store_path, int(os.getenv("FLUX_STORE_WORKERS", 1)))
@@ -0,0 +1,147 @@
+"""Module to stitch the sectors of each star into a single light curve
+
+The light curves of all the sectors of a TIC are read from a flux store, normalized by their median and concatenated
+into a single time series, written in a stitched flux store (see `store.py`) under the sector `STITCHED_SECTOR`.
+Transits whose period is longer than a sector can then be seen several times.
+The stitched store is updated incrementally : the stars whose sectors did not change since the previous stitching are copied
+from the previous stitched store.
+
+"""
+import logging
+import os
+import zlib
+
+import numpy as np
+
+from .store import FluxStoreWriter, load_flux_store
+
+# Sector of the stitched light curves in the stitched store
+STITCHED_SECTOR = 0
+
+
+def get_sectors_signature(store, start, stop):
+    """Signature of the light curves of a star, changing whenever one of its sectors is added, removed or modified.
+
+    Parameters
+    ----------
+    store: FluxStore
+        the store of the sectors
+    start: int
+        first row of the star in the store
+    stop: int
+        row following the last one of the star
+
+    Returns
+    -------
+    (int, int)
+        the number of sectors and a checksum of their sectors, sizes and modification times
+
+    """
+    rows = np.stack([store.sector[start:stop].astype(np.int64), store.source_size[start:stop], store.source_mtime[start:stop]])
+    return (stop - start, zlib.crc32(rows.tobytes()))
+
+
+def stitch_sectors(store, start, stop):
+    """Normalize and concatenate the light curves of the sectors of a star.
+
+    Parameters
+    ----------
+    store: FluxStore
+        the store of the sectors
+    start: int
+        first row of the star in the store
+    stop: int
+        row following the last one of the star
+
+    Returns
+    -------
+    (float, numpy.ndarray, numpy.ndarray, numpy.ndarray)
+        the first time stamp in BTJD, the float32 time stamps in days since the first one, the float32 fluxes divided by the median
+        of their sector, and the quality flags
+
+    """
+    t0 = float(np.nanmin(store.t0[start:stop]))
+    (times, fluxes, qualities) = ([], [], [])
+
+    for row in range(start, stop):
+        (time, flux, quality) = store.get_row(row)
+        # Time stamps of the sector, relative to the first sector
+        times.append((time.astype(np.float64) + (float(store.t0[row]) - t0)).astype(np.float32))
+
+        finite = np.isfinite(flux)
+        median = np.median(flux[finite]) if finite.any() else np.nan
+        fluxes.append((flux / median).astype(np.float32))
+        qualities.append(quality)
+
+    return t0, np.concatenate(times), np.concatenate(fluxes), np.concatenate(qualities)
+
+
+def stitch_flux_store(store_path, stitched_store_path):
+    """Stitch the sectors of every star of a flux store.
+
+    Parameters
+    ----------
+    store_path: path-like object
+        path to the flux store of the sectors
+    stitched_store_path: path-like object
+        path to the folder of the stitched store
+
+    """
+    store = load_flux_store(store_path)
+    try:
+        previous_store = load_flux_store(stitched_store_path)
+    except EnvironmentError:
+        previous_store = None
+
+    # Rows of the stars, the store being sorted by TICID then sector
+    TIC_IDs = np.asarray(store.ticid)
+    starts = np.flatnonzero(np.r_[True, TIC_IDs[1:] != TIC_IDs[:-1]]) if len(TIC_IDs) else np.zeros(0, dtype=np.int64)
+    stops = np.r_[starts[1:], len(TIC_IDs)]
+    logging.info("Stitching the light curves of {} stars from {} into {}".format(len(starts), store_path, stitched_store_path))
+
+    (nb_stitched, nb_copied) = (0, 0)
+    writer = FluxStoreWriter(stitched_store_path)
+    try:
+        for (start, stop) in zip(starts, stops):
+            TIC = int(TIC_IDs[start])
+            # The number of sectors and their checksum take the place of the size and modification time of the source
+            signature = get_sectors_signature(store, start, stop)
+
+            row = previous_store.find(TIC, STITCHED_SECTOR) if previous_store is not None else None
+            if row is not None and (int(previous_store.source_size[row]), int(previous_store.source_mtime[row])) == signature:
+                (time, flux, quality) = previous_store.get_row(row)
+                t0 = float(previous_store.t0[row])
+                nb_copied += 1
+            else:
+                (t0, time, flux, quality) = stitch_sectors(store, start, stop)
+                nb_stitched += 1
+
+            writer.add(TIC, STITCHED_SECTOR, t0, time, flux, quality, signature)
+
+        # The previous store is replaced : its files must not be mapped any more
+        previous_store = None
+        writer.close()
+
+    except BaseException:
+        writer.abort()
+        raise
+
+    logging.info("Stitching done : {} stars stitched, {} unchanged".format(nb_stitched, nb_copied))
+
+
+def stitching(store_path, stitched_store_path):
+    """Stitch the sectors of every star if asked in the configuration.
+
+    Parameters
+    ----------
+    store_path: path-like object
+        path to the flux store of the sectors
+    stitched_store_path: path-like object
+        path to the folder of the stitched store
+
+    """
+    if not int(os.getenv("STITCH_LIGHT_CURVES", 0)):
+        logging.info("Not stitching the light curves")
+        return
+
+    stitch_flux_store(store_path, stitched_store_path)
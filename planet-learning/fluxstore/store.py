@@ -0,0 +1,300 @@
+"""Consolidated storage of the light curves fluxes
+
+The flux store is a folder holding the samples of all the light curves, one after another, in contiguous arrays :
+    - `time.bin` : float32 time stamps, in days since the first time stamp of the light curve (`t0`)
+    - `flux.bin` : float32 PDCSAP_FLUX, in e-/s
+    - `quality.bin` : int32 QUALITY flags
+    - `ticid.npy`, `sector.npy` : TICID and sector of each light curve, sorted by TICID then sector
+    - `offsets.npy` : position of the first sample of each light curve, followed by the total number of samples
+    - `t0.npy` : float64 first time stamp of each light curve, in BTJD (BJD - 2457000)
+    - `source_size.npy`, `source_mtime.npy` : size and modification time of the `.fits` file each light curve was read from
+    - `meta.json` : format version and counts
+Time stamps are stored relative to `t0` so that float32 keeps a sub-second precision over a sector.
+The samples are memory-mapped when the store is loaded : reading a light curve only reads its pages from the storage,
+and returns views on the mapped arrays, without any copy.
+
+"""
+import json
+import os
+import shutil
+from os.path import isdir, isfile, join
+
+import numpy as np
+
+from ..extracttic.tic_index import replace_folder
+
+FORMAT_VERSION = 1
+# Columns of samples, with their data type
+SAMPLE_COLUMNS = (('time', np.float32), ('flux', np.float32), ('quality', np.int32))
+
+
+class FluxStoreWriter:
+    """
+    Writes a flux store in a temporary folder, one light curve after another, then replaces the existing store.
+    The light curves must be added sorted by TICID then sector.
+    """
+    def __init__(self, path):
+        """
+        Opens the temporary folder of the store
+
+        Parameters
+        ----------
+        path: path-like object
+            path to the folder of the store
+        """
+        self.path = path
+        self.tmp_path = "{}.tmp".format(path)
+        if isdir(self.tmp_path):
+            shutil.rmtree(self.tmp_path)
+        os.makedirs(self.tmp_path)
+
+        self.files = {name: open(join(self.tmp_path, "{}.bin".format(name)), 'wb') for (name, _) in SAMPLE_COLUMNS}
+        self.rows = {'ticid': [], 'sector': [], 't0': [], 'source_size': [], 'source_mtime': []}
+        self.offsets = [0]
+
+    def add(self, ticid, sector, t0, time, flux, quality, source_stat=(-1, -1)):
+        """
+        Appends a light curve to the store
+
+        Parameters
+        ----------
+        ticid: int
+            TICID of the object
+        sector: int
+            observation sector
+        t0: float
+            first time stamp of the light curve, in BTJD
+        time: numpy.ndarray
+            time stamps, in days since t0
+        flux: numpy.ndarray
+            PDCSAP fluxes
+        quality: numpy.ndarray
+            quality flags
+        source_stat: (int, int)
+            size and modification time in ns of the file the light curve was read from
+        """
+        if not len(time) == len(flux) == len(quality):
+            raise ValueError("TIC {} sector {} : columns of different lengths".format(ticid, sector))
+
+        for (name, dtype), column in zip(SAMPLE_COLUMNS, (time, flux, quality)):
+            self.files[name].write(np.ascontiguousarray(column, dtype=dtype).tobytes())
+
+        self.rows['ticid'].append(ticid)
+        self.rows['sector'].append(sector)
+        self.rows['t0'].append(t0)
+        self.rows['source_size'].append(source_stat[0])
+        self.rows['source_mtime'].append(source_stat[1])
+        self.offsets.append(self.offsets[-1] + len(time))
+
+    def close(self):
+        """
+        Writes the index of the store and replaces the existing store
+        """
+        for f in self.files.values():
+            f.close()
+
+        columns = {
+            'ticid': np.array(self.rows['ticid'], dtype=np.int64),
+            'sector': np.array(self.rows['sector'], dtype=np.int32),
+            't0': np.array(self.rows['t0'], dtype=np.float64),
+            'source_size': np.array(self.rows['source_size'], dtype=np.int64),
+            'source_mtime': np.array(self.rows['source_mtime'], dtype=np.int64),
+            'offsets': np.array(self.offsets, dtype=np.int64),
+        }
+        keys = columns['ticid'] * (1 << 16) + columns['sector']
+        if np.any(np.diff(keys) <= 0):
+            raise ValueError("The light curves must be added sorted by TICID then sector, without duplicates")
+
+        for (name, column) in columns.items():
+            np.save(join(self.tmp_path, "{}.npy".format(name)), column)
+        meta = {
+            'version': FORMAT_VERSION,
+            'n_light_curves': len(columns['ticid']),
+            'n_samples': int(columns['offsets'][-1]),
+            'n_objects': len(np.unique(columns['ticid'])),
+        }
+        with open(join(self.tmp_path, 'meta.json'), 'w') as f:
+            json.dump(meta, f)
+
+        replace_folder(self.tmp_path, self.path)
+
+    def abort(self):
+        """
+        Removes the temporary folder, keeping the existing store
+        """
+        for f in self.files.values():
+            f.close()
+        shutil.rmtree(self.tmp_path, ignore_errors=True)
+
+
+def load_flux_store(path):
+    """Load a flux store.
+
+    Parameters
+    ----------
+    path: path-like object
+        path to the folder of the store
+
+    Raises
+    ------
+    EnvironmentError
+        if the requested store does not exist
+
+    Returns
+    -------
+    FluxStore
+        the loaded store
+
+    """
+    if not isfile(join(path, 'meta.json')):
+        raise EnvironmentError("No flux store found in {}".format(path))
+
+    return FluxStore(path)
+
+
+class FluxStore:
+    """
+    Read access to a flux store, as written by `FluxStoreWriter`.
+    """
+    def __init__(self, path):
+        """
+        Memory-maps the samples and loads the index of the store
+
+        Parameters
+        ----------
+        path: path-like object
+            path to the folder of the store
+        """
+        with open(join(path, 'meta.json')) as f:
+            meta = json.load(f)
+
+        self.path = path
+        self.n_light_curves = meta['n_light_curves']
+        self.n_samples = meta['n_samples']
+        self.n_objects = meta['n_objects']
+
+        self.ticid = np.load(join(path, 'ticid.npy'), mmap_mode='r')
+        self.sector = np.load(join(path, 'sector.npy'), mmap_mode='r')
+        self.t0 = np.load(join(path, 't0.npy'), mmap_mode='r')
+        self.offsets = np.load(join(path, 'offsets.npy'), mmap_mode='r')
+        self.source_size = np.load(join(path, 'source_size.npy'), mmap_mode='r')
+        self.source_mtime = np.load(join(path, 'source_mtime.npy'), mmap_mode='r')
+
+        # An empty file cannot be memory-mapped
+        self.samples = {}
+        for (name, dtype) in SAMPLE_COLUMNS:
+            if self.n_samples:
+                self.samples[name] = np.memmap(join(path, "{}.bin".format(name)), dtype=dtype, mode='r', shape=(self.n_samples,))
+            else:
+                self.samples[name] = np.zeros(0, dtype=dtype)
+
+    def __len__(self):
+        return len(self.ticid)
+
+    def __contains__(self, key):
+        return self.find(*key) is not None
+
+    def rows(self, TICID):
+        """
+        Finds the rows of the light curves of an object
+
+        Parameters
+        ----------
+        TICID: int
+            the TICID of the object
+
+        Returns
+        -------
+        (int, int)
+            the slice of rows, ordered by sector, empty if the object is not in the store
+        """
+        start = int(np.searchsorted(self.ticid, TICID, side='left'))
+        stop = int(np.searchsorted(self.ticid, TICID, side='right'))
+        return (start, stop)
+
+    def find(self, TICID, sector):
+        """
+        Finds the row of a light curve
+
+        Parameters
+        ----------
+        TICID: int
+            the TICID of the object
+        sector: int
+            the observation sector
+
+        Returns
+        -------
+        int or None
+            the row, None if the light curve is not in the store
+        """
+        (start, stop) = self.rows(TICID)
+        row = start + int(np.searchsorted(self.sector[start:stop], sector))
+        if row < stop and self.sector[row] == sector:
+            return row
+        return None
+
+    def get_row(self, row):
+        """
+        Reads the samples of a light curve
+
+        Parameters
+        ----------
+        row: int
+            the row of the light curve
+
+        Returns
+        -------
+        (numpy.ndarray, numpy.ndarray, numpy.ndarray)
+            read-only views on the time stamps (in days since `t0[row]`), fluxes and quality flags
+        """
+        (start, stop) = (int(self.offsets[row]), int(self.offsets[row + 1]))
+        return tuple(self.samples[name][start:stop] for (name, _) in SAMPLE_COLUMNS)
+
+    def read(self, TICID, sector):
+        """
+        Reads the samples of a light curve
+
+        Parameters
+        ----------
+        TICID: int
+            the TICID of the object
+        sector: int
+            the observation sector
+
+        Raises
+        ------
+        KeyError
+            if the light curve is not in the store
+
+        Returns
+        -------
+        (numpy.ndarray, numpy.ndarray, numpy.ndarray)
+            read-only views on the time stamps (in days since the first one), fluxes and quality flags
+        """
+        row = self.find(TICID, sector)
+        if row is None:
+            raise KeyError("TIC {} sector {} is not in the flux store".format(TICID, sector))
+        return self.get_row(row)
+
+    def lookup(self, TICID):
+        """
+        Gets the light curves of an object
+
+        Parameters
+        ----------
+        TICID: int
+            the TICID of the object
+
+        Returns
+        -------
+        list of dict
+            the light curves, [{'SECTOR': int, 't0': float, 'time': numpy.ndarray, 'flux': numpy.ndarray, 'quality': numpy.ndarray},],
+            ordered by sector. Empty if the object is not in the store.
+        """
+        (start, stop) = self.rows(TICID)
+        light_curves = []
+        for row in range(start, stop):
+            (time, flux, quality) = self.get_row(row)
+            light_curves.append({'SECTOR': int(self.sector[row]), 't0': float(self.t0[row]), 'time': time, 'flux': flux, 'quality': quality})
+        return light_curves
@@ -1,12 +1,32 @@
+import argparse
+import importlib
 import logging
 import os
 from os.path import isdir, join
 
 from dotenv import load_dotenv
 
-from .catascript.catascript import catascript
-from .extracttic.extracttic import extracttic, save_to_pickle
-from .plot_to_file.make_light_curves_plot import make_light_curves_plot
+from .pipeline.prefetch import get_prefetch_depth
+from .pipeline.runner import Stage, run_pipeline
+
+# Checkpoints of the pipeline stages, in the processed data folder
+CHECKPOINT_FILE = 'pipeline_checkpoint.json'
+
+
+def lazy_stage(module_name, function_name):
+    # The module of a stage, and the libraries it needs (astropy, matplotlib, the database...), are only imported when it runs
+    def run(*args, **kwargs):
+        return getattr(importlib.import_module(module_name, __package__), function_name)(*args, **kwargs)
+    return run
+
+
+extracttic = lazy_stage('.extracttic.extracttic', 'extracttic')
+fluxstore = lazy_stage('.fluxstore.fluxstore', 'fluxstore')
+preprocessing = lazy_stage('.preprocessing.preprocessing', 'preprocessing')
+stitching = lazy_stage('.fluxstore.stitching', 'stitching')
+catascript = lazy_stage('.catascript.catascript', 'catascript')
+transitsearch = lazy_stage('.transitsearch.transitsearch', 'transitsearch')
+make_light_curves_plot = lazy_stage('.plot_to_file.make_light_curves_plot', 'make_light_curves_plot')
 
 def create_dir(directory):
     # Create the directory to store the logs on first run
@@ -14,6 +34,11 @@ def create_dir(directory):
             os.mkdir(directory)
 
 
+def enabled_outputs(flag, path):
+    # The output of a stage enabled by a flag is only expected when the flag is set
+    return [path] if int(os.getenv(flag, 0)) else []
+
+
 if __name__ == '__main__':
     load_dotenv()
 
@@ -22,12 +47,54 @@ if __name__ == '__main__':
     LIGHT_CURVES_DIR = os.getenv('LIGHT_CURVES_DIR')
     PROCESSED_DIR = os.getenv('PROCESSED_DIR')
     EXTRACTED_TICS_FILE = os.getenv('EXTRACTED_TICS_FILE')
+    FLUX_STORE_DIR = os.getenv('FLUX_STORE_DIR', 'flux_store')
+    CLEAN_FLUX_STORE_DIR = os.getenv('CLEAN_FLUX_STORE_DIR', 'flux_store_clean')
+    STITCHED_FLUX_STORE_DIR = os.getenv('STITCHED_FLUX_STORE_DIR', 'flux_store_stitched')
     light_curves_path = join(DATA_ROOT, LIGHT_CURVES_DIR)
     processed_dir_path = join(DATA_ROOT, PROCESSED_DIR)
     save_path = join(processed_dir_path, EXTRACTED_TICS_FILE)
+    flux_store_path = join(processed_dir_path, FLUX_STORE_DIR)
+    clean_flux_store_path = join(processed_dir_path, CLEAN_FLUX_STORE_DIR)
+    stitched_flux_store_path = join(processed_dir_path, STITCHED_FLUX_STORE_DIR)
+    catalog_path = join(DATA_ROOT, 'catalog')
+    confirmed_path = join(DATA_ROOT, os.getenv('CONFIRMED_DIR', 'confirmed'))
+    plots_dir_path = join(processed_dir_path, 'plots_to_file')
+    metrics_dir_path = join(processed_dir_path, os.getenv('METRICS_DIR', 'metrics'))
 
     # False if "0" alse True
     force_tic_extract = False if not int(os.getenv('FORCE_TIC_EXTRACTION')) else True
+    # Number of light curve files read in parallel, 1 to read them one after another
+    extraction_workers = int(os.getenv('EXTRACTION_WORKERS', 1))
+    # Number of light curve files read ahead while the previous ones are processed
+    prefetch_depth = get_prefetch_depth()
+    # Light curves stitched from the cleaned ones if they are cleaned
+    stitching_source_path = clean_flux_store_path if int(os.getenv('CLEAN_FLUX_STORE', 0)) else flux_store_path
+    # Transits searched in the stitched light curves or in the cleaned ones
+    search_store_path = stitched_flux_store_path if int(os.getenv('TRANSIT_SEARCH_STITCHED', 0)) else clean_flux_store_path
+
+    # Stages of the pipeline, in order : (name, function, inputs, outputs, settings, always run)
+    stages = [
+        # extracttic detects the new and modified light curves itself, sector by sector : the archive is not walked twice
+        Stage('extracttic', lambda checkpoint: extracttic(light_curves_path, save_path, force_tic_extract, extraction_workers, prefetch_depth),
+              [], [save_path], [], True),
+        Stage('fluxstore', lambda checkpoint: fluxstore(save_path, flux_store_path),
+              [save_path], enabled_outputs('BUILD_FLUX_STORE', flux_store_path), ['BUILD_FLUX_STORE'], False),
+        Stage('preprocessing', lambda checkpoint: preprocessing(flux_store_path, clean_flux_store_path),
+              [flux_store_path], enabled_outputs('CLEAN_FLUX_STORE', clean_flux_store_path), ['CLEAN_FLUX_STORE', 'DETREND_WINDOW', 'MAX_GAP_LENGTH'], False),
+        Stage('stitching', lambda checkpoint: stitching(stitching_source_path, stitched_flux_store_path),
+              [stitching_source_path], enabled_outputs('STITCH_LIGHT_CURVES', stitched_flux_store_path), ['STITCH_LIGHT_CURVES', 'CLEAN_FLUX_STORE'], False),
+        Stage('catascript', catascript,
+              [save_path, catalog_path, confirmed_path], [], ['ENGINE_URL', 'RE_LAUNCH', 'LIST_DB_FIELDS', 'LIST_CONFIRMED_FIELDS', 'CROSSMATCH_TOLERANCE_ARCSEC'], False),
+        Stage('transitsearch', lambda checkpoint: transitsearch(search_store_path),
+              [search_store_path, catalog_path], [], ['ENGINE_URL', 'TRANSIT_SEARCH', 'TRANSIT_SEARCH_STITCHED', 'TRANSIT_SEARCH_TOP_K', 'TRANSIT_MIN_PERIOD', 'TRANSIT_MAX_PERIOD', 'TRANSIT_MAX_TRIAL_PERIODS', 'TRANSIT_DURATIONS_HOURS'], False),
+        Stage('plot_to_file', lambda checkpoint: make_light_curves_plot(processed_dir_path),
+              [save_path, catalog_path, confirmed_path], enabled_outputs('PLOT_TO_FILE', plots_dir_path), ['ENGINE_URL', 'PLOT_TO_FILE', 'PLOT_MODE', 'PLOT_FORMAT'], False),
+    ]
+
+    parser = argparse.ArgumentParser(description="Runs the stages of the pipeline, skipping those whose inputs did not change since their last run")
+    parser.add_argument('--stage', action='append', choices=[stage.name for stage in stages], help="run only this stage, whatever its inputs (can be repeated)")
+    parser.add_argument('--force', action='store_true', help="run the stages from scratch, forgetting their checkpoints")
+    args = parser.parse_args()
 
     create_dir('log')
     create_dir(processed_dir_path)
@@ -35,21 +102,9 @@ if __name__ == '__main__':
 
     # Configuration of the logging module
     logging.basicConfig(
-        filename='log/extracttic.log',
+        filename='log/pipeline.log',
         level=logging.DEBUG,
         format='%(asctime)s %(levelname)s: %(message)s',
         datefmt='%Y-%m-%d %H:%M:%S'
     )
-    extracttic(light_curves_path, save_path, force_tic_extract)
-
-    # Configuration of the logging module
-    logging.basicConfig(
-        filename='log/catascript.log',
-        level=logging.DEBUG,
-        format='%(asctime)s %(levelname)s: %(message)s',
-        datefmt='%Y-%m-%d %H:%M:%S'
-    )
-    catascript()
-
-    #Plotting to file
-    make_light_curves_plot(processed_dir_path)
\ No newline at end of file
+    run_pipeline(stages, join(processed_dir_path, CHECKPOINT_FILE), args.stage, args.force, metrics_dir_path)
@@ -0,0 +1,220 @@
+"""Checkpoints of the pipeline stages
+
+The checkpoint store is a JSON file recording, for each stage of the pipeline :
+    - `signature` : a hash of the inputs and settings the stage was last run with (see `get_inputs_signature()`)
+    - `done` : whether this run completed
+    - `units` : the sub-units (catalog files, ...) completed so far by this run
+The file is written again, atomically, each time a stage or a unit completes : after a crash, a run resumes after the last
+completed unit, and the stages whose inputs did not change since they completed are skipped.
+
+"""
+import hashlib
+import json
+import logging
+import os
+from os.path import isdir, isfile
+
+FORMAT_VERSION = 1
+
+
+def walk_stats(path):
+    """List the size and modification time of a path and, for a folder, of everything under it.
+
+    Only the folders are listed : the files are not opened.
+
+    Parameters
+    ----------
+    path: path-like object
+        path to a file or a folder
+
+    Returns
+    -------
+    list of (str, int, int)
+        the path, size and modification time in ns of the entries, sorted by path. Empty if the path does not exist.
+
+    """
+    if not isdir(path):
+        if not isfile(path):
+            return []
+        stat = os.stat(path)
+        return [(str(path), stat.st_size, stat.st_mtime_ns)]
+
+    stats = []
+    with os.scandir(path) as entries:
+        for entry in entries:
+            if entry.is_dir():
+                stats += walk_stats(entry.path)
+            else:
+                stat = entry.stat()
+                stats.append((entry.path, stat.st_size, stat.st_mtime_ns))
+
+    return sorted(stats)
+
+
+def get_inputs_signature(paths, settings):
+    """Hash the inputs of a stage.
+
+    The signature changes whenever a file is added, removed or modified under one of the paths,
+    or whenever one of the settings changes.
+
+    Parameters
+    ----------
+    paths: list of path-like objects
+        the files and folders read by the stage
+    settings: dict
+        the (name, value) pairs of the configuration changing the results of the stage
+
+    Returns
+    -------
+    str
+        the hexadecimal signature
+
+    """
+    signature = hashlib.sha1()
+    for path in paths:
+        for (entry_path, size, mtime) in walk_stats(path):
+            signature.update("{}\0{}\0{}\n".format(entry_path, size, mtime).encode())
+    signature.update(json.dumps(settings, sort_keys=True).encode())
+    return signature.hexdigest()
+
+
+class CheckpointStore:
+    """
+    Progress of the stages of the pipeline, saved in a JSON file after each change
+    """
+    def __init__(self, path):
+        """
+        Loads the checkpoint file, starting from scratch if there is none
+
+        Parameters
+        ----------
+        path: path-like object
+            path to the checkpoint file
+        """
+        self.path = path
+        self.stages = {}
+
+        if isfile(path):
+            try:
+                with open(path) as checkpoint_file:
+                    content = json.load(checkpoint_file)
+                if content.get('version') == FORMAT_VERSION:
+                    self.stages = content['stages']
+            except ValueError:
+                logging.warning("Corrupted checkpoint file {}, running all the stages again".format(path))
+
+    def save(self):
+        """
+        Writes the checkpoint file, replacing the previous one at once
+        """
+        tmp_path = "{}.tmp".format(self.path)
+        with open(tmp_path, 'w') as checkpoint_file:
+            json.dump({'version': FORMAT_VERSION, 'stages': self.stages}, checkpoint_file, sort_keys=True, indent=1)
+        os.replace(tmp_path, self.path)
+
+    def is_stage_done(self, stage, signature):
+        """
+        Tells whether a stage completed with the given inputs
+
+        Parameters
+        ----------
+        stage: str
+            name of the stage
+        signature: str
+            signature of its current inputs
+
+        Returns
+        -------
+        bool
+            True if its last run completed with the same inputs
+        """
+        checkpoint = self.stages.get(stage)
+        return checkpoint is not None and checkpoint['done'] and checkpoint['signature'] == signature
+
+    def start_stage(self, stage, signature, reset=False):
+        """
+        Starts a run of a stage. The units completed by a previous interrupted run are kept, unless its inputs changed.
+
+        Parameters
+        ----------
+        stage: str
+            name of the stage
+        signature: str
+            signature of its current inputs
+        reset: bool
+            True to forget the completed units whatever the inputs
+
+        Returns
+        -------
+        StageCheckpoint
+            the checkpoint of the units of this run
+        """
+        checkpoint = self.stages.get(stage)
+        if reset or checkpoint is None or checkpoint['done'] or checkpoint['signature'] != signature:
+            checkpoint = {'signature': signature, 'units': []}
+        checkpoint['done'] = False
+        self.stages[stage] = checkpoint
+        self.save()
+        return StageCheckpoint(self, stage)
+
+    def complete_stage(self, stage):
+        """
+        Records that the run of a stage completed
+
+        Parameters
+        ----------
+        stage: str
+            name of the stage
+        """
+        self.stages[stage]['done'] = True
+        self.save()
+
+
+class StageCheckpoint:
+    """
+    Units completed by the current run of a stage. The stages accept it as an optional `checkpoint` argument.
+    """
+    def __init__(self, store, stage):
+        """
+        Parameters
+        ----------
+        store: CheckpointStore
+            the checkpoint store
+        stage: str
+            name of the stage
+        """
+        self.store = store
+        self.stage = stage
+        self.units = set(store.stages[stage]['units'])
+
+    def __len__(self):
+        return len(self.units)
+
+    def is_done(self, unit):
+        """
+        Tells whether a unit was completed
+
+        Parameters
+        ----------
+        unit: str
+            name of the unit
+
+        Returns
+        -------
+        bool
+            True if the unit was completed by this run or by the interrupted previous one
+        """
+        return unit in self.units
+
+    def complete(self, unit):
+        """
+        Records a completed unit, at once in the checkpoint file
+
+        Parameters
+        ----------
+        unit: str
+            name of the unit
+        """
+        self.units.add(unit)
+        self.store.stages[self.stage]['units'].append(unit)
+        self.store.save()
@@ -0,0 +1,308 @@
+"""Metrics of the pipeline runs
+
+The stages record their measures in a registry of the process :
+    - counters, only increasing : files read, rows added, bytes read, database round trips...
+    - gauges, set to their last value : throughputs
+    - histograms, counting the observed values in fixed buckets : durations of the stages, of the catalog files,
+      of the opening of the `.fits` files...
+Each measure has a name and labels, e.g. `fits_open_seconds{reader="header"}`.
+The registry is thread-safe. The worker processes send the measures of each task back to the main process
+with `drain()` and `merge()`.
+
+At the end of a run, the measures are exported as a JSON run report and as a Prometheus textfile
+(see https://prometheus.io/docs/instrumenting/exposition_formats/), to be collected by the node exporter.
+
+"""
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from os.path import join
+
+# Prefix of the metric names in the Prometheus textfile
+PROMETHEUS_PREFIX = "planet_learning_"
+PROMETHEUS_FILE = "planet_learning.prom"
+# Upper bounds of the buckets of the histograms, in seconds
+DURATION_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300, 1800)
+
+_lock = threading.Lock()
+# (name, labels) -> value, the labels being a sorted tuple of (name, value) pairs
+_counters = {}
+_gauges = {}
+# (name, labels) -> [count of each bucket, sum, count]
+_histograms = {}
+
+
+def _key(name, labels):
+    return (name, tuple(sorted((label, str(value)) for (label, value) in labels.items())))
+
+
+def increment(name, value=1, **labels):
+    """Increase a counter.
+
+    Parameters
+    ----------
+    name: str
+        name of the counter, ending with `_total`
+    value: int or float
+        the increase
+    labels:
+        the labels of the counter
+
+    """
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+
+def set_gauge(name, value, **labels):
+    """Set the value of a gauge.
+
+    Parameters
+    ----------
+    name: str
+        name of the gauge
+    value: int or float
+        the value
+    labels:
+        the labels of the gauge
+
+    """
+    with _lock:
+        _gauges[_key(name, labels)] = value
+
+
+def observe(name, value, **labels):
+    """Count a value in a histogram.
+
+    Parameters
+    ----------
+    name: str
+        name of the histogram
+    value: float
+        the observed value, in seconds
+    labels:
+        the labels of the histogram
+
+    """
+    key = _key(name, labels)
+    with _lock:
+        histogram = _histograms.setdefault(key, [[0] * len(DURATION_BUCKETS), 0., 0])
+        for (i, bound) in enumerate(DURATION_BUCKETS):
+            if value <= bound:
+                histogram[0][i] += 1
+        histogram[1] += value
+        histogram[2] += 1
+
+
+@contextmanager
+def timer(name, **labels):
+    """Observe the duration of a block of code in a histogram.
+
+    Parameters
+    ----------
+    name: str
+        name of the histogram, ending with `_seconds`
+    labels:
+        the labels of the histogram
+
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - start, **labels)
+
+
+def record_throughput(name, count, duration, **labels):
+    """Set a gauge to a number of items per second.
+
+    Parameters
+    ----------
+    name: str
+        name of the gauge, ending with `_per_second`
+    count: int
+        the number of items processed
+    duration: float
+        the processing duration, in seconds
+    labels:
+        the labels of the gauge
+
+    """
+    set_gauge(name, count / max(duration, 1e-6), **labels)
+
+
+def drain():
+    """Take the measures of the process, and reset them.
+
+    Returns
+    -------
+    dict
+        the measures, to be sent to the main process and given to `merge()`
+
+    """
+    global _counters, _gauges, _histograms
+    with _lock:
+        measures = {'counters': _counters, 'gauges': _gauges, 'histograms': _histograms}
+        (_counters, _gauges, _histograms) = ({}, {}, {})
+    return measures
+
+
+def merge(measures):
+    """Add the measures of another process to the ones of this process.
+
+    Parameters
+    ----------
+    measures: dict
+        the measures given by `drain()`
+
+    """
+    with _lock:
+        for (key, value) in measures['counters'].items():
+            _counters[key] = _counters.get(key, 0) + value
+        _gauges.update(measures['gauges'])
+        for (key, (buckets, total, count)) in measures['histograms'].items():
+            histogram = _histograms.setdefault(key, [[0] * len(DURATION_BUCKETS), 0., 0])
+            histogram[0] = [a + b for (a, b) in zip(histogram[0], buckets)]
+            histogram[1] += total
+            histogram[2] += count
+
+
+def instrument_engine(engine):
+    """Count the round trips of a SQLAlchemy engine to the database, by type of statement.
+
+    Parameters
+    ----------
+    engine: sqlalchemy.engine.Engine
+        the engine
+
+    """
+    from sqlalchemy import event
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def count_round_trip(conn, cursor, statement, parameters, context, executemany):
+        increment("db_round_trips_total", statement=statement.lstrip().split(None, 1)[0].upper() if statement.strip() else "")
+
+
+def get_report(**run_info):
+    """Build the run report of the measures of the process.
+
+    Parameters
+    ----------
+    run_info:
+        the information on the run added to the report
+
+    Returns
+    -------
+    dict
+        the report, serializable to JSON
+
+    """
+    with _lock:
+        report = dict(run_info)
+        report['counters'] = [{'name': name, 'labels': dict(labels), 'value': value} for ((name, labels), value) in sorted(_counters.items())]
+        report['gauges'] = [{'name': name, 'labels': dict(labels), 'value': value} for ((name, labels), value) in sorted(_gauges.items())]
+        report['histograms'] = [
+            {'name': name, 'labels': dict(labels), 'buckets': dict(zip([str(bound) for bound in DURATION_BUCKETS], buckets)), 'sum': total, 'count': count}
+            for ((name, labels), (buckets, total, count)) in sorted(_histograms.items())
+        ]
+    return report
+
+
+def format_labels(labels, **extra_labels):
+    """Format the labels of a measure in the Prometheus text format.
+
+    Parameters
+    ----------
+    labels: tuple
+        the sorted (name, value) pairs
+    extra_labels:
+        labels added after them
+
+    Returns
+    -------
+    str
+        the labels between braces, empty if there are none
+
+    """
+    pairs = list(labels) + sorted(extra_labels.items())
+    if not pairs:
+        return ""
+    # Backslashes, double quotes and line feeds are escaped in the values
+    values = [str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for (_, value) in pairs]
+    return "{{{}}}".format(",".join('{}="{}"'.format(label, value) for ((label, _), value) in zip(pairs, values)))
+
+
+def format_prometheus(report):
+    """Format a run report in the Prometheus text format.
+
+    Parameters
+    ----------
+    report: dict
+        the report given by `get_report()`
+
+    Returns
+    -------
+    str
+        the content of the textfile
+
+    """
+    lines = []
+    typed = set()
+
+    def add_type(name, metric_type):
+        if name not in typed:
+            typed.add(name)
+            lines.append("# TYPE {}{} {}".format(PROMETHEUS_PREFIX, name, metric_type))
+
+    for (kind, metric_type) in (('counters', 'counter'), ('gauges', 'gauge')):
+        for measure in report[kind]:
+            add_type(measure['name'], metric_type)
+            lines.append("{}{}{} {}".format(PROMETHEUS_PREFIX, measure['name'], format_labels(sorted(measure['labels'].items())), measure['value']))
+
+    for measure in report['histograms']:
+        add_type(measure['name'], 'histogram')
+        labels = sorted(measure['labels'].items())
+        name = PROMETHEUS_PREFIX + measure['name']
+        for (bound, count) in measure['buckets'].items():
+            lines.append("{}_bucket{} {}".format(name, format_labels(labels, le=bound), count))
+        lines.append("{}_bucket{} {}".format(name, format_labels(labels, le="+Inf"), measure['count']))
+        lines.append("{}_sum{} {}".format(name, format_labels(labels), measure['sum']))
+        lines.append("{}_count{} {}".format(name, format_labels(labels), measure['count']))
+
+    return "\n".join(lines) + "\n"
+
+
+def write_reports(metrics_dir_path, **run_info):
+    """Write the run report in JSON, and the Prometheus textfile, in a folder.
+
+    The JSON reports of the successive runs are kept, named after their start time. The textfile is replaced,
+    at once so that the node exporter never reads a partial file.
+
+    Parameters
+    ----------
+    metrics_dir_path: path-like object
+        path to the folder of the reports, created if needed
+    run_info:
+        the information on the run added to the report, e.g. its `start` timestamp
+
+    Returns
+    -------
+    str
+        path to the JSON report
+
+    """
+    os.makedirs(metrics_dir_path, exist_ok=True)
+    report = get_report(**run_info)
+
+    report_path = join(metrics_dir_path, "run_report_{}.json".format(time.strftime("%Y%m%d-%H%M%S", time.localtime(run_info.get('start', time.time())))))
+    with open(report_path, 'w') as report_file:
+        json.dump(report, report_file, indent=1, sort_keys=True)
+
+    textfile_path = join(metrics_dir_path, PROMETHEUS_FILE)
+    with open("{}.tmp".format(textfile_path), 'w') as textfile:
+        textfile.write(format_prometheus(report))
+    os.replace("{}.tmp".format(textfile_path), textfile_path)
+
+    return report_path
@@ -0,0 +1,138 @@
+"""Read-ahead of the input files
+
+Reading a light curve over the NFS mostly waits for the storage, while parsing or plotting it mostly waits for the CPU.
+`prefetch()` reads the next files of a list in background threads while the current one is processed, so that the reads
+overlap with the computations. At most `PREFETCH_DEPTH` files are read ahead, which bounds the memory used by the buffers.
+The files are handed over as bytes, parsed from memory by the stages, e.g. with `fits.open(io.BytesIO(content))`.
+`map_bounded()` applies the same bounded read-ahead to the results of the calls run by an executor.
+
+"""
+import logging
+import os
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from . import metrics
+
+# Number of files read ahead when PREFETCH_DEPTH is not set
+DEFAULT_PREFETCH_DEPTH = 4
+
+
+def get_prefetch_depth():
+    """Number of files read ahead, from the PREFETCH_DEPTH environment variable.
+
+    Returns
+    -------
+    int
+        the depth, 0 not to read ahead
+
+    """
+    return max(int(os.getenv("PREFETCH_DEPTH", DEFAULT_PREFETCH_DEPTH)), 0)
+
+
+def read_file(path):
+    """Read the whole content of a file.
+
+    Parameters
+    ----------
+    path: path-like object
+        path to the file
+
+    Returns
+    -------
+    bytes
+        the content of the file
+
+    """
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def try_read(read, path):
+    # A failed read is left to the consumer, which reads the file itself and handles the error as usual
+    try:
+        return read(path)
+    except Exception as e:
+        logging.debug("Could not prefetch {} : {}".format(path, e))
+        return None
+
+
+def prefetch(paths, read=read_file, depth=None, stage=None):
+    """Read files ahead of their use, in background threads.
+
+    The time spent waiting for the next file is recorded in the `prefetch_wait_seconds` histogram : close to zero when
+    the reads are fully overlapped with the processing of the previous files.
+
+    Parameters
+    ----------
+    paths: iterable of path-like objects
+        paths to the files, in the order they are processed
+    read: callable
+        function reading a file from its path, e.g. `read_file()` or a reader of the header blocks only
+    depth: int
+        maximum number of files read ahead, read from PREFETCH_DEPTH if None. With 0 nothing is read ahead.
+    stage: str
+        name of the stage, label of the metrics
+
+    Yields
+    ------
+    (path-like object, bytes or None)
+        each path with the content read by `read`, in the order of `paths`.
+        The content is None if the file was not read ahead or could not be read : the consumer must read it itself.
+
+    """
+    if depth is None:
+        depth = get_prefetch_depth()
+
+    if depth < 1:
+        for path in paths:
+            yield path, None
+        return
+
+    with ThreadPoolExecutor(max_workers=depth) as executor:
+        pending = deque()
+        for path in paths:
+            pending.append((path, executor.submit(try_read, read, path)))
+            # The file processed next is waited for, with `depth` other files being read meanwhile
+            if len(pending) > depth:
+                yield get_prefetched(pending.popleft(), stage)
+        while pending:
+            yield get_prefetched(pending.popleft(), stage)
+
+
+def get_prefetched(pending_read, stage):
+    # Waits for a read submitted by prefetch()
+    (path, future) = pending_read
+    start = time.perf_counter()
+    content = future.result()
+    metrics.observe("prefetch_wait_seconds", time.perf_counter() - start, stage=stage)
+    return path, content
+
+
+def map_bounded(executor, function, items, window):
+    """Ordered `executor.map` keeping at most `window` results in memory.
+
+    Parameters
+    ----------
+    executor: concurrent.futures.Executor
+        the executor running the calls
+    function: callable
+        function called on each item
+    items: iterable
+        the items
+    window: int
+        maximum number of pending calls
+
+    Yields
+    ------
+    the results, in the order of the items
+
+    """
+    pending = deque()
+    for item in items:
+        pending.append(executor.submit(function, item))
+        if len(pending) >= window:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
@@ -0,0 +1,105 @@
+"""Resumable runner of the pipeline stages
+
+A stage is run only if its inputs or settings changed since it last completed, or if it is asked for explicitly.
+Its progress is recorded in a checkpoint store (see `checkpoint.py`), so that an interrupted run resumes after the last
+completed unit of the stage.
+
+"""
+import logging
+import os
+import time
+from collections import namedtuple
+from os.path import exists
+
+from . import metrics
+from .checkpoint import CheckpointStore, get_inputs_signature
+
+# A stage of the pipeline :
+#    - name : name of the stage, used on the command line and in the checkpoint store
+#    - run : function running the stage, called with its StageCheckpoint
+#    - inputs : files and folders read by the stage
+#    - outputs : files and folders written by the stage, run again if one of them is missing
+#    - settings : names of the environment variables changing its results
+#    - always_run : True to run it even when its inputs did not change
+Stage = namedtuple('Stage', ['name', 'run', 'inputs', 'outputs', 'settings', 'always_run'])
+
+
+def get_stage_signature(stage):
+    """Hash the current inputs and settings of a stage.
+
+    Parameters
+    ----------
+    stage: Stage
+        the stage
+
+    Returns
+    -------
+    str
+        the signature, see `checkpoint.get_inputs_signature()`
+
+    """
+    return get_inputs_signature(stage.inputs, {name: os.getenv(name) for name in stage.settings})
+
+
+def run_pipeline(stages, checkpoint_path, selected_stages=None, force=False, metrics_dir_path=None):
+    """Run the stages of the pipeline in order, skipping those whose inputs did not change since they completed.
+
+    The duration of each stage, and the measures recorded by the stages, are written in a run report at the end of the run,
+    even if a stage fails (see `metrics.py`).
+
+    Parameters
+    ----------
+    stages: list of Stage
+        the stages, in the order they must be run
+    checkpoint_path: path-like object
+        path to the checkpoint file
+    selected_stages: list of str
+        names of the only stages to run, whatever their inputs. All the stages if None.
+    force: bool
+        True to run the stages from scratch, forgetting their checkpoints
+    metrics_dir_path: path-like object
+        path to the folder of the run reports, None not to write them
+
+    """
+    store = CheckpointStore(checkpoint_path)
+    start = time.time()
+    stages_status = {}
+
+    try:
+        for stage in stages:
+            if selected_stages and stage.name not in selected_stages:
+                continue
+
+            signature = get_stage_signature(stage)
+            up_to_date = store.is_stage_done(stage.name, signature) and all(exists(path) for path in stage.outputs)
+            if up_to_date and not (force or selected_stages or stage.always_run):
+                logging.info("Stage {} : inputs unchanged since its last run, skipping".format(stage.name))
+                stages_status[stage.name] = "skipped"
+                continue
+
+            logging.info("Stage {} : starting".format(stage.name))
+            stages_status[stage.name] = "failed"
+            stage_start = time.time()
+            checkpoint = store.start_stage(stage.name, signature, reset=force)
+            if len(checkpoint):
+                logging.info("Stage {} : resuming after {} completed units".format(stage.name, len(checkpoint)))
+                metrics.set_gauge("stage_resumed_units", len(checkpoint), stage=stage.name)
+
+            try:
+                stage.run(checkpoint)
+            finally:
+                metrics.set_gauge("stage_duration_seconds", time.time() - stage_start, stage=stage.name)
+
+            store.complete_stage(stage.name)
+            stages_status[stage.name] = "done"
+            logging.info("Stage {} : done in {:.1f} s".format(stage.name, time.time() - stage_start))
+
+        logging.info("Pipeline done in {:.1f} s".format(time.time() - start))
+
+    finally:
+        metrics.set_gauge("run_duration_seconds", time.time() - start)
+        for (name, status) in stages_status.items():
+            metrics.set_gauge("stage_status", 1, stage=name, status=status)
+        if metrics_dir_path is not None:
+            report_path = metrics.write_reports(metrics_dir_path, start=start, duration=time.time() - start, stages=stages_status)
+            logging.info("Run report written in {}".format(report_path))
@@ -0,0 +1,94 @@
+"""
+plot_to_file.decimation reduces the number of elements drawn for a light curve, without changing the image.
+
+The samples are projected on the pixels of the plot. In each pixel column the samples are sorted by flux, and split into runs
+wherever two consecutive fluxes are further apart than a marker : the markers of a run overlap, so the run is drawn as the markers
+of its lowest and highest samples, joined by a segment as wide as a marker. The noise band, the envelope of the light curve,
+its outliers, transits and gaps are thus drawn as with one marker per sample, to within the antialiasing of the edges.
+Where the noise band is dense in pixels a column holds a single run, e.g. when a transit stretches the flux axis : a 2-minutes
+cadence sector of about 20 000 samples is then drawn with a few thousand elements. Sparse samples are kept as they are.
+"""
+import numpy as np
+
+def decimate_min_max(x, y, max_gap=np.inf):
+    """
+    Splits the samples of each pixel column into runs of overlapping samples, and finds the extremes of each run
+
+    Parameters
+    ----------
+    x: numpy.ndarray
+        the horizontal positions of the samples, in pixels : a pixel column holds the positions between two consecutive integers
+    y: numpy.ndarray
+        the vertical positions of the samples, in pixels
+    max_gap: float
+        the largest distance between two consecutive samples of a run, in pixels. By default a column holds a single run,
+        from its minimum to its maximum.
+
+    Returns
+    -------
+    (numpy.ndarray, numpy.ndarray)
+        the indices of the lowest and of the highest sample of each run, sorted by column. The samples with a missing value are dropped.
+    """
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+
+    valid = np.flatnonzero(np.isfinite(x) & np.isfinite(y))
+    if len(valid) == 0:
+        return (valid, valid)
+
+    #Sorting by column then position : the runs are contiguous, their first and last samples are their extremes
+    order = valid[np.lexsort((y[valid], np.floor(x[valid])))]
+    columns = np.floor(x[order])
+    starts = np.flatnonzero(np.r_[True, (columns[1:] != columns[:-1]) | (np.diff(y[order]) > max_gap)])
+    stops = np.r_[starts[1:], len(order)] - 1
+
+    return (order[starts], order[stops])
+
+def plot_min_max(ax, time, flux, marker_size, color='k'):
+    """
+    Draws a light curve on the axes looking like one '.' marker per sample, from the extremes of the runs of overlapping samples
+    of each pixel column only (see decimate_min_max). The limits of the axes are the same as with every marker.
+
+    Parameters
+    ----------
+    ax: matplotlib.axes.Axes
+        the axes to draw on, whose figure has its final size and resolution
+    time: numpy.ndarray
+        the time stamps of the samples
+    flux: numpy.ndarray
+        the fluxes of the samples
+    marker_size: float
+        the diameter of the '.' markers, edge included, in points
+    color: str
+        the color of the markers
+
+    Returns
+    -------
+    int
+        the number of runs drawn
+    """
+    from matplotlib.collections import LineCollection
+
+    time = np.asarray(time, dtype=np.float64)
+    flux = np.asarray(flux, dtype=np.float64)
+    valid = np.isfinite(time) & np.isfinite(flux)
+    if not valid.any():
+        return 0
+    (time, flux) = (time[valid], flux[valid])
+
+    #Same data limits, hence same autoscaled axes, as every marker
+    ax.update_datalim([(time.min(), flux.min()), (time.max(), flux.max())])
+    ax.autoscale_view()
+
+    #Decimating in pixels, the kept samples are then drawn in data coordinates so that they follow the resolution of the saved file
+    pixels = ax.transData.transform(np.column_stack((time, flux)))
+    (lowest, highest) = decimate_min_max(pixels[:, 0], pixels[:, 1], max_gap=marker_size * ax.figure.dpi / 72.)
+
+    #The extremes of each run as markers, joined by a segment as wide as a marker covering the samples between them
+    kept = np.unique(np.r_[lowest, highest])
+    ax.plot(time[kept], flux[kept], linestyle='none', marker='.', color=color)
+    extended = lowest != highest
+    segments = np.stack((np.column_stack((time[lowest[extended]], flux[lowest[extended]])), np.column_stack((time[highest[extended]], flux[highest[extended]]))), axis=1)
+    ax.add_collection(LineCollection(segments, colors=color, linewidths=marker_size, capstyle='butt'), autolim=False)
+
+    return len(lowest)
@@ -1,55 +1,116 @@
-from astropy.io import fits
-import matplotlib.pyplot as plt
 import numpy as np
+import io
 import logging
 import os
+import time
 
-from os.path import isdir, join
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from os.path import isdir, isfile, join
 
 from ..catascript.base import Base, Session
 from ..catascript.models import Catalog, Confirmed
+from ..pipeline import metrics
+from ..pipeline.prefetch import get_prefetch_depth, prefetch
+from .decimation import plot_min_max
+from .render_cache import compute_render_key, evict_stale_plots, load_render_cache, save_render_cache
 
-#Setting properties for matplotlib (width, heigth in inches)
-plt.rcParams["figure.figsize"] = (20,3)
+#Size of the figures (width, heigth in inches)
+FIGURE_SIZE = (20,3)
+#Resolution of the figures, in dots per inch
+FIGURE_DPI = 100
+
+#Rendering modes : every sample as a vector point, overlapping points merged in segments per pixel column, or points layer rasterized
+PLOT_MODES = ("points", "decimated", "rasterized")
+PLOT_FORMATS = ("svg", "png")
 
 def create_dir(directory):
     # Create the directory to store the plots on first run
     if not isdir(directory):
          os.mkdir(directory)
 
+def get_render_options(mode="points", plot_format="svg"):
+    """
+    This function checks and gathers the options changing the rendered plots, that are also part of the render cache keys
+
+    Parameters
+    ----------
+    mode : str
+        The rendering mode, one of PLOT_MODES
+    plot_format : str
+        The format of the plot files, one of PLOT_FORMATS
+
+    Returns
+    -------
+    dict
+        The rendering options
+    """
+    if mode not in PLOT_MODES:
+        raise ValueError("Unknown plot mode {}, expected one of {}".format(mode, ", ".join(PLOT_MODES)))
+    if plot_format not in PLOT_FORMATS:
+        raise ValueError("Unknown plot format {}, expected one of {}".format(plot_format, ", ".join(PLOT_FORMATS)))
+
+    return {"figure_size": FIGURE_SIZE, "dpi": FIGURE_DPI, "mode": mode, "format": plot_format}
+
+def get_plot_path(processed_dir_path, TIC, options):
+    """
+    This function gives the path to the plot of a light curve
+
+    Parameters
+    ----------
+    processed_dir_path : str
+        Path to the folder of processed data in the nfs
+    TIC : int
+        The value of the TIC ID
+    options : dict
+        The rendering options, as given by get_render_options
+
+    Returns
+    -------
+    str
+        The path to the plot file
+    """
+    return '{}/plots_to_file/{}_lc.{}'.format(processed_dir_path, TIC, options["format"])
+
 def get_TICS_with_confirmed_and_info():
     """
     This function queries the database and returns the TIC IDs that have a confirmed planet.
+    A single query joins the catalog and confirmed tables, fetching only the needed columns, and its results are streamed from a server-side cursor.
 
     Returns
     -------
     dict_TIC_IDs : dict
         The dictionnary containing the (TIC ID, (path to the ligth curve storage on the nfs, name of star, discovery method)) pairs.
     """
-    #Catalog Query
+    #Joined Query
     session = Session()
 
-    TIC_query = session.query(Catalog).filter(Catalog.already_confirmed == True).all()
-
-    #Creating the dict of data
-    dict_TIC_IDs = {}
-
-    for catalog_entry in TIC_query:
-        #Querying more info
-        info_query = session.query(Confirmed).filter(Confirmed.catalog_id == catalog_entry.ID).limit(1)
-        confirmed_entry = info_query[0]
+    try:
+        TIC_query = (
+            session.query(Catalog.ID, Catalog.path, Confirmed.Host_name, Confirmed.Discovery_Method)
+            .join(Confirmed, Confirmed.catalog_id == Catalog.ID)
+            .filter(Catalog.already_confirmed == True)
+            .order_by(Catalog.ID)
+            .execution_options(stream_results=True)
+            .yield_per(1000)
+        )
 
-        dict_TIC_IDs[catalog_entry.ID] = (catalog_entry.path, confirmed_entry.Host_name, confirmed_entry.Discovery_Method)
+        #Creating the dict of data
+        dict_TIC_IDs = {ID: (path, host_name, discovery_method) for (ID, path, host_name, discovery_method) in TIC_query}
 
-    session.close()
+    finally:
+        session.close()
 
     #Returning
     return(dict_TIC_IDs)
 
 
-def make_and_save_light_curve(TIC, info, processed_dir_path):
+def make_and_save_light_curve(TIC, info, processed_dir_path, options=None, content=None):
     """
-    This function plots the light curve using matplotlib and saves the output to a svg file
+    This function plots the light curve using matplotlib and saves the output to a svg or png file.
+    The figure is created with matplotlib's object-oriented API, without pyplot and its global state, so that plots can be rendered in parallel processes.
+
+    In the "decimated" mode the overlapping markers of each pixel column are merged into vertical segments, drawing the same image with fewer elements where the noise band is dense.
+    In the "rasterized" mode the points are drawn as a single image embedded in the svg.
 
     Parameters
     ----------
@@ -59,7 +120,26 @@ def make_and_save_light_curve(TIC, info, processed_dir_path):
         (path to the ligth curve storage on the nfs, name of star, discovery method)
     processed_dir_path : str
         Path to the folder of processed data in the nfs
+    options : dict
+        The rendering options, as given by get_render_options. Defaults to every sample as a vector point in a svg file.
+    content : bytes
+        The content of the light curve file if it was read ahead (see pipeline.prefetch), None to read it from the nfs
+
+    Returns
+    -------
+    float
+        The rendering duration, in seconds
     """
+    # astropy and matplotlib are only imported when a plot is rendered
+    from astropy.io import fits
+    from matplotlib import rcParams
+    from matplotlib.figure import Figure
+
+    start = time.time()
+
+    if options is None:
+        options = get_render_options()
+
     # Unpacking info
     (lc_path, name, method) = info
 
@@ -67,24 +147,111 @@ def make_and_save_light_curve(TIC, info, processed_dir_path):
     logging.info("TIC {} : Tackling {} file".format(TIC, lc_path))
     
     # Opening the data
-    with fits.open(lc_path, mode="readonly") as hdulist:
-        tess_bjds = hdulist[1].data['TIME']
-        pdcsap_fluxes = hdulist[1].data['PDCSAP_FLUX']
+    # The content read ahead is parsed from memory
+    with metrics.timer("fits_open_seconds", stage="plot_to_file", reader="astropy" if content is None else "prefetched"):
+        with fits.open(lc_path if content is None else io.BytesIO(content), mode="readonly") as hdulist:
+            tess_bjds = hdulist[1].data['TIME']
+            pdcsap_fluxes = hdulist[1].data['PDCSAP_FLUX']
+    metrics.increment("bytes_read_total", os.path.getsize(lc_path) if content is None else len(content), stage="plot_to_file")
     
-    # Plotting
-    fig, ax = plt.subplots()
-    ax.plot(tess_bjds, pdcsap_fluxes, 'k.') 
+    # Plotting, on a figure that is not managed by pyplot (no need to close it)
+    fig = Figure(figsize=options["figure_size"], dpi=options["dpi"])
+    ax = fig.subplots()
+    if options["mode"] == "decimated":
+        # Segments as wide as the '.' markers of the other modes : a circle of half the marker size, with its edge
+        plot_min_max(ax, tess_bjds, pdcsap_fluxes, 0.5 * rcParams["lines.markersize"] + rcParams["lines.markeredgewidth"])
+    else:
+        ax.plot(tess_bjds, pdcsap_fluxes, 'k.', rasterized=(options["mode"] == "rasterized"))
 
     #Adding a title
     fig.suptitle("{name}, discovered by {method}".format(name=name, method=method))
 
-    #Saving the file to svg
-    plt.savefig('{}/plots_to_file/{}_lc.svg'.format(processed_dir_path,TIC))
-    plt.close(fig)
+    #Saving the file
+    fig.savefig(get_plot_path(processed_dir_path, TIC, options), dpi=options["dpi"])
+
+    return time.time() - start
+
+def run_plot_worker(TIC, info, processed_dir_path, options):
+    """
+    This function plots a light curve in a worker process, see make_and_save_light_curve
+
+    Returns
+    -------
+    (float, dict)
+        The rendering duration in seconds, and the metrics recorded by the worker while rendering it
+    """
+    duration = make_and_save_light_curve(TIC, info, processed_dir_path, options)
+    return duration, metrics.drain()
+
+def render_light_curves(dict_TIC_IDs, processed_dir_path, n_workers=1, options=None, prefetch_depth=0):
+    """
+    This function plots all the given light curves, in parallel processes if more than one worker is asked.
+    Otherwise the next prefetch_depth light curve files are read in background threads while the current one is rendered.
+    The progress and the duration of each plot are logged and recorded in the metrics. A light curve that cannot be plotted is logged and skipped.
+
+    Parameters
+    ----------
+    dict_TIC_IDs : dict
+        The dictionnary containing the (TIC ID, (path to the ligth curve storage on the nfs, name of star, discovery method)) pairs.
+    processed_dir_path : str
+        Path to the folder of processed data in the nfs
+    n_workers : int
+        The number of plots rendered at once
+    options : dict
+        The rendering options, as given by get_render_options
+    prefetch_depth : int
+        The number of light curve files read ahead when the plots are rendered one after another, 0 not to read ahead
+
+    Returns
+    -------
+    list
+        The TIC IDs whose light curve was plotted
+    """
+    nb_plots = len(dict_TIC_IDs)
+    rendered_TICs = []
+    start = time.time()
+
+    def log_result(TIC, get_duration, nb_done):
+        try:
+            duration = get_duration()
+        except Exception as e:
+            logging.warning("TIC {} : could not be plotted, {}: {} ({}/{})".format(TIC, type(e).__name__, e, nb_done, nb_plots))
+            metrics.increment("plots_total", status="failed")
+            return
+        rendered_TICs.append(TIC)
+        metrics.observe("plot_render_seconds", duration)
+        metrics.increment("plots_total", status="rendered")
+        logging.info("TIC {} : plotted in {:.2f} s ({}/{})".format(TIC, duration, nb_done, nb_plots))
+
+    def get_worker_duration(future):
+        (duration, worker_metrics) = future.result()
+        metrics.merge(worker_metrics)
+        return duration
+
+    if n_workers > 1 and nb_plots > 1:
+        with ProcessPoolExecutor(max_workers=n_workers) as executor:
+            futures = {executor.submit(run_plot_worker, TIC, info, processed_dir_path, options): TIC for (TIC, info) in dict_TIC_IDs.items()}
+
+            for (nb_done, future) in enumerate(as_completed(futures), 1):
+                log_result(futures[future], lambda: get_worker_duration(future), nb_done)
+
+    else:
+        TICs = list(dict_TIC_IDs)
+        light_curves = prefetch([dict_TIC_IDs[TIC][0] for TIC in TICs], depth=prefetch_depth, stage="plot_to_file")
+        for (nb_done, (TIC, (_, content))) in enumerate(zip(TICs, light_curves), 1):
+            log_result(TIC, lambda: make_and_save_light_curve(TIC, dict_TIC_IDs[TIC], processed_dir_path, options, content), nb_done)
+
+    duration = time.time() - start
+    logging.info("{} light curves plotted in {:.1f} s ({:.1f} plots/s)".format(len(rendered_TICs), duration, len(rendered_TICs) / max(duration, 1e-6)))
+
+    return rendered_TICs
 
 def make_light_curves_plot(processed_dir_path):
     """
-    This function builds the plot of all light curves and save them to svg, in a nfs subfolder
+    This function builds the plot of all light curves and save them to svg or png, in a nfs subfolder.
+    Only the plots whose inputs changed since they were rendered are built again (see plot_to_file.render_cache),
+    and the plots of the TICs that are no longer confirmed are removed.
+    The plots are rendered by batches, the render cache being saved after each one : an interrupted run resumes after the last batch.
 
     Parameters:
     -----------
@@ -93,9 +260,18 @@ def make_light_curves_plot(processed_dir_path):
     """
     #Get plotting boolean
     need_to_plot = int(os.getenv("PLOT_TO_FILE"))
+    #Get the number of plots rendered at once
+    n_workers = int(os.getenv("PLOT_WORKERS", 1))
+    #Get the number of plots rendered between two saves of the render cache
+    batch_size = max(int(os.getenv("PLOT_BATCH_SIZE", 200)), 1)
+    #Get the number of light curve files read ahead
+    prefetch_depth = get_prefetch_depth()
+    #Get the rendering options
+    options = get_render_options(os.getenv("PLOT_MODE", "points"), os.getenv("PLOT_FORMAT", "svg"))
 
     #Create directory
-    create_dir('{}/plots_to_file'.format(processed_dir_path))
+    plots_dir_path = '{}/plots_to_file'.format(processed_dir_path)
+    create_dir(plots_dir_path)
 
     if need_to_plot:
         logging.info("Processing : plotting to file light curves of TICS with confirmed planets")
@@ -103,9 +279,38 @@ def make_light_curves_plot(processed_dir_path):
         #Create a dir if not existent
         dict_TIC_IDs = get_TICS_with_confirmed_and_info()
 
-        #Plot to file all light curves
-        for (TIC, info) in dict_TIC_IDs.items():
-            make_and_save_light_curve(TIC, info, processed_dir_path)
+        #Compare the inputs of the plots with the ones of the rendered plots
+        render_cache = load_render_cache(plots_dir_path)
+        nb_evicted = evict_stale_plots(plots_dir_path, render_cache, dict_TIC_IDs.keys(), options["format"])
+        save_render_cache(plots_dir_path, render_cache)
+
+        render_keys = {TIC: compute_render_key(info, options) for (TIC, info) in dict_TIC_IDs.items()}
+        dict_TIC_IDs_to_render = {
+            TIC: info for (TIC, info) in dict_TIC_IDs.items()
+            if render_keys[TIC] is None or render_cache.get(str(TIC)) != render_keys[TIC] or not isfile(get_plot_path(processed_dir_path, TIC, options))
+        }
+        logging.info("Render cache : {} hits, {} misses, {} stale plots removed".format(
+            len(dict_TIC_IDs) - len(dict_TIC_IDs_to_render), len(dict_TIC_IDs_to_render), nb_evicted))
+        metrics.increment("render_cache_total", len(dict_TIC_IDs) - len(dict_TIC_IDs_to_render), result="hit")
+        metrics.increment("render_cache_total", len(dict_TIC_IDs_to_render), result="miss")
+        metrics.increment("plots_evicted_total", nb_evicted)
+
+        #Plot to file the light curves that changed, by batches
+        TICs_to_render = list(dict_TIC_IDs_to_render)
+        start_rendering = time.time()
+        for start in range(0, len(TICs_to_render), batch_size):
+            batch = {TIC: dict_TIC_IDs_to_render[TIC] for TIC in TICs_to_render[start:start + batch_size]}
+            rendered_TICs = render_light_curves(batch, processed_dir_path, n_workers, options, prefetch_depth)
+
+            #Record the inputs of the new plots
+            for TIC in rendered_TICs:
+                if render_keys[TIC] is not None:
+                    render_cache[str(TIC)] = render_keys[TIC]
+            save_render_cache(plots_dir_path, render_cache)
+            logging.info("Progress : {}/{} plots rendered".format(min(start + batch_size, len(TICs_to_render)), len(TICs_to_render)))
+
+        if TICs_to_render:
+            metrics.record_throughput("plots_per_second", len(TICs_to_render), time.time() - start_rendering)
 
         #Display message
         logging.info("Done")
@@ -0,0 +1,121 @@
+import hashlib
+import json
+import logging
+import os
+import re
+from os.path import isfile, join
+
+"""
+plot_to_file.render_cache records the inputs of each rendered plot, so that the plots whose inputs did not change are not rendered again.
+
+The inputs of a plot are hashed into a key : the path to the light curve and its modification time, the name of the star, the discovery method
+and the rendering options. The cache is a JSON file in the plots folder, holding the (TIC, key) pairs of the plots rendered so far.
+"""
+
+CACHE_FILE = "render_cache.json"
+
+#Name of the plot files, as written by make_and_save_light_curve
+PLOT_FILE_PATTERN = re.compile(r"^(\d+)_lc\.(\w+)$")
+
+def load_render_cache(plots_dir_path):
+    """
+    Loads the render cache of a plots folder
+
+    Parameters
+    ----------
+    plots_dir_path : str
+        Path to the plots folder
+
+    Returns
+    -------
+    dict
+        The (TIC ID as str, key) pairs, empty if there is no cache yet
+    """
+    cache_path = join(plots_dir_path, CACHE_FILE)
+    if not isfile(cache_path):
+        return {}
+
+    try:
+        with open(cache_path) as cache_file:
+            return json.load(cache_file)
+    except ValueError:
+        logging.warning("Corrupted render cache {}, rendering all plots again".format(cache_path))
+        return {}
+
+def save_render_cache(plots_dir_path, cache):
+    """
+    Saves the render cache of a plots folder
+
+    Parameters
+    ----------
+    plots_dir_path : str
+        Path to the plots folder
+    cache : dict
+        The (TIC ID as str, key) pairs
+    """
+    cache_path = join(plots_dir_path, CACHE_FILE)
+    tmp_path = "{}.tmp".format(cache_path)
+    with open(tmp_path, 'w') as cache_file:
+        json.dump(cache, cache_file, sort_keys=True)
+    os.replace(tmp_path, cache_path)
+
+def compute_render_key(info, options):
+    """
+    Hashes the inputs of a plot
+
+    Parameters
+    ----------
+    info : tuple
+        (path to the ligth curve storage on the nfs, name of star, discovery method)
+    options : dict
+        The rendering options that change the output
+
+    Returns
+    -------
+    str or None
+        The key, None if the light curve file cannot be accessed
+    """
+    (lc_path, name, method) = info
+    try:
+        mtime = os.stat(lc_path).st_mtime_ns
+    except OSError:
+        return None
+
+    inputs = json.dumps([lc_path, mtime, name, method, options], sort_keys=True)
+    return hashlib.sha1(inputs.encode('utf-8')).hexdigest()
+
+def evict_stale_plots(plots_dir_path, cache, TIC_IDs, plot_format=None):
+    """
+    Removes the plots, and their cache entries, of the TICs that are no longer confirmed,
+    as well as the plots left in another format
+
+    Parameters
+    ----------
+    plots_dir_path : str
+        Path to the plots folder
+    cache : dict
+        The (TIC ID as str, key) pairs, modified in place
+    TIC_IDs : iterable of int
+        The TIC IDs having a confirmed planet
+    plot_format : str
+        The extension of the plots currently rendered, None to keep all formats
+
+    Returns
+    -------
+    int
+        The number of plots removed
+    """
+    TIC_IDs = set(str(TIC) for TIC in TIC_IDs)
+    nb_evicted = 0
+
+    for file_name in os.listdir(plots_dir_path):
+        match = PLOT_FILE_PATTERN.match(file_name)
+        if match and (match.group(1) not in TIC_IDs or (plot_format is not None and match.group(2) != plot_format)):
+            os.remove(join(plots_dir_path, file_name))
+            nb_evicted += 1
+
+    for TIC in list(cache):
+        if TIC not in TIC_IDs:
+            del cache[TIC]
+
+    return nb_evicted
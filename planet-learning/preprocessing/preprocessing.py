@@ -0,0 +1,315 @@
+"""Module to clean the light curves of the flux store
+
+The light curves are processed by batches, as 2-D arrays of one row per light curve, with vectorized NumPy operations :
+    - the samples having a bad quality flag are masked
+    - the fluxes are divided by their median
+    - the slow variations of the star are removed by dividing by a moving median
+    - the short gaps are filled by linear interpolation, the longer ones are left missing
+The cleaned light curves are written in a second flux store, next to the raw one, with the same time stamps and quality flags.
+
+"""
+import logging
+import os
+import warnings
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from ..fluxstore.store import FluxStoreWriter, load_flux_store
+from ..pipeline.prefetch import map_bounded
+
+# QUALITY bits of the samples to discard : attitude tweak (1), safe mode (2), coarse point (4), Earth point (8),
+# Argabrightening (16), reaction wheel desaturation (32) and manual exclude (128)
+DEFAULT_QUALITY_BITMASK = 1 | 2 | 4 | 8 | 16 | 32 | 128
+# Width of the moving median, in samples : about 1 day at 2-minutes cadence
+DEFAULT_DETREND_WINDOW = 721
+# Longest gap filled by interpolation, in samples : 1 hour at 2-minutes cadence
+DEFAULT_MAX_GAP = 30
+
+
+def stack_rows(columns, fill_value=np.nan):
+    """Stack 1-D arrays of different lengths into a 2-D array.
+
+    Parameters
+    ----------
+    columns: list of numpy.ndarray
+        the arrays
+    fill_value: scalar
+        value of the missing samples at the end of the shorter arrays
+
+    Returns
+    -------
+    (numpy.ndarray, numpy.ndarray)
+        the (n, max length) array, and the length of each row
+
+    """
+    lengths = np.array([len(column) for column in columns], dtype=np.int64)
+    dtype = np.result_type(*columns) if len(columns) else np.float32
+    stacked = np.full((len(columns), lengths.max() if len(columns) else 0), fill_value, dtype=dtype)
+    for (i, column) in enumerate(columns):
+        stacked[i, :len(column)] = column
+    return stacked, lengths
+
+
+def mask_quality(flux, quality, bitmask=DEFAULT_QUALITY_BITMASK):
+    """Mask the samples having a bad quality flag.
+
+    Parameters
+    ----------
+    flux: numpy.ndarray
+        (n, length) fluxes
+    quality: numpy.ndarray
+        (n, length) quality flags
+    bitmask: int
+        the bits of the flags to discard
+
+    Returns
+    -------
+    numpy.ndarray
+        a copy of the fluxes, with NaN for the discarded samples
+
+    """
+    return np.where((quality & bitmask) != 0, np.nan, flux)
+
+
+def normalize_by_median(flux):
+    """Divide each light curve by its median.
+
+    Parameters
+    ----------
+    flux: numpy.ndarray
+        (n, length) fluxes, NaN for the missing samples
+
+    Returns
+    -------
+    numpy.ndarray
+        the normalized fluxes, around 1
+
+    """
+    with warnings.catch_warnings():
+        # Light curves without any valid sample give NaN
+        warnings.simplefilter("ignore", RuntimeWarning)
+        median = np.nanmedian(flux, axis=1, keepdims=True)
+    return flux / median
+
+
+def nanmedian_last_axis(values):
+    """Median along the last axis, ignoring NaN.
+
+    Unlike `numpy.nanmedian`, which loops in Python over the rows when they are long, the rows are sorted at once
+    (NaN at the end) and the middle of their valid values is picked.
+
+    Parameters
+    ----------
+    values: numpy.ndarray
+        the values, NaN for the missing ones
+
+    Returns
+    -------
+    numpy.ndarray
+        the medians, NaN for the rows without any valid value
+
+    """
+    counts = np.count_nonzero(~np.isnan(values), axis=-1)
+    ordered = np.sort(values, axis=-1)
+    low = np.take_along_axis(ordered, np.maximum((counts - 1) // 2, 0)[..., None], axis=-1)[..., 0]
+    high = np.take_along_axis(ordered, (counts // 2)[..., None], axis=-1)[..., 0]
+    medians = (low + high) / 2
+    medians[counts == 0] = np.nan
+    return medians
+
+
+def moving_median(flux, window, step=None):
+    """Moving median of each light curve, ignoring the missing samples.
+
+    The median is computed every `step` samples over `window` samples centered on them, and interpolated linearly in between,
+    so that the temporary array holds `length / step * window` values per light curve instead of `length * window`.
+
+    Parameters
+    ----------
+    flux: numpy.ndarray
+        (n, length) fluxes, NaN for the missing samples
+    window: int
+        the width of the moving window, in samples
+    step: int
+        the spacing of the computed medians, in samples. Defaults to a 24th of the window.
+
+    Returns
+    -------
+    numpy.ndarray
+        the (n, length) moving median, NaN where the window holds no valid sample
+
+    """
+    (n, length) = flux.shape
+    if length == 0:
+        return flux.copy()
+    step = max(1, window // 24) if step is None else step
+    half = window // 2
+
+    # Windows centered on every step-th sample, as a strided view on the padded fluxes
+    padded = np.full((n, length + 2 * half), np.nan, dtype=np.float32)
+    padded[:, half:half + length] = flux
+    centers = np.arange(0, length, step)
+    windows = np.lib.stride_tricks.as_strided(
+        padded, shape=(n, len(centers), 2 * half + 1),
+        strides=(padded.strides[0], step * padded.strides[1], padded.strides[1]), writeable=False,
+    )
+    medians = nanmedian_last_axis(windows)
+
+    # Linear interpolation between the centers, identical for all the light curves
+    samples = np.arange(length)
+    left = np.minimum(samples // step, len(centers) - 1)
+    right = np.minimum(left + 1, len(centers) - 1)
+    span = np.maximum(centers[right] - centers[left], 1)
+    weight = (samples - centers[left]) / span
+    interpolated = medians[:, left] * (1 - weight) + medians[:, right] * weight
+    # On the centers, the median is kept even if the next one is missing
+    return np.where(weight == 0, medians[:, left], interpolated).astype(flux.dtype)
+
+
+def detrend(flux, window=DEFAULT_DETREND_WINDOW):
+    """Remove the slow variations of each light curve by dividing it by its moving median.
+
+    Parameters
+    ----------
+    flux: numpy.ndarray
+        (n, length) fluxes, NaN for the missing samples
+    window: int
+        the width of the moving median, in samples. It must be well above the duration of the transits.
+
+    Returns
+    -------
+    numpy.ndarray
+        the detrended fluxes, around 1
+
+    """
+    return flux / moving_median(flux, window)
+
+
+def fill_gaps(flux, max_gap=DEFAULT_MAX_GAP):
+    """Fill the short gaps of each light curve by linear interpolation.
+
+    Parameters
+    ----------
+    flux: numpy.ndarray
+        (n, length) fluxes, NaN for the missing samples
+    max_gap: int
+        the longest gap filled, in samples. The longer gaps and those at the ends of the light curves are left missing.
+
+    Returns
+    -------
+    numpy.ndarray
+        a copy of the fluxes with the short gaps filled
+
+    """
+    (n, length) = flux.shape
+    valid = np.isfinite(flux)
+    samples = np.broadcast_to(np.arange(length), (n, length))
+
+    # Position of the previous and of the next valid sample of each sample
+    previous = np.maximum.accumulate(np.where(valid, samples, -1), axis=1)
+    following = np.minimum.accumulate(np.where(valid, samples, length)[:, ::-1], axis=1)[:, ::-1]
+
+    to_fill = ~valid & (previous >= 0) & (following < length) & (following - previous - 1 <= max_gap)
+    (rows, columns) = np.nonzero(to_fill)
+    (before, after) = (previous[rows, columns], following[rows, columns])
+    weight = (columns - before) / (after - before)
+
+    filled = flux.copy()
+    filled[rows, columns] = flux[rows, before] * (1 - weight) + flux[rows, after] * weight
+    return filled
+
+
+def clean_light_curves(flux, quality, bitmask=DEFAULT_QUALITY_BITMASK, window=DEFAULT_DETREND_WINDOW, max_gap=DEFAULT_MAX_GAP):
+    """Apply all the cleaning steps to a batch of light curves.
+
+    Parameters
+    ----------
+    flux: numpy.ndarray
+        (n, length) fluxes, NaN for the missing samples
+    quality: numpy.ndarray
+        (n, length) quality flags
+    bitmask: int
+        the bits of the quality flags to discard
+    window: int
+        the width of the moving median, in samples
+    max_gap: int
+        the longest gap filled, in samples
+
+    Returns
+    -------
+    numpy.ndarray
+        the (n, length) cleaned fluxes, around 1
+
+    """
+    flux = mask_quality(flux, quality, bitmask)
+    flux = normalize_by_median(flux)
+    flux = detrend(flux, window)
+    return fill_gaps(flux, max_gap)
+
+
+def clean_flux_store(store_path, clean_store_path, batch_size=64, n_workers=1, **cleaning_options):
+    """Clean all the light curves of a flux store into a second store.
+
+    Parameters
+    ----------
+    store_path: path-like object
+        path to the raw flux store
+    clean_store_path: path-like object
+        path to the folder of the cleaned store
+    batch_size: int
+        number of light curves processed at once. The moving median needs about 4 MB per light curve of 20 000 samples.
+    n_workers: int
+        number of batches processed at the same time
+    cleaning_options:
+        `bitmask`, `window` and `max_gap` arguments of `clean_light_curves()`
+
+    """
+    store = load_flux_store(store_path)
+    logging.info("Cleaning the {} light curves of {} into {}".format(len(store), store_path, clean_store_path))
+
+    def clean_batch(rows):
+        light_curves = [store.get_row(row) for row in rows]
+        (flux, lengths) = stack_rows([flux for (_, flux, _) in light_curves])
+        (quality, _) = stack_rows([quality for (_, _, quality) in light_curves], fill_value=0)
+        return light_curves, lengths, clean_light_curves(flux, quality, **cleaning_options)
+
+    batches = [range(start, min(start + batch_size, len(store))) for start in range(0, len(store), batch_size)]
+    writer = FluxStoreWriter(clean_store_path)
+    try:
+        with ThreadPoolExecutor(max_workers=max(n_workers, 1)) as executor:
+            for (rows, (light_curves, lengths, cleaned)) in zip(batches, map_bounded(executor, clean_batch, batches, 2 * max(n_workers, 1))):
+                for (i, row) in enumerate(rows):
+                    (time, _, quality) = light_curves[i]
+                    source_stat = (int(store.source_size[row]), int(store.source_mtime[row]))
+                    writer.add(int(store.ticid[row]), int(store.sector[row]), float(store.t0[row]), time, cleaned[i, :lengths[i]], quality, source_stat)
+        writer.close()
+
+    except BaseException:
+        writer.abort()
+        raise
+
+    logging.info("{} light curves cleaned".format(len(store)))
+
+
+def preprocessing(store_path, clean_store_path):
+    """Clean the flux store if asked in the configuration.
+
+    Parameters
+    ----------
+    store_path: path-like object
+        path to the raw flux store
+    clean_store_path: path-like object
+        path to the folder of the cleaned store
+
+    """
+    if not int(os.getenv("CLEAN_FLUX_STORE", 0)):
+        logging.info("Not cleaning the flux store")
+        return
+
+    clean_flux_store(
+        store_path, clean_store_path,
+        n_workers=int(os.getenv("CLEANING_WORKERS", 1)),
+        window=int(os.getenv("DETREND_WINDOW", DEFAULT_DETREND_WINDOW)),
+        max_gap=int(os.getenv("MAX_GAP_LENGTH", DEFAULT_MAX_GAP)),
+    )
@@ -0,0 +1,8 @@
+"""
+The tests import the modules of the pipeline as `planet-learning.<subpackage>.<module>` with importlib, the name of the package
+not being a valid identifier : the root of the repository is added to the import path, as when running `python -m planet-learning.main` from it.
+"""
+import sys
+from os.path import abspath, dirname
+
+sys.path.insert(0, dirname(dirname(dirname(abspath(__file__)))))
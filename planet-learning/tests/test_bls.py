@@ -0,0 +1,49 @@
+"""Tests of the Box Least Squares transit search, on injected transits"""
+from importlib import import_module
+
+import numpy as np
+import pytest
+
+bls = import_module("planet-learning.transitsearch.bls")
+
+
+def make_light_curve(rng, period, epoch, duration, depth, noise=1e-3, baseline=27.):
+    # A sector at 2-minutes cadence with the mid-sector gap, and a box transit
+    time = np.arange(0., baseline, 2. / 60 / 24)
+    flux = 1. + rng.normal(0., noise, len(time))
+    in_transit = np.abs((time - epoch + period / 2) % period - period / 2) < duration / 2
+    flux[in_transit] -= depth
+    flux[(time > 13.) & (time < 14.)] = np.nan
+    return time, flux
+
+
+@pytest.mark.parametrize("period", [1.7, 3.3, 8.9])
+def test_search_transits_recovers_the_injected_transit(period):
+    (epoch, duration, depth) = (0.8, 0.1, 3e-3)
+    (time, flux) = make_light_curve(np.random.RandomState(0), period, epoch, duration, depth)
+
+    candidates = bls.search_transits(time, flux, top_k=3)
+
+    best = candidates[0]
+    assert abs(best['period'] - period) / period < 0.01
+    assert abs(best['duration'] - duration) < 0.05
+    assert abs(best['depth'] - depth) / depth < 0.3
+    # Epoch of any transit, within a fraction of the duration
+    phase = (best['epoch'] - epoch) % period
+    assert min(phase, period - phase) < duration / 2
+    assert best['snr'] > 10
+    assert [candidate['power'] for candidate in candidates] == sorted((candidate['power'] for candidate in candidates), reverse=True)
+
+
+def test_search_transits_without_enough_samples():
+    assert bls.search_transits(np.array([0.]), np.array([1.])) == []
+
+
+def test_period_grid_is_capped():
+    periods = bls.period_grid(700., max_periods=1000)
+
+    assert len(periods) <= 1000
+    assert np.all(np.diff(periods) > 0)
+    assert periods[0] >= bls.DEFAULT_MIN_PERIOD and periods[-1] <= 350.
+    assert len(bls.period_grid(27.)) < bls.DEFAULT_MAX_PERIODS
+    assert len(bls.period_grid(700., max_periods=None)) > bls.DEFAULT_MAX_PERIODS
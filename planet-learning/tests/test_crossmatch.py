@@ -0,0 +1,66 @@
+"""Tests of the sky positions matching, against the brute force nearest neighbour"""
+from importlib import import_module
+
+import numpy as np
+import pytest
+
+crossmatch = import_module("planet-learning.catascript.crossmatch")
+
+
+def brute_force_match(ids, ra, dec, target_ra, target_dec, tolerance_arcsec):
+    # Angular separations of every target to every entry, with the haversine formula
+    (ra, dec, target_ra, target_dec) = (np.radians(ra), np.radians(dec), np.radians(target_ra)[:, None], np.radians(target_dec)[:, None])
+    haversine = np.sin((dec - target_dec) / 2) ** 2 + np.cos(dec) * np.cos(target_dec) * np.sin((ra - target_ra) / 2) ** 2
+    separations = np.degrees(2 * np.arcsin(np.sqrt(np.clip(haversine, 0., 1.)))) * 3600.
+    nearest = np.argmin(separations, axis=1)
+    nearest_separations = separations[np.arange(len(nearest)), nearest]
+    within = nearest_separations <= tolerance_arcsec
+    return np.where(within, ids[nearest], -1), np.where(within, nearest_separations, np.nan)
+
+
+def perturb(rng, ra, dec, max_arcsec):
+    # Positions moved in a random direction by up to max_arcsec
+    (angle, distance) = (rng.uniform(0., 2 * np.pi, len(ra)), rng.uniform(0., max_arcsec / 3600., len(ra)))
+    new_dec = np.clip(dec + distance * np.sin(angle), -90., 90.)
+    new_ra = np.mod(ra + distance * np.cos(angle) / np.maximum(np.cos(np.radians(new_dec)), 1e-6), 360.)
+    return new_ra, new_dec
+
+
+@pytest.mark.parametrize("region", ["everywhere", "ra_wrap", "north_pole", "south_pole"])
+def test_match_finds_the_nearest_entry(region):
+    rng = np.random.RandomState(0)
+    n = 2000
+    if region == "everywhere":
+        (ra, dec) = (rng.uniform(0., 360., n), np.degrees(np.arcsin(rng.uniform(-1., 1., n))))
+    elif region == "ra_wrap":
+        (ra, dec) = (np.mod(rng.uniform(-0.05, 0.05, n), 360.), rng.uniform(-1., 1., n))
+    else:
+        sign = 1. if region == "north_pole" else -1.
+        (ra, dec) = (rng.uniform(0., 360., n), sign * rng.uniform(89.95, 90., n))
+    ids = np.arange(1000, 1000 + n)
+
+    # Targets near the entries, within and beyond the tolerance, plus ra given out of [0, 360)
+    tolerance_arcsec = 20.
+    picked = rng.choice(n, 500)
+    (target_ra, target_dec) = perturb(rng, ra[picked], dec[picked], 3 * tolerance_arcsec)
+    target_ra[:50] -= 360.
+
+    (matched_ids, separations) = crossmatch.SkyIndex(ids, ra, dec).match(target_ra, target_dec, tolerance_arcsec)
+    (expected_ids, expected_separations) = brute_force_match(ids, ra, dec, target_ra, target_dec, tolerance_arcsec)
+
+    # Ties and the tolerance boundary aside, the same entries are matched
+    (_, nearest_separations) = brute_force_match(ids, ra, dec, target_ra, target_dec, np.inf)
+    close_calls = np.abs(nearest_separations - tolerance_arcsec) < 1e-6
+    assert np.count_nonzero(close_calls) < 5
+    assert np.array_equal(matched_ids[~close_calls], expected_ids[~close_calls])
+    assert np.allclose(separations, expected_separations, atol=1e-6, equal_nan=True)
+    assert (matched_ids != -1).any() and (matched_ids == -1).any()
+
+
+def test_missing_positions_are_not_matched():
+    index = crossmatch.SkyIndex([1, 2, 3], [10., np.nan, 10.], [20., 20., np.nan])
+
+    assert len(index) == 1
+    (matched_ids, separations) = index.match([10., np.nan, 10.], [20., 20., np.nan], 1.)
+    assert matched_ids.tolist() == [1, -1, -1]
+    assert separations[0] == 0. and np.isnan(separations[1:]).all()
@@ -0,0 +1,75 @@
+"""Tests of the decimation of the plots, against brute force and against the rendering of every marker"""
+import io
+from importlib import import_module
+
+import numpy as np
+from matplotlib import rcParams
+from matplotlib.figure import Figure
+from matplotlib.image import imread
+
+decimation = import_module("planet-learning.plot_to_file.decimation")
+
+
+def test_decimate_min_max_keeps_column_extremes():
+    rng = np.random.RandomState(0)
+    x = rng.uniform(0., 50., 2000)
+    y = rng.normal(0., 10., 2000)
+    y[::97] = np.nan
+
+    (lowest, highest) = decimation.decimate_min_max(x, y)
+
+    valid = np.isfinite(y)
+    columns = np.floor(x).astype(np.int64)
+    expected_columns = np.unique(columns[valid])
+    assert np.array_equal(columns[lowest], expected_columns)
+    assert np.array_equal(columns[highest], expected_columns)
+    for (column, low, high) in zip(expected_columns, lowest, highest):
+        in_column = valid & (columns == column)
+        assert y[low] == y[in_column].min()
+        assert y[high] == y[in_column].max()
+
+
+def test_decimate_min_max_splits_runs_on_gaps():
+    x = np.array([0.1, 0.2, 0.3, 0.4, 0.5, 1.5])
+    y = np.array([0., 1., 2., 10., 11., 5.])
+
+    (lowest, highest) = decimation.decimate_min_max(x, y, max_gap=3.)
+
+    assert lowest.tolist() == [0, 3, 5]
+    assert highest.tolist() == [2, 4, 5]
+
+
+def test_decimate_min_max_without_samples():
+    (lowest, highest) = decimation.decimate_min_max(np.array([np.nan]), np.array([1.]))
+
+    assert len(lowest) == 0
+    assert len(highest) == 0
+
+
+def render(draw):
+    # Light curve plot of the size of plot_to_file, as a png image
+    fig = Figure(figsize=(20, 3), dpi=100)
+    ax = fig.subplots()
+    draw(ax)
+    image = io.BytesIO()
+    fig.savefig(image, format='png')
+    image.seek(0)
+    return imread(image)
+
+
+def test_decimated_plot_matches_every_marker():
+    # A sector of white noise with a gap and a transit
+    rng = np.random.RandomState(1)
+    time = np.linspace(1325., 1352., 20000)
+    flux = rng.normal(10000., 10., len(time))
+    flux[(time > 1330.) & (time < 1330.2)] -= 300.
+    time[9500:10500] = np.nan
+
+    marker_size = 0.5 * rcParams['lines.markersize'] + rcParams['lines.markeredgewidth']
+    runs = []
+    reference = render(lambda ax: ax.plot(time, flux, 'k.'))
+    image = render(lambda ax: runs.append(decimation.plot_min_max(ax, time, flux, marker_size)))
+
+    differing = np.mean(np.any(np.abs(image - reference) > 1. / 255, axis=-1))
+    assert differing < 0.005
+    assert runs[0] < len(time) / 5
@@ -0,0 +1,58 @@
+"""Tests of the upgrade of databases created by previous versions of catascript, on SQLite"""
+from importlib import import_module
+
+import pytest
+from sqlalchemy import create_engine, inspect, text
+
+base = import_module("planet-learning.catascript.base")
+migrations = import_module("planet-learning.catascript.migrations")
+# Declares the tables of the models
+import_module("planet-learning.catascript.models")
+
+
+@pytest.fixture
+def old_engine(tmp_path):
+    # Database of a previous version : no indexes, duplicated confirmed entries and an empty observation table
+    engine = create_engine("sqlite:///{}".format(tmp_path / "catalog.db"))
+    base.Base.metadata.create_all(engine)
+    with engine.begin() as connection:
+        for (_, name, _) in migrations.INDEXES:
+            connection.execute(text("DROP INDEX {}".format(name)))
+        connection.execute(text('INSERT INTO catalog ("ID", "SECTOR", path, already_confirmed) VALUES (1, 1, \'a.fits\', 1), (2, 3, \'b.fits\', 1), (3, NULL, NULL, 0)'))
+        connection.execute(text('INSERT INTO confirmed ("ID", "Host_name", catalog_id) VALUES (1, \'A\', 1), (2, \'A\', 1), (3, \'B\', 2), (4, \'C\', NULL), (5, \'D\', NULL)'))
+    yield engine
+    engine.dispose()
+
+
+def get_rows(engine, query):
+    with engine.connect() as connection:
+        return [tuple(row) for row in connection.execute(text(query))]
+
+
+def test_upgrade_database(old_engine):
+    migrations.upgrade_database(old_engine)
+
+    inspector = inspect(old_engine)
+    for (table, name, _) in migrations.INDEXES:
+        assert name in set(index["name"] for index in inspector.get_indexes(table))
+    # The first confirmed entry of each system is kept, those without catalog entry as well
+    assert get_rows(old_engine, 'SELECT "ID" FROM confirmed ORDER BY "ID"') == [(1,), (3,), (4,), (5,)]
+    assert get_rows(old_engine, 'SELECT catalog_id, "SECTOR", path FROM observation ORDER BY catalog_id') == [(1, 1, 'a.fits'), (2, 3, 'b.fits')]
+
+
+def test_upgrade_database_is_idempotent(old_engine):
+    migrations.upgrade_database(old_engine)
+    tables = {table: get_rows(old_engine, "SELECT * FROM {}".format(table)) for table in ("catalog", "confirmed", "observation")}
+
+    migrations.upgrade_database(old_engine)
+
+    assert {table: get_rows(old_engine, "SELECT * FROM {}".format(table)) for table in tables} == tables
+
+
+def test_upgrade_keeps_existing_observations(old_engine):
+    with old_engine.begin() as connection:
+        connection.execute(text('INSERT INTO observation (catalog_id, "SECTOR", "TICVER", path) VALUES (1, 2, 8, \'c.fits\')'))
+
+    migrations.upgrade_database(old_engine)
+
+    assert get_rows(old_engine, 'SELECT catalog_id, "SECTOR", path FROM observation') == [(1, 2, 'c.fits')]
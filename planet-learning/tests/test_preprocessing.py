@@ -0,0 +1,99 @@
+"""Tests of the cleaning steps of the light curves, against brute force"""
+from importlib import import_module
+
+import numpy as np
+import pytest
+
+preprocessing = import_module("planet-learning.preprocessing.preprocessing")
+
+
+def make_flux(rng, n=3, length=400):
+    # Noisy slow variations, with missing samples and a light curve without any valid sample
+    flux = 1. + 0.01 * np.sin(np.arange(length) / 40.) + rng.normal(0., 1e-3, (n, length))
+    flux[rng.uniform(size=flux.shape) < 0.1] = np.nan
+    flux[0, 100:180] = np.nan
+    flux[-1] = np.nan
+    return flux.astype(np.float32)
+
+
+def brute_force_moving_median(flux, window):
+    half = window // 2
+    (n, length) = flux.shape
+    medians = np.full((n, length), np.nan)
+    for i in range(n):
+        for j in range(length):
+            values = flux[i, max(j - half, 0):j + half + 1]
+            if np.isfinite(values).any():
+                medians[i, j] = np.nanmedian(values)
+    return medians
+
+
+def test_nanmedian_last_axis():
+    rng = np.random.RandomState(0)
+    values = rng.normal(size=(50, 7))
+    values[rng.uniform(size=values.shape) < 0.3] = np.nan
+    values[0] = np.nan
+
+    with pytest.warns(RuntimeWarning):
+        expected = np.nanmedian(values, axis=-1)
+    assert np.allclose(preprocessing.nanmedian_last_axis(values), expected, equal_nan=True)
+
+
+@pytest.mark.parametrize("window", [1, 10, 31])
+def test_moving_median_matches_brute_force(window):
+    flux = make_flux(np.random.RandomState(1))
+
+    moving = preprocessing.moving_median(flux, window, step=1)
+
+    assert moving.dtype == flux.dtype
+    assert np.allclose(moving, brute_force_moving_median(flux, window), rtol=1e-6, equal_nan=True)
+
+
+def test_moving_median_interpolates_between_steps():
+    flux = make_flux(np.random.RandomState(2))
+    (window, step) = (61, 8)
+
+    moving = preprocessing.moving_median(flux, window, step=step)
+
+    # Exact on the centers, in between the medians of the surrounding centers elsewhere
+    exact = brute_force_moving_median(flux, window)
+    assert np.allclose(moving[:, ::step], exact[:, ::step], rtol=1e-6, equal_nan=True)
+    (low, high) = (np.fmin(exact[:, :-step:step], exact[:, step::step]), np.fmax(exact[:, :-step:step], exact[:, step::step]))
+    for offset in range(1, step):
+        between = moving[:, offset:-step:step][:, :low.shape[1]]
+        valid = np.isfinite(between)
+        assert np.all((between[valid] >= low[valid] - 1e-6) & (between[valid] <= high[valid] + 1e-6))
+
+
+def test_fill_gaps_fills_short_interior_gaps_only():
+    flux = np.arange(40, dtype=np.float64)[None, :].repeat(2, axis=0)
+    flux[0, 5:8] = np.nan   # 3 samples : filled
+    flux[0, 20:24] = np.nan  # 4 samples : too long
+    flux[0, :2] = np.nan    # edges : left missing
+    flux[0, 38:] = np.nan
+    flux[1] = np.nan
+
+    filled = preprocessing.fill_gaps(flux, max_gap=3)
+
+    expected = np.arange(40, dtype=np.float64)
+    expected[20:24] = np.nan
+    expected[:2] = np.nan
+    expected[38:] = np.nan
+    assert np.allclose(filled[0], expected, equal_nan=True)
+    assert np.isnan(filled[1]).all()
+    # The input is left as it is
+    assert np.isnan(flux[0, 5:8]).all()
+
+
+def test_clean_light_curves_flattens_the_variations():
+    rng = np.random.RandomState(3)
+    flux = make_flux(rng, length=4000) * 5000.
+    quality = np.zeros(flux.shape, dtype=np.int32)
+    quality[0, 50] = 32
+
+    cleaned = preprocessing.clean_light_curves(flux, quality, window=31, max_gap=0)
+
+    assert np.isnan(cleaned[0, 50])
+    assert np.isnan(cleaned[-1]).all()
+    assert abs(np.nanmedian(cleaned[:-1]) - 1.) < 1e-3
+    assert np.nanstd(cleaned[:-1]) < 2e-3
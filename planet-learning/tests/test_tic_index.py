@@ -0,0 +1,97 @@
+"""Tests of the columnar TIC index and of the compaction of its shards, against brute force"""
+from importlib import import_module
+from os.path import join
+
+import numpy as np
+import pytest
+
+shards = import_module("planet-learning.extracttic.shards")
+tic_index = import_module("planet-learning.extracttic.tic_index")
+
+
+def make_sectors(rng, n_sectors=4, n_objects=60):
+    # Each sector observes a random subset of the objects, with a few files that could not be read
+    sectors = {}
+    for sector in range(1, n_sectors + 1):
+        ticids = rng.choice(np.arange(1, 3 * n_objects), n_objects, replace=False)
+        rows = [(int(ticid), sector, 8, "tess-s{:04d}-{:016d}_lc.fits".format(sector, ticid), 1000 + int(ticid), 10 * int(ticid)) for ticid in ticids]
+        rows += [(tic_index.CORRUPTED, tic_index.CORRUPTED, tic_index.CORRUPTED, "corrupted_{}.fits".format(i), 0, 0) for i in range(2)]
+        sectors["sector_{}".format(sector)] = rows
+    return sectors
+
+
+def build_index(tmp_path, sectors, chunk_rows=shards.COMPACTION_CHUNK_ROWS, name='tic_index'):
+    index_path = join(str(tmp_path), name)
+    shards_path = shards.get_shards_path(index_path)
+    for (sector_dir, rows) in sectors.items():
+        shards.write_shard(join(shards_path, sector_dir), join("/data/light_curves", sector_dir), rows)
+    counts = shards.compact_shards(shards_path, list(sectors), index_path, chunk_rows=chunk_rows)
+    return tic_index.load_tic_index(index_path), counts
+
+
+def test_contains_and_lookup_match_brute_force(tmp_path):
+    sectors = make_sectors(np.random.RandomState(0))
+    (index, (n_light_curves, n_objects)) = build_index(tmp_path, sectors)
+
+    observations = {}
+    for (sector_dir, rows) in sectors.items():
+        for (ticid, sector, ticver, name, _, _) in rows:
+            if ticid != tic_index.CORRUPTED:
+                path = join("/data/light_curves", sector_dir, name)
+                observations.setdefault(ticid, []).append({'SECTOR': sector, 'TICVER': ticver, 'path': path})
+
+    assert n_light_curves == sum(len(value) for value in observations.values())
+    assert n_objects == len(observations)
+
+    queried = np.arange(-5, 200)
+    expected = np.array([ticid in observations for ticid in queried])
+    assert np.array_equal(index.contains(queried), expected)
+    assert [ticid in index for ticid in queried] == expected.tolist()
+
+    for ticid in queried:
+        assert index.lookup(ticid) == sorted(observations.get(int(ticid), []), key=lambda observation: observation['SECTOR'])
+
+
+def test_corrupted_files_are_not_observations(tmp_path):
+    (index, _) = build_index(tmp_path, make_sectors(np.random.RandomState(1)))
+
+    assert not index.contains([tic_index.CORRUPTED])[0]
+    assert index.lookup(tic_index.CORRUPTED) == []
+    assert sorted(index.corrupted_paths()) == sorted(
+        join("/data/light_curves", "sector_{}".format(sector), "corrupted_{}.fits".format(i)) for sector in range(1, 5) for i in range(2)
+    )
+
+
+def test_empty_index(tmp_path):
+    (index, counts) = build_index(tmp_path, {"sector_1": []})
+
+    assert counts == (0, 0)
+    assert len(index) == 0
+    assert not index.contains([1, 2]).any()
+    assert index.lookup(1) == []
+
+
+@pytest.mark.parametrize("chunk_rows", [1, 7, 50])
+def test_compaction_does_not_depend_on_the_chunks(tmp_path, chunk_rows):
+    sectors = make_sectors(np.random.RandomState(2))
+    (reference, reference_counts) = build_index(tmp_path, sectors, name='reference')
+    (index, counts) = build_index(tmp_path, sectors, chunk_rows=chunk_rows)
+
+    assert counts == reference_counts
+    for name in ('ticid', 'sector', 'ticver', 'directory', 'name_offsets', 'names'):
+        assert np.array_equal(getattr(index, name), getattr(reference, name))
+    # Sorted by TICID then sector
+    keys = np.asarray(index.ticid) * 100 + np.asarray(index.sector)
+    assert np.all(np.diff(keys) >= 0)
+    assert len(shards.get_chunk_bounds([index], chunk_rows)) > 1
+
+
+def test_shard_files_round_trip(tmp_path):
+    rows = make_sectors(np.random.RandomState(3), n_sectors=1)["sector_1"]
+    shard_path = join(str(tmp_path), "tic_index_shards", "sector_1")
+    shards.write_shard(shard_path, "/data/light_curves/sector_1", rows)
+
+    files = shards.load_shard_files(shard_path)
+
+    assert files == {join("/data/light_curves/sector_1", row[3]): row for row in rows}
+    assert shards.load_shard_files(join(str(tmp_path), "missing")) == {}
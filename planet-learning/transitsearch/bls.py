@@ -0,0 +1,281 @@
+import numpy as np
+
+"""
+transitsearch.bls searches periodic transits in a light curve with the Box Least Squares (BLS) method (Kovacs, Zucker & Mazeh 2002).
+
+For every trial period, the light curve is folded and binned in phase, and every box of every trial duration is slid along the phase :
+the box with the largest decrease of chi-square (the power) gives the epoch, duration and depth of the transit at this period.
+The trial periods are processed by batches, as 2-D arrays of one row per period : folding and binning are a single bincount,
+and the boxes of every start phase are differences of a cumulative sum. The light curve is first binned in time at a fraction of the
+shortest duration, which keeps the statistics of the samples while dividing their number.
+"""
+
+#Trial durations of the transits, in days (1 to 12 hours)
+DEFAULT_DURATIONS = np.array([1, 1.5, 2, 3, 4, 6, 8, 12]) / 24.
+#Shortest trial period, in days
+DEFAULT_MIN_PERIOD = 0.5
+#Number of time and phase bins per shortest duration
+DEFAULT_OVERSAMPLE = 3
+#Number of frequency steps over which the last transit moves by the shortest duration
+DEFAULT_PERIOD_OVERSAMPLE = 1
+#Largest number of trial periods of a light curve : beyond it the frequency step is widened (multi-year stitched light curves)
+DEFAULT_MAX_PERIODS = 200000
+#Maximum fraction of the period covered by a transit
+MAX_DUTY_CYCLE = 0.25
+#Minimum number of samples in transit
+MIN_SAMPLES_IN_TRANSIT = 3
+#Periods closer than this relative difference belong to the same peak of the periodogram
+PEAK_WIDTH = 0.01
+
+def period_grid(baseline, min_period=DEFAULT_MIN_PERIOD, max_period=None, min_duration=DEFAULT_DURATIONS[0], oversample=DEFAULT_PERIOD_OVERSAMPLE,
+                max_periods=DEFAULT_MAX_PERIODS):
+    """
+    Builds the trial periods, evenly spaced in frequency so that the transits move by a fraction of the shortest duration
+    from one period to the next (at most half of it with the default oversampling, as the periods are below half the baseline).
+    The number of periods grows with the square of the baseline : it is capped to max_periods by widening the frequency step,
+    in which case the transits may move by more than the shortest duration from one period to the next.
+
+    Parameters
+    ----------
+    baseline: float
+        the time span of the light curve, in days
+    min_period: float
+        the shortest period, in days
+    max_period: float
+        the longest period, in days. Defaults to half the baseline, to see at least 2 transits.
+    min_duration: float
+        the shortest trial duration, in days
+    oversample: int
+        the number of steps per shortest duration
+    max_periods: int
+        the largest number of periods, None not to cap it
+
+    Returns
+    -------
+    numpy.ndarray
+        the periods, in days, increasing
+    """
+    max_period = baseline / 2. if max_period is None else max_period
+    if max_period <= min_period:
+        return np.zeros(0)
+
+    frequency_step = min_duration / (oversample * baseline ** 2)
+    (min_frequency, max_frequency) = (1. / max_period, 1. / min_period)
+    if max_periods and (max_frequency - min_frequency) / frequency_step > max_periods:
+        frequency_step = (max_frequency - min_frequency) / max_periods
+    frequencies = np.arange(min_frequency, max_frequency, frequency_step)[:max_periods]
+    return np.sort(1. / frequencies)
+
+def bin_in_time(time, flux, bin_width):
+    """
+    Bins a light curve in time, keeping the number and sum of the mean-subtracted fluxes of each bin
+
+    Parameters
+    ----------
+    time: numpy.ndarray
+        the time stamps, in days
+    flux: numpy.ndarray
+        the fluxes, NaN for the missing samples
+    bin_width: float
+        the width of the bins, in days
+
+    Returns
+    -------
+    (numpy.ndarray, numpy.ndarray, numpy.ndarray, float)
+        the centers of the non-empty bins, their number of samples, their sum of mean-subtracted fluxes,
+        and the robust standard deviation of the samples (NaN if there are fewer than 2 samples)
+    """
+    valid = np.isfinite(time) & np.isfinite(flux)
+    time = np.asarray(time[valid], dtype=np.float64)
+    flux = np.asarray(flux[valid], dtype=np.float64)
+    if len(time) < 2:
+        return (np.zeros(0), np.zeros(0), np.zeros(0), np.nan)
+
+    residuals = flux - flux.mean()
+    sigma = 1.4826 * np.median(np.abs(residuals - np.median(residuals)))
+
+    bins = np.floor((time - time.min()) / bin_width).astype(np.int64)
+    counts = np.bincount(bins).astype(np.float64)
+    sums = np.bincount(bins, weights=residuals)
+    centers = time.min() + (np.arange(len(counts)) + 0.5) * bin_width
+
+    non_empty = counts > 0
+    return (centers[non_empty], counts[non_empty], sums[non_empty], sigma)
+
+def bls_power(time, counts, sums, sigma, periods, durations=DEFAULT_DURATIONS, oversample=DEFAULT_OVERSAMPLE, batch_size=256):
+    """
+    Computes the BLS periodogram of a binned light curve
+
+    Parameters
+    ----------
+    time: numpy.ndarray
+        the centers of the time bins, in days
+    counts: numpy.ndarray
+        the number of samples of the bins
+    sums: numpy.ndarray
+        the sum of the mean-subtracted fluxes of the bins
+    sigma: float
+        the standard deviation of the samples
+    periods: numpy.ndarray
+        the trial periods, in days
+    durations: numpy.ndarray
+        the trial durations, in days
+    oversample: int
+        the number of phase bins per shortest duration at the longest period
+    batch_size: int
+        the number of periods processed at once
+
+    Returns
+    -------
+    dict of numpy.ndarray
+        for each period, the best 'power' (decrease of chi-square), 'duration', 'epoch' (middle of the first transit, in days),
+        'depth' (in units of the fluxes) and 'snr' (signal to noise ratio of the depth)
+    """
+    periods = np.asarray(periods, dtype=np.float64)
+    durations = np.sort(np.asarray(durations, dtype=np.float64))
+    results = {name: np.zeros(len(periods)) for name in ('power', 'duration', 'epoch', 'depth', 'snr')}
+    total = counts.sum()
+    if len(periods) == 0 or total < 2 or not sigma > 0:
+        return results
+
+    #Sorting the periods, so that the periods of a batch need about the same number of phase bins
+    order = np.argsort(periods)
+    periods = periods[order]
+
+    for start in range(0, len(periods), batch_size):
+        batch = periods[start:start + batch_size]
+        n_periods = len(batch)
+
+        #Same number of phase bins for all the periods of the batch, fine enough for the shortest duration at the longest period
+        n_bins = int(np.ceil(batch[-1] / durations[0] * oversample))
+
+        #Folding and binning all the periods of the batch with a single bincount
+        #Fractional part of the number of cycles, floor being much faster than a floating-point modulo
+        cycles = time[None, :] * (1. / batch[:, None])
+        cycles -= np.floor(cycles)
+        cycles *= n_bins
+        phase_bins = cycles.astype(np.int64)
+        np.minimum(phase_bins, n_bins - 1, out=phase_bins)
+        phase_bins += np.arange(n_periods)[:, None] * n_bins
+        flat_bins = phase_bins.ravel()
+        binned_counts = np.bincount(flat_bins, weights=np.broadcast_to(counts, phase_bins.shape).ravel(), minlength=n_periods * n_bins).reshape(n_periods, n_bins)
+        binned_sums = np.bincount(flat_bins, weights=np.broadcast_to(sums, phase_bins.shape).ravel(), minlength=n_periods * n_bins).reshape(n_periods, n_bins)
+
+        #Cumulative sums over one and a half turn, so that the boxes can wrap around the phase
+        wrap = np.arange(n_bins + n_bins // 2) % n_bins
+        cumulated_counts = np.zeros((n_periods, len(wrap) + 1))
+        cumulated_sums = np.zeros((n_periods, len(wrap) + 1))
+        np.cumsum(binned_counts[:, wrap], axis=1, out=cumulated_counts[:, 1:])
+        np.cumsum(binned_sums[:, wrap], axis=1, out=cumulated_sums[:, 1:])
+
+        best_power = np.zeros(n_periods)
+        best = {name: np.zeros(n_periods) for name in ('duration', 'epoch', 'depth')}
+
+        for duration in durations:
+            allowed = duration <= MAX_DUTY_CYCLE * batch
+            if not allowed.any():
+                continue
+
+            #Width of the box in phase bins : the periods of a batch being close, they share a few widths
+            widths = np.clip(np.round(duration / batch * n_bins).astype(np.int64), 1, n_bins // 2)
+            for width in np.unique(widths[allowed]):
+                rows = np.flatnonzero(allowed & (widths == width))
+                n_in = cumulated_counts[rows, width:width + n_bins] - cumulated_counts[rows, :n_bins]
+                sum_in = cumulated_sums[rows, width:width + n_bins] - cumulated_sums[rows, :n_bins]
+
+                #Decrease of chi-square of a box, up to a constant factor, only for boxes darker than the rest of the light curve
+                power = np.zeros(n_in.shape)
+                np.divide(sum_in ** 2, n_in * (total - n_in), out=power, where=(sum_in < 0) & (n_in >= MIN_SAMPLES_IN_TRANSIT) & (n_in < total))
+
+                best_start = np.argmax(power, axis=1)
+                power = power[np.arange(len(rows)), best_start]
+                better = power > best_power[rows]
+                if not better.any():
+                    continue
+
+                (rows, best_start, power) = (rows[better], best_start[better], power[better])
+                (n_in, sum_in) = (n_in[better, best_start], sum_in[better, best_start])
+                best_power[rows] = power
+                best['duration'][rows] = duration
+                best['epoch'][rows] = (best_start + width / 2.) / n_bins * batch[rows]
+                best['depth'][rows] = -sum_in * total / (n_in * (total - n_in))
+
+        best['power'] = best_power * total / sigma ** 2
+        best['snr'] = np.sqrt(best['power'])
+
+        for (name, values) in best.items():
+            results[name][order[start:start + n_periods]] = values
+
+    return results
+
+def top_candidates(periods, results, top_k):
+    """
+    Picks the highest peaks of a periodogram, a peak being a set of neighbouring periods
+
+    Parameters
+    ----------
+    periods: numpy.ndarray
+        the trial periods, in days
+    results: dict of numpy.ndarray
+        the periodogram, as given by bls_power
+    top_k: int
+        the number of candidates
+
+    Returns
+    -------
+    list of dict
+        the candidates, by decreasing power : {'period', 'power', 'duration', 'epoch', 'depth', 'snr'}
+    """
+    candidates = []
+    for i in np.argsort(results['power'])[::-1]:
+        if len(candidates) == top_k or results['power'][i] <= 0:
+            break
+        if any(abs(periods[i] - candidate['period']) <= PEAK_WIDTH * candidate['period'] for candidate in candidates):
+            continue
+        candidate = {name: float(values[i]) for (name, values) in results.items()}
+        candidate['period'] = float(periods[i])
+        candidates.append(candidate)
+
+    return candidates
+
+def search_transits(time, flux, top_k=3, periods=None, period_range=(DEFAULT_MIN_PERIOD, None), durations=DEFAULT_DURATIONS,
+                    oversample=DEFAULT_OVERSAMPLE, batch_size=256, max_periods=DEFAULT_MAX_PERIODS):
+    """
+    Searches the periodic transits of a light curve
+
+    Parameters
+    ----------
+    time: numpy.ndarray
+        the time stamps, in days
+    flux: numpy.ndarray
+        the fluxes, normalized and detrended, NaN for the missing samples
+    top_k: int
+        the number of candidates
+    periods: numpy.ndarray
+        the trial periods, in days. Defaults to the grid given by period_grid for the baseline of the light curve.
+    period_range: (float, float or None)
+        the shortest and longest periods of the default grid, in days. None for half the baseline.
+    durations: numpy.ndarray
+        the trial durations, in days
+    oversample: int
+        the number of time and phase bins per shortest duration
+    batch_size: int
+        the number of periods processed at once
+    max_periods: int
+        the largest number of periods of the default grid, see period_grid
+
+    Returns
+    -------
+    list of dict
+        the candidates, by decreasing power : {'period', 'power', 'duration', 'epoch', 'depth', 'snr'}, the epoch being in the time stamps unit
+    """
+    durations = np.sort(np.asarray(durations, dtype=np.float64))
+    (binned_time, counts, sums, sigma) = bin_in_time(time, flux, durations[0] / oversample)
+    if len(binned_time) < 2:
+        return []
+
+    if periods is None:
+        periods = period_grid(binned_time[-1] - binned_time[0], period_range[0], period_range[1], min_duration=durations[0], max_periods=max_periods)
+
+    results = bls_power(binned_time, counts, sums, sigma, periods, durations, oversample, batch_size)
+    return top_candidates(np.asarray(periods, dtype=np.float64), results, top_k)
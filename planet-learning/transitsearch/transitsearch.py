@@ -0,0 +1,205 @@
+import logging
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from sqlalchemy import tuple_
+
+from ..catascript.base import Base, Session, dispose_engine, get_engine
+from ..catascript.models import Candidate, Catalog
+from ..fluxstore.store import load_flux_store
+from .bls import DEFAULT_DURATIONS, DEFAULT_MAX_PERIODS, DEFAULT_MIN_PERIOD, period_grid, search_transits
+
+"""
+transitsearch searches periodic transits in the light curves of all the TICs of the catalog, with the BLS engine of transitsearch.bls.
+The light curves are read from the cleaned flux store written by the preprocessing module, and searched in parallel processes.
+The best candidates of each light curve are stored in the candidate table, replacing those of a previous search.
+"""
+
+#Flux store and search options of a worker process
+_worker_store = None
+_worker_options = None
+
+def get_catalog_TICs():
+    """
+    Queries the TIC IDs of the catalog
+
+    Returns
+    -------
+    numpy.ndarray
+        the TIC IDs, sorted
+    """
+    session = Session()
+    try:
+        query = session.query(Catalog.ID).order_by(Catalog.ID).execution_options(stream_results=True).yield_per(10000)
+        return np.array([ID for (ID,) in query], dtype=np.int64)
+    finally:
+        session.close()
+
+def init_search_worker(store_path, options):
+    """
+    Initializes a search worker process by loading its own (memory-mapped) flux store
+
+    Parameters
+    ----------
+    store_path: str
+        path to the flux store
+    options: dict
+        the keyword arguments of search_transits
+    """
+    global _worker_store, _worker_options
+    _worker_store = load_flux_store(store_path)
+    _worker_options = options
+
+def run_search_worker(row):
+    """
+    Searches the transits of a light curve of the flux store, in a search worker process
+
+    Parameters
+    ----------
+    row: int
+        the row of the light curve in the flux store
+
+    Returns
+    -------
+    (int, int, float, list of dict)
+        the TIC ID, the sector, the first time stamp of the light curve and its candidates, as given by search_transits
+    """
+    (time_stamps, flux, _) = _worker_store.get_row(row)
+    candidates = search_transits(time_stamps, flux, **_worker_options)
+    return (int(_worker_store.ticid[row]), int(_worker_store.sector[row]), float(_worker_store.t0[row]), candidates)
+
+def save_candidates(results):
+    """
+    Replaces the candidates of the searched light curves in the database, in a single transaction.
+    A light curve is identified by its TIC and its sector : the candidates of the other sectors of a TIC are kept.
+
+    Parameters
+    ----------
+    results: list of tuple
+        the results of run_search_worker
+    """
+    rows = []
+    for (TIC, sector, t0, candidates) in results:
+        for (rank, candidate) in enumerate(candidates, 1):
+            rows.append(dict(candidate, catalog_id=TIC, SECTOR=sector, rank=rank, epoch=t0 + candidate['epoch']))
+
+    searched_light_curves = sorted(set((TIC, sector) for (TIC, sector, _, _) in results))
+    columns = Candidate.__table__.c
+    with get_engine().begin() as connection:
+        connection.execute(Candidate.__table__.delete().where(tuple_(columns.catalog_id, columns.SECTOR).in_(searched_light_curves)))
+        if rows:
+            connection.execute(Candidate.__table__.insert(), rows)
+
+def log_period_grid(store, rows, options):
+    """
+    Logs the number of trial periods of the longest light curve to search, which sets the cost of the search
+
+    Parameters
+    ----------
+    store: fluxstore.store.FluxStore
+        the flux store
+    rows: numpy.ndarray
+        the rows of the light curves to search
+    options: dict
+        the keyword arguments of search_transits
+    """
+    #Time span of the light curves, from their first and last samples
+    offsets = np.asarray(store.offsets)
+    (starts, stops) = (offsets[rows], offsets[rows + 1])
+    non_empty = stops > starts
+    if not non_empty.any():
+        return
+    samples_time = store.samples['time']
+    baselines = samples_time[stops[non_empty] - 1].astype(np.float64) - samples_time[starts[non_empty]]
+    baseline = float(np.nanmax(baselines)) if np.isfinite(baselines).any() else 0.
+
+    (min_period, max_period) = options.get("period_range", (DEFAULT_MIN_PERIOD, None))
+    durations = options.get("durations", DEFAULT_DURATIONS)
+    max_periods = options.get("max_periods", DEFAULT_MAX_PERIODS)
+    nb_periods = len(period_grid(baseline, min_period, max_period, min_duration=np.min(durations), max_periods=max_periods))
+    logging.info("Up to {} trial periods per light curve, for a time span of {:.1f} days".format(nb_periods, baseline))
+    if max_periods and nb_periods >= max_periods:
+        logging.warning("The trial periods are capped to TRANSIT_MAX_TRIAL_PERIODS={} : the longest light curves are searched with a coarser frequency step, "
+                        "raise TRANSIT_MIN_PERIOD or TRANSIT_MAX_TRIAL_PERIODS to search them fully".format(max_periods))
+
+def search_flux_store(store_path, options, n_workers=1, batch_size=1000):
+    """
+    Searches the transits of the light curves of the flux store whose TIC is in the catalog
+
+    Parameters
+    ----------
+    store_path: str
+        path to the cleaned flux store
+    options: dict
+        the keyword arguments of search_transits
+    n_workers: int
+        the number of light curves searched at once
+    batch_size: int
+        the minimum number of light curves whose candidates are saved at once
+    """
+    store = load_flux_store(store_path)
+    TIC_IDs = get_catalog_TICs()
+    rows = np.flatnonzero(np.isin(np.asarray(store.ticid), TIC_IDs))
+    nb_rows = len(rows)
+    logging.info("Searching transits in {} light curves with {} workers".format(nb_rows, n_workers))
+    log_period_grid(store, rows, options)
+
+    Base.metadata.create_all(get_engine(), tables=[Candidate.__table__])
+    #The connections opened so far must not be shared with the workers
+    dispose_engine()
+
+    start = time.time()
+    batch = []
+    with ProcessPoolExecutor(max_workers=max(n_workers, 1), initializer=init_search_worker, initargs=(store_path, options)) as executor:
+        #Results in the order of the rows, sorted by TIC : the candidates of a TIC are saved together
+        for (nb_done, result) in enumerate(executor.map(run_search_worker, rows, chunksize=8), 1):
+            if len(batch) >= batch_size and batch[-1][0] != result[0]:
+                save_candidates(batch)
+                batch = []
+                duration = time.time() - start
+                logging.info("Progress : {}/{} light curves searched ({:.1f} light curves/s)".format(nb_done - 1, nb_rows, (nb_done - 1) / max(duration, 1e-6)))
+            batch.append(result)
+
+    if batch:
+        save_candidates(batch)
+
+    logging.info("Transit search of {} light curves done in {:.1f} s".format(nb_rows, time.time() - start))
+
+def get_search_options():
+    """
+    Reads the options of the search in the configuration
+
+    Returns
+    -------
+    dict
+        the keyword arguments of search_transits
+    """
+    options = {"top_k": int(os.getenv("TRANSIT_SEARCH_TOP_K", 3))}
+
+    durations_hours = os.getenv("TRANSIT_DURATIONS_HOURS")
+    durations = np.array([float(value) for value in durations_hours.split(",")]) / 24. if durations_hours else DEFAULT_DURATIONS
+    options["durations"] = durations
+
+    min_period = float(os.getenv("TRANSIT_MIN_PERIOD", DEFAULT_MIN_PERIOD))
+    max_period = os.getenv("TRANSIT_MAX_PERIOD")
+    options["period_range"] = (min_period, float(max_period) if max_period else None)
+    options["max_periods"] = int(os.getenv("TRANSIT_MAX_TRIAL_PERIODS", DEFAULT_MAX_PERIODS))
+
+    return options
+
+def transitsearch(store_path):
+    """
+    Searches the transits of the light curves of the catalog if asked in the configuration
+
+    Parameters
+    ----------
+    store_path: str
+        path to the cleaned flux store
+    """
+    if not int(os.getenv("TRANSIT_SEARCH", 0)):
+        logging.info("Not searching transits")
+        return
+
+    search_flux_store(store_path, get_search_options(), int(os.getenv("TRANSIT_SEARCH_WORKERS", 1)), int(os.getenv("DB_BATCH_SIZE", 1000)))